@@ -1,6 +1,9 @@
 from fyers_api import fyersModel
 from fyers_api import accessToken
 import os
+import logs
+import metrics
+import threading
 import webbrowser
 
 APP_ID = "JBGZVR59OA-100"
@@ -9,45 +12,75 @@ REDIRECT_URI = "https://www.google.com/"
 RESPONSE_TYPE = "code"
 GRANT_TYPE = "authorization_code"
 
+logger = logs.get_logger("access_token")
+
+_fyers_client = None
+_fyers_client_lock = threading.Lock()
+
 
 # Authentication of the APP from the FYERS Server
+@metrics.timed("access_token.get_access_token")
 def get_access_token():
     """
     Authentication of the APP from the FYERS Server
     :return:
     """
-    print("\n\nRetrieving: Access Token from FYERS Server")
+    logger.info("Retrieving: Access Token from FYERS Server")
     if not os.path.exists("access_token.txt"):
         session = accessToken.SessionModel(client_id=APP_ID, secret_key=SECRET_KEY, redirect_uri=REDIRECT_URI,
                                            response_type=RESPONSE_TYPE, grant_type=GRANT_TYPE)
         response = session.generate_authcode()
-        print(response)
-        print("open")
+        logger.info("Open %s and log in to get the Auth Code", response, extra={"event": "auth_code_url"})
         webbrowser.open(response)
-        auth_code = input("1. Enter Auth Code: ")
+        # the prompt carries the login page, so it is shown whatever the log level
+        auth_code = input(f"Open {response}, log in and enter the Auth Code: ")
         session.set_token(auth_code)
         access_token = session.generate_token()["access_token"]
-        print("2. Creating Access Token text file.")
         with open("access_token.txt", "w") as f:
             f.write(access_token)
-        print("3. Access Token file created")
-        print("Retrieved: Access Token from Server\n")
+        logger.info("Retrieved: Access Token from Server, access_token.txt created", extra={"event": "access_token"})
     else:
-        print("1. Retrieving: Access Token from local file")
         with open("access_token.txt", "r") as f:
             access_token = f.read()
-        print("Retrieved: Access Token from file\n")
+        logger.info("Retrieved: Access Token from file", extra={"event": "access_token"})
     return access_token
 
 
 # Retrieving Access Token to have an ENTRY POINT in the project
 def get_fyers_entry_point():
     """
-    Retrieving Access Token to have an ENTRY POINT in the project
+    Retrieving Access Token to have an ENTRY POINT in the project, built once and shared by every caller
     :return: fyers key
     """
-    fyers = fyersModel.FyersModel(client_id=APP_ID, token=get_access_token(), log_path="")
-    return fyers
+    global _fyers_client
+    client = _fyers_client
+    if client is None:
+        with _fyers_client_lock:
+            if _fyers_client is None:
+                token = get_access_token()
+                with metrics.span("access_token.client"):
+                    _fyers_client = fyersModel.FyersModel(client_id=APP_ID, token=token, log_path="")
+            client = _fyers_client
+    return client
 
 
+def set_fyers_entry_point(client):
+    """
+    Replaces the shared client, tests use it to pass in a local stub
+    :param client: object with the FyersModel methods we call
+    """
+    global _fyers_client
+    with _fyers_client_lock:
+        _fyers_client = client
 
+
+def reset_fyers_entry_point(token_expired=False):
+    """
+    Drops the shared client so the next call builds a new one
+    :param token_expired: True also deletes access_token.txt, so a fresh token is generated from the server
+    """
+    global _fyers_client
+    with _fyers_client_lock:
+        _fyers_client = None
+        if token_expired and os.path.exists("access_token.txt"):
+            os.remove("access_token.txt")
@@ -0,0 +1,477 @@
+import repository
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the trade loop runs as plain Python without it
+    njit = None
+
+TRADE_LEDGER_DTYPE = np.dtype([
+    ("entry_index", np.int64),  # candle where the breakout was seen, the buy fills at the next CLOSE
+    ("entry_price", np.float64),
+    ("stop_loss", np.float64),
+    ("target", np.float64),
+    ("exit_index", np.int64),  # candle where the exit was seen, the sell fills at the next CLOSE
+    ("exit_price", np.float64),
+    ("pnl", np.float64),
+    ("stop_loss_hit", np.bool_),
+])
+
+# FYERS order types, the "type" of create_buy_data / create_sell_data
+LIMIT_ORDER = 1
+MARKET_ORDER = 2
+STOP_ORDER = 3  # SL-M, a market order once the stop price trades
+STOP_LIMIT_ORDER = 4  # SL-L, a limit order at limitPrice once the stop price trades
+
+BUY_SIDE = 1
+SELL_SIDE = -1
+
+# within one candle market orders fill first at the OPEN, then stops, then limits; the candle does not tell
+# whether its HIGH or LOW came first, so a stop loss and a target touched together fill the stop loss
+_ORDER_PRIORITY = {MARKET_ORDER: 0, STOP_ORDER: 1, STOP_LIMIT_ORDER: 1, LIMIT_ORDER: 2}
+
+FILL_LEDGER_DTYPE = np.dtype([
+    ("index", np.int64),  # candle the order filled in
+    ("order_id", np.int64),
+    ("side", np.int8),
+    ("qty", np.int64),
+    ("price", np.float64),
+    ("pnl", np.float64),  # realised by this fill, 0 when it opens or adds to the position
+])
+
+
+def _ema_trades_loop(low, close, breakout, exit_allowed, rr_ratio_changer):
+    """
+    Walks the precomputed signals once and pairs every entry with its exit (numba compiles this when installed)
+    :param low: LOW values
+    :param close: CLOSE values
+    :param breakout: True where EMA is above the HIGH and the next CLOSE breaks that HIGH
+    :param exit_allowed: False where EMA is above the HIGH, the strategy does not look at exits there
+    :param rr_ratio_changer: target is buy value + (buy value - stop loss) * rr_ratio_changer
+    :return: entry indices, exit indices, stop loss hit flags, True if a position is still open
+    """
+    n = len(close)
+    entries = np.empty(n // 2 + 1, dtype=np.int64)
+    exits = np.empty(n // 2 + 1, dtype=np.int64)
+    stop_loss_hits = np.empty(n // 2 + 1, dtype=np.bool_)
+    trade_count = 0
+    in_position = False
+    entry_index = 0
+    stop_loss = 0.0
+    target = 0.0
+
+    for i in range(n):
+        if not in_position:
+            if breakout[i]:
+                in_position = True
+                entry_index = i
+                buy_value = close[i + 1]
+                stop_loss = min(low[i], low[i + 1])
+                target = buy_value + ((buy_value - stop_loss) * rr_ratio_changer)
+        elif exit_allowed[i] and (close[i] < stop_loss or close[i] >= target):
+            if i == n - 1:
+                # no candle left to sell at
+                break
+            entries[trade_count] = entry_index
+            exits[trade_count] = i
+            stop_loss_hits[trade_count] = close[i] < stop_loss
+            trade_count += 1
+            in_position = False
+
+    return entries[:trade_count], exits[:trade_count], stop_loss_hits[:trade_count], in_position
+
+
+_ema_trades_jit = njit(cache=True)(_ema_trades_loop) if njit is not None else None
+
+
+def run_ema_backtest(high_values, low_values, close_values, ema_values, rr_ratio_changer, stock_length=None):
+    """
+    Backtests the EMA breakout strategy of repository.ema_initializer with array signals and returns the trades
+    :param high_values: HIGH values
+    :param low_values: LOW values
+    :param close_values: CLOSE values
+    :param ema_values: EMA of the CLOSE values
+    :param rr_ratio_changer: target is buy value + (buy value - stop loss) * rr_ratio_changer
+    :param stock_length: number of candles the strategy may trade on, defaults to all of them
+    :return: trade ledger (TRADE_LEDGER_DTYPE array), summary dictionary
+    """
+    high = np.asarray(high_values, dtype=np.float64)
+    low = np.asarray(low_values, dtype=np.float64)
+    close = np.asarray(close_values, dtype=np.float64)
+    ema = np.asarray(ema_values, dtype=np.float64)
+    n = len(close)
+    tradable = max((n if stock_length is None else min(stock_length, n)) - 1, 0)
+
+    # while EMA is above the HIGH the strategy only looks for entries, exits are checked on every other candle
+    ema_above_high = np.zeros(n, dtype=np.bool_)
+    ema_above_high[:tradable] = ema[:tradable] > high[:tradable]
+    breakout = np.zeros(n, dtype=np.bool_)
+    breakout[:-1] = ema_above_high[:-1] & (close[1:] > high[:-1])
+    exit_allowed = ~ema_above_high
+
+    if _ema_trades_jit is not None:
+        entries, exits, stop_loss_hits, open_position = _ema_trades_jit(low, close, breakout, exit_allowed,
+                                                                          float(rr_ratio_changer))
+    else:
+        entries, exits, stop_loss_hits, open_position = _ema_trades_loop(
+            low.tolist(), close.tolist(), breakout.tolist(), exit_allowed.tolist(), float(rr_ratio_changer))
+
+    ledger = np.empty(len(entries), dtype=TRADE_LEDGER_DTYPE)
+    ledger["entry_index"] = entries
+    ledger["entry_price"] = close[entries + 1]
+    ledger["stop_loss"] = np.minimum(low[entries], low[entries + 1])
+    ledger["target"] = ledger["entry_price"] + ((ledger["entry_price"] - ledger["stop_loss"]) * rr_ratio_changer)
+    ledger["exit_index"] = exits
+    ledger["exit_price"] = close[exits + 1]
+    ledger["pnl"] = ledger["exit_price"] - ledger["entry_price"]
+    ledger["stop_loss_hit"] = stop_loss_hits
+
+    summary = {
+        "trade_count": len(ledger),
+        "final_pnl": float(ledger["pnl"].sum()),
+        "stop_loss_count": int(ledger["stop_loss_hit"].sum()),
+        "win_count": int((ledger["pnl"] > 0).sum()),
+        "open_position": bool(open_position),
+    }
+    return ledger, summary
+
+
+class _Order:
+    """
+    A working order of the event backtest, made from a create_buy_data / create_sell_data dictionary
+    """
+    __slots__ = ("order_id", "side", "qty", "type", "limit_price", "stop_price", "triggered", "data")
+
+    def __init__(self, order_id, order_data):
+        self.order_id = order_id
+        self.side = int(order_data["side"])
+        self.qty = int(order_data["qty"])
+        self.type = int(order_data["type"])
+        self.limit_price = float(order_data.get("limitPrice") or 0)
+        self.stop_price = float(order_data.get("stopPrice") or 0)
+        self.triggered = False
+        self.data = order_data
+
+
+class EventBacktest:
+    """
+    Replays candles one by one and fills the orders a strategy places against the HIGH and LOW of the candles
+    that follow, with slippage on market and stop fills and a share of the candle VOLUME as the most that can
+    fill per candle
+
+    The strategy is an object with three methods:
+        signals(backtest) -> bool array, on_bar is only called on the candles where it is True
+        on_bar(backtest, index) -> places orders after the candle at index closed
+        on_fill(backtest, order_id, index, price, qty) -> called for every fill, also partial ones
+    Orders placed in on_bar or on_fill work from the next candle on.
+    """
+
+    def __init__(self, open_values, high_values, low_values, close_values, volume_values=None,
+                 funds=repository.FUNDS, slippage=0.0, volume_share=None):
+        """
+        :param open_values: OPEN values
+        :param high_values: HIGH values
+        :param low_values: LOW values
+        :param close_values: CLOSE values
+        :param volume_values: VOLUME values, needed with volume_share
+        :param funds: money the backtest starts with
+        :param slippage: fraction of the price lost on every market and stop fill, 0.0005 is 5 basis points
+        :param volume_share: most of a candle's VOLUME one order can fill, None fills any quantity at once
+        """
+        self.open = np.asarray(open_values, dtype=np.float64)
+        self.high = np.asarray(high_values, dtype=np.float64)
+        self.low = np.asarray(low_values, dtype=np.float64)
+        self.close = np.asarray(close_values, dtype=np.float64)
+        if volume_share is not None and volume_values is None:
+            raise ValueError("volume_share needs volume_values")
+        self.volume = None if volume_values is None else np.asarray(volume_values, dtype=np.float64)
+        self.funds = funds
+        self.slippage = slippage
+        self.volume_share = volume_share
+
+        self.orders = {}  # order ID -> working or pending _Order
+        self.working = []  # orders matched against the current candle, in _ORDER_PRIORITY order
+        self.pending = []  # orders placed during the current candle, they work from the next one
+        self.next_order_id = 1
+        self.position = 0
+        self.average_price = 0.0
+        self.realised_pnl = 0.0
+        self.trade_pnl = 0.0  # realised since the position was last flat
+        self.trade_pnls = []  # one value per round trip back to flat
+        self.fills = []
+        self.strategy = None
+
+    @property
+    def equity(self):
+        """
+        :return: funds plus the realised PnL
+        """
+        return self.funds + self.realised_pnl
+
+    def submit(self, order_data: dict):
+        """
+        Places an order, it works from the next candle on
+        :param order_data: dictionary made by repository.create_buy_data or create_sell_data
+        :return: order ID
+        """
+        order = _Order(self.next_order_id, order_data)
+        if order.type not in _ORDER_PRIORITY:
+            raise ValueError(f"Unknown order type {order.type}")
+        if order.qty <= 0:
+            raise ValueError(f"Order quantity must be positive, got {order.qty}")
+        self.next_order_id += 1
+        self.orders[order.order_id] = order
+        self.pending.append(order)
+        return order.order_id
+
+    def modify(self, order_id: int, qty=None, limit_price=None, stop_price=None):
+        """
+        Changes a working order, a quantity of 0 cancels it
+        :param order_id: ID returned by submit
+        :param qty: new quantity still to fill
+        :param limit_price: new limit price
+        :param stop_price: new stop price
+        """
+        order = self.orders[order_id]
+        if qty is not None:
+            if qty <= 0:
+                self.cancel(order_id)
+                return
+            order.qty = int(qty)
+        if limit_price is not None:
+            order.limit_price = float(limit_price)
+        if stop_price is not None:
+            order.stop_price = float(stop_price)
+
+    def cancel(self, order_id: int):
+        """
+        Cancels an order that has not filled completely, the filled part stays
+        :param order_id: ID returned by submit
+        """
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            order.qty = 0
+
+    def is_working(self, order_id) -> bool:
+        """
+        :param order_id: ID returned by submit or None
+        :return: True while the order is neither filled nor cancelled
+        """
+        return order_id in self.orders
+
+    def _fill_price(self, order, open_value, high, low):
+        """
+        Price the order fills at in this candle, gaps through the limit or stop price fill at the OPEN
+        :return: price or None when the order does not fill
+        """
+        side = order.side
+        if order.type == MARKET_ORDER:
+            return open_value * (1 + side * self.slippage)
+        if not order.triggered and order.type != LIMIT_ORDER:
+            stop = order.stop_price
+            if side == BUY_SIDE:
+                if high < stop:
+                    return None
+                trigger_price = open_value if open_value > stop else stop
+            else:
+                if low > stop:
+                    return None
+                trigger_price = open_value if open_value < stop else stop
+            if order.type == STOP_ORDER:
+                return trigger_price * (1 + side * self.slippage)
+            # a triggered SL-L order is a limit order from here on, it may fill within the same candle
+            order.triggered = True
+            open_value = trigger_price
+        limit = order.limit_price
+        if side == BUY_SIDE:
+            if low > limit:
+                return None
+            return open_value if open_value < limit else limit
+        if high < limit:
+            return None
+        return open_value if open_value > limit else limit
+
+    def _apply_fill(self, index, order, price, qty):
+        """
+        Updates the position and the PnL with one fill and tells the strategy
+        """
+        signed_qty = order.side * qty
+        pnl = 0.0
+        position = self.position
+        if position and (position > 0) != (signed_qty > 0):
+            closed = min(abs(position), qty)
+            pnl = (price - self.average_price) * closed * (1 if position > 0 else -1)
+            self.realised_pnl += pnl
+            self.trade_pnl += pnl
+            if qty > abs(position):
+                self.average_price = price  # went through flat into the other side
+        else:
+            self.average_price = (self.average_price * abs(position) + price * qty) / (abs(position) + qty)
+        self.position = position + signed_qty
+        if self.position == 0 or (position and (position > 0) != (self.position > 0)):
+            self.trade_pnls.append(self.trade_pnl)
+            self.trade_pnl = 0.0
+            if self.position == 0:
+                self.average_price = 0.0
+
+        order.qty -= qty
+        if order.qty == 0:
+            self.orders.pop(order.order_id, None)
+        self.fills.append((index, order.order_id, order.side, qty, price, pnl))
+        self.strategy.on_fill(self, order.order_id, index, price, qty)
+
+    def _match(self, index):
+        """
+        Fills the working orders the candle at index reaches
+        """
+        if self.pending:
+            self.working.extend(self.pending)
+            self.pending = []
+            self.working.sort(key=lambda order: (_ORDER_PRIORITY[order.type], order.order_id))
+        open_value, high, low = self._open[index], self._high[index], self._low[index]
+        available = None if self.volume_share is None else int(self._volume[index] * self.volume_share)
+        for order in self.working:
+            # on_fill may have cancelled or shrunk an order that comes later in this candle
+            if order.qty == 0:
+                continue
+            price = self._fill_price(order, open_value, high, low)
+            if price is None:
+                continue
+            qty = order.qty
+            if available is not None:
+                qty = min(qty, available)
+                if qty <= 0:
+                    break
+                available -= qty
+            self._apply_fill(index, order, price, qty)
+        self.working = [order for order in self.working if order.qty]
+
+    def run(self, strategy, start=0):
+        """
+        Replays the candles from start on
+        :param strategy: object with signals, on_bar and on_fill methods
+        :param start: first candle replayed
+        :return: fill ledger (FILL_LEDGER_DTYPE array), summary dictionary
+        """
+        self.strategy = strategy
+        # plain lists, indexing them in the loop is much cheaper than indexing numpy arrays
+        self._open, self._high, self._low = self.open.tolist(), self.high.tolist(), self.low.tolist()
+        self._volume = None if self.volume is None else self.volume.tolist()
+        signals = np.asarray(strategy.signals(self), dtype=np.bool_)
+        signal_indices = np.flatnonzero(signals[start:]) + start
+
+        index = start
+        n = len(self.close)
+        for signal_index in signal_indices.tolist() + [n]:
+            # no strategy call between signals, candles are only looked at while orders work
+            while index < signal_index:
+                if not self.orders:
+                    self.working = []
+                    index = signal_index
+                    break
+                self._match(index)
+                index += 1
+            if signal_index == n:
+                break
+            if self.orders:
+                self._match(index)
+            strategy.on_bar(self, index)
+            index += 1
+
+        fills = np.array(self.fills, dtype=FILL_LEDGER_DTYPE)
+        trade_pnls = np.array(self.trade_pnls, dtype=np.float64)
+        summary = {
+            "trade_count": len(trade_pnls),
+            "fill_count": len(fills),
+            "final_pnl": self.realised_pnl,
+            "win_count": int((trade_pnls > 0).sum()),
+            "open_position": self.position,
+            "equity": self.equity,
+        }
+        return fills, summary
+
+
+class EMABreakoutStrategy:
+    """
+    The EMA breakout of repository.ema_initializer as orders: a candle closing above the HIGH of a candle that
+    had the EMA above it buys at the next OPEN with repository.quantity shares, then a stop loss below the two
+    candles and a target at rr_ratio_changer times the risk are worked; with fix_rr half the position is sold at
+    fix_rr times the risk and the stop loss moves to the buy price (the RR method-2 of ema_initializer)
+    """
+
+    def __init__(self, ema_values, rr_ratio_changer, fix_rr=None, risk_per_trade=repository.RISK_PER_TRADE,
+                 symbol="", product_type="INTRADAY"):
+        """
+        :param ema_values: EMA of the CLOSE values
+        :param rr_ratio_changer: target is buy value + (buy value - stop loss) * rr_ratio_changer
+        :param fix_rr: half the position is sold at buy value + (buy value - stop loss) * fix_rr, None sells all
+            at the target
+        :param risk_per_trade: most money lost when the stop loss is hit
+        :param symbol: symbol written into the order dictionaries
+        :param product_type: CNC, MIS, INTRADAY
+        """
+        self.ema_values = ema_values
+        self.rr_ratio_changer = rr_ratio_changer
+        self.fix_rr = fix_rr
+        self.risk_per_trade = risk_per_trade
+        self.symbol = symbol
+        self.product_type = product_type
+        self.entry_id = None
+        self.stop_loss_id = None
+        self.target_id = None
+        self.half_target_id = None
+        self.stop_loss = 0.0
+
+    def signals(self, backtest):
+        ema = np.asarray(self.ema_values, dtype=np.float64)
+        signals = np.zeros(len(backtest.close), dtype=np.bool_)
+        signals[1:] = (ema[:-1] > backtest.high[:-1]) & (backtest.close[1:] > backtest.high[:-1])
+        return signals
+
+    def _order(self, type, qty, side, limit_price=0, stop_price=0):
+        if side == BUY_SIDE:
+            return repository.create_buy_data(self.symbol, type, qty, side, self.product_type, limit_price,
+                                              stop_price)
+        return repository.create_sell_data(self.symbol, type, qty, side, self.product_type, limit_price,
+                                           stop_price)
+
+    def on_bar(self, backtest, index):
+        if backtest.position or backtest.is_working(self.entry_id):
+            return
+        buy_value = backtest.close[index]
+        stop_loss = min(backtest.low[index - 1], backtest.low[index])
+        qty = repository.quantity(backtest.equity, stop_loss, buy_value, self.risk_per_trade)
+        if qty < 1:
+            return
+        self.stop_loss = stop_loss
+        self.stop_loss_id = self.target_id = self.half_target_id = None
+        self.entry_id = backtest.submit(self._order(MARKET_ORDER, qty, BUY_SIDE))
+
+    def on_fill(self, backtest, order_id, index, price, qty):
+        position = backtest.position
+        if order_id == self.entry_id:
+            if self.stop_loss_id is None:
+                risk = price - self.stop_loss
+                self.stop_loss_id = backtest.submit(self._order(STOP_ORDER, position, SELL_SIDE,
+                                                                stop_price=self.stop_loss))
+                self.target_id = backtest.submit(self._order(LIMIT_ORDER, position, SELL_SIDE,
+                                                             limit_price=price + risk * self.rr_ratio_changer))
+                if self.fix_rr is not None and position >= 2:
+                    self.half_target_id = backtest.submit(self._order(LIMIT_ORDER, position // 2, SELL_SIDE,
+                                                                      limit_price=price + risk * self.fix_rr))
+            else:
+                # the entry filled in parts, the exits grow with the position
+                backtest.modify(self.stop_loss_id, qty=position)
+                backtest.modify(self.target_id, qty=position)
+                if backtest.is_working(self.half_target_id):
+                    backtest.modify(self.half_target_id, qty=position // 2)
+            return
+
+        if order_id == self.half_target_id:
+            backtest.modify(self.stop_loss_id, stop_price=backtest.average_price)
+        if position <= 0:
+            backtest.cancel(self.entry_id)
+        # the exits left never sell more than the position
+        for exit_id in (self.stop_loss_id, self.target_id, self.half_target_id):
+            if backtest.is_working(exit_id):
+                backtest.modify(exit_id, qty=min(backtest.orders[exit_id].qty, max(position, 0)))
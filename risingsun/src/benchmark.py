@@ -0,0 +1,780 @@
+import os
+import sys
+import json
+import datetime
+import itertools
+import time
+import logging
+import tracemalloc
+import metrics
+import indicator_cache
+import daemon
+import resample
+import session_calendar
+import backtest
+import walk_forward
+import live_feed
+import order_book
+import risk_engine
+import argparse
+import repository
+import matrix_indicators
+import numpy as np
+import pandas as pd
+
+SUITE_SIZES = (1_000, 100_000, 1_000_000)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+REGRESSION_TOLERANCE = 0.25  # fraction of throughput a case may lose, or of peak memory it may gain
+
+
+def generate_ohlc(bars: int, volatility=0.002, start_price=1000.0, seed=7):
+    """
+    Generates a random walk of candles for benchmarking
+    :param bars: number of candles
+    :param volatility: standard deviation of the close to close return
+    :param start_price: first OPEN value
+    :param seed: seed of the random generator, so every run sees the same candles
+    :return: dictionary of OPEN, HIGH, LOW, CLOSE NumPy arrays
+    """
+    rng = np.random.default_rng(seed)
+    close = start_price * np.exp(np.cumsum(rng.normal(0.0, volatility, bars)))
+    open_ = np.empty(bars)
+    open_[0] = start_price
+    open_[1:] = close[:-1]
+    wick = np.abs(rng.normal(0.0, volatility / 2, (2, bars))) * close
+    high = np.maximum(open_, close) + wick[0]
+    low = np.minimum(open_, close) - wick[1]
+    return {"OPEN": open_, "HIGH": high, "LOW": low, "CLOSE": close}
+
+
+def generate_history_response(bars: int, resolution=5, start_epoch=1672544700, volatility=0.002):
+    """
+    Builds a dictionary shaped like the FYERS history() response
+    :param bars: number of candles
+    :param resolution: minutes per candle
+    :param start_epoch: EPOCH of the first candle
+    :param volatility: standard deviation of the close to close return
+    :return: {"s": "ok", "candles": [[epoch, open, high, low, close, volume], ...]}
+    """
+    candles = generate_ohlc(bars, volatility)
+    epochs = start_epoch + np.arange(bars) * resolution * 60
+    volume = np.random.default_rng(11).integers(100, 100000, bars)
+    rows = zip(epochs.tolist(), candles["OPEN"].tolist(), candles["HIGH"].tolist(), candles["LOW"].tolist(),
+               candles["CLOSE"].tolist(), volume.tolist())
+    return {"s": "ok", "candles": [list(row) for row in rows]}
+
+
+def legacy_parse_candles(entire_stock_data):
+    """
+    The original candle loop of entry_point.py, kept as the reference for the ingestion benchmark
+    :param entire_stock_data: FYERS history() response
+    :return: Dataframe with HIGH, LOW, CLOSE columns
+    """
+    EPOCH_VALUES, OPEN_VALUES, HIGH_VALUES, LOW_VALUES, CLOSE_VALUES = [], [], [], [], []
+    for i in range(len((entire_stock_data)["candles"])):
+        EPOCH_VALUES.append((entire_stock_data)["candles"][i][0])
+        OPEN_VALUES.append((entire_stock_data)["candles"][i][1])
+        HIGH_VALUES.append((entire_stock_data)["candles"][i][2])
+        LOW_VALUES.append((entire_stock_data)["candles"][i][3])
+        CLOSE_VALUES.append((entire_stock_data)["candles"][i][4])
+
+    return pd.DataFrame(
+        {"HIGH": repository.list_to_numpy_array(HIGH_VALUES), "LOW": repository.list_to_numpy_array(LOW_VALUES),
+         "CLOSE": repository.list_to_numpy_array(CLOSE_VALUES)})
+
+
+def legacy_get_supertrend(df, atr_period, multiplier):
+    """
+    The original per-bar pandas implementation of get_supertrend, kept as the reference for equivalence checks
+    :param df: Dataframe with HIGH, LOW, CLOSE columns
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: Supertrend, Final Lowerband, Final Upperband Dataframe
+    """
+    high = df['HIGH']
+    low = df['LOW']
+    close = df['CLOSE']
+
+    price_diffs = [high - low,
+                   high - close.shift(),
+                   close.shift() - low]
+    true_range = pd.concat(price_diffs, axis=1)
+    true_range = true_range.abs().max(axis=1)
+    atr = true_range.ewm(alpha=1 / atr_period, min_periods=atr_period).mean()
+    hl2 = (high + low) / 2
+    final_upperband = hl2 + (multiplier * atr)
+    final_lowerband = hl2 - (multiplier * atr)
+    supertrend = [True] * len(df)
+
+    for i in range(1, len(df.index)):
+        curr, prev = i, i - 1
+        if close[curr] > final_upperband[prev]:
+            supertrend[curr] = True
+        elif close[curr] < final_lowerband[prev]:
+            supertrend[curr] = False
+        else:
+            supertrend[curr] = supertrend[prev]
+            if supertrend[curr] == True and final_lowerband[curr] < final_lowerband[prev]:
+                final_lowerband[curr] = final_lowerband[prev]
+            if supertrend[curr] == False and final_upperband[curr] > final_upperband[prev]:
+                final_upperband[curr] = final_upperband[prev]
+        if supertrend[curr] == True:
+            final_upperband[curr] = np.nan
+        else:
+            final_lowerband[curr] = np.nan
+
+    return pd.DataFrame({
+        'Supertrend': supertrend,
+        'Final Lowerband': final_lowerband,
+        'Final Upperband': final_upperband
+    }, index=df.index)
+
+
+class VirtualClock:
+    """
+    Clock whose sleep only moves the time forward, so a trading day runs in a moment
+    """
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
+
+
+class SessionHistoryClient:
+    """
+    FYERS style history() over prepared candles that only returns bars closed by the virtual clock, a few bars
+    show up one retry late
+    """
+
+    def __init__(self, candles, clock, step: int, late_epochs=()):
+        self.candles = candles
+        self.clock = clock
+        self.step = step
+        self.late_epochs = set(late_epochs)
+        self.requests = []  # number of candles returned by every call
+
+    def history(self, data):
+        candles = [candle for candle in self.candles
+                   if data["range_from"] <= candle[0] <= data["range_to"]
+                   and session_calendar.next_bar_close(candle[0], self.step) <= self.clock.time()]
+        late = {candle[0] for candle in candles} & self.late_epochs
+        self.late_epochs -= late
+        candles = [candle for candle in candles if candle[0] not in late]
+        self.requests.append(len(candles))
+        return {"s": "ok", "candles": candles}
+
+
+def generate_session_candles(days: int, minutes=1, first_day=1704133800, drop=0.0, seed=5):
+    """
+    Builds candle columns with EPOCH values inside the 09:15 - 15:30 IST session of consecutive days
+    :param days: number of sessions
+    :param minutes: minutes per candle
+    :param first_day: EPOCH of the IST midnight of the first day
+    :param drop: share of candles removed at random, like bars without trades
+    :param seed: seed of the random generator
+    :return: dictionary of EPOCH, OPEN, HIGH, LOW, CLOSE, VOLUME arrays
+    """
+    step = minutes * 60
+    session_open = first_day + session_calendar.SESSION_OPEN_SECONDS
+    per_day = np.arange(session_open, first_day + session_calendar.SESSION_CLOSE_SECONDS, step)
+    epochs = (per_day[None, :] + 24 * 60 * 60 * np.arange(days)[:, None]).ravel()
+    rng = np.random.default_rng(seed)
+    keep = rng.random(len(epochs)) >= drop
+    candles = generate_ohlc(len(epochs), seed=seed)
+    columns = {"EPOCH": epochs.astype(np.float64), **candles,
+               "VOLUME": rng.integers(100, 10000, len(epochs)).astype(np.float64)}
+    return {column: values[keep] for column, values in columns.items()}
+
+
+def legacy_resample(candle_columns, minutes):
+    """
+    Resamples candle by candle with a dictionary keyed by bar start
+    """
+    bars = {}
+    for epoch, open_, high, low, close, volume in zip(*(candle_columns[column].tolist()
+                                                        for column in repository.CANDLE_COLUMNS)):
+        local = (int(epoch) + session_calendar.IST_OFFSET) % (24 * 60 * 60) - session_calendar.SESSION_OPEN_SECONDS
+        start = int(epoch) - local + local // (minutes * 60) * minutes * 60
+        if start not in bars:
+            bars[start] = [start, open_, high, low, close, volume]
+        else:
+            bar = bars[start]
+            bar[2], bar[3], bar[4], bar[5] = max(bar[2], high), min(bar[3], low), close, bar[5] + volume
+    return np.array(list(bars.values())).T
+
+
+def legacy_session_calendar(epochs):
+    """
+    Session day, minutes since open and position in the day, one datetime per candle
+    """
+    ist = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+    rows, previous_day, position = [], None, 0
+    for epoch in epochs.tolist():
+        moment = datetime.datetime.fromtimestamp(epoch, ist)
+        day = moment.date().toordinal() - datetime.date(1970, 1, 1).toordinal()
+        position = position + 1 if day == previous_day else 0
+        previous_day = day
+        rows.append((day, moment.hour * 60 + moment.minute - 9 * 60 - 15, position))
+    return np.array(rows).T
+
+
+def timed(function, *args, repeat=1):
+    """
+    Returns the best wall time of a function call in seconds
+    :param function: function to be timed
+    :param args: arguments passed to the function
+    :param repeat: number of runs, the fastest one is reported
+    :return: seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_supertrend(bars=1_000_000, atr_period=12, multiplier=3):
+    """
+    Times get_supertrend against the original pandas implementation
+    :param bars: number of candles
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: speedup
+    """
+    dataframe_data = pd.DataFrame(generate_ohlc(bars))
+    repository.get_supertrend(dataframe_data.iloc[:100], atr_period, multiplier)  # JIT warm up
+
+    new_time = timed(repository.get_supertrend, dataframe_data, atr_period, multiplier, repeat=3)
+    legacy_time = timed(legacy_get_supertrend, dataframe_data, atr_period, multiplier)
+    speedup = legacy_time / new_time
+    print(f"get_supertrend {bars} bars: legacy {legacy_time:.3f}s, new {new_time:.4f}s, speedup {speedup:.0f}x")
+    return speedup
+
+
+def legacy_trade_diff_result(dataframe_data, supertrend_ATR, supertrend_Multiplier, dema_time_period, per):
+    """
+    The Supertrend + DEMA loop kept in experiments.py, it recomputes both indicators on every candle
+    :param dataframe_data: Dataframe with HIGH, LOW, CLOSE columns
+    :param supertrend_ATR: value defined by us
+    :param supertrend_Multiplier: value defined by us
+    :param dema_time_period: DEMA period
+    :param per: sell percentage criteria
+    :return: trade_diff_result
+    """
+    CLOSE_VALUES = dataframe_data["CLOSE"].tolist()
+    a = 0
+    buy_value = 0
+    trade_counter = 0
+    trade_diff_result = []
+    discrete_diff = 0
+    for i in range(len(CLOSE_VALUES)):
+        if CLOSE_VALUES[i] > repository.get_dema(repository.list_to_numpy_array(CLOSE_VALUES),
+                                                 dema_time_period)[i] and \
+                repository.get_supertrend(dataframe_data, supertrend_ATR, supertrend_Multiplier)["Supertrend"][i] \
+                and a != 1:
+            buy_value = CLOSE_VALUES[i]
+            buy_index = i
+            a = 1
+        elif (repository.get_supertrend(dataframe_data, supertrend_ATR, supertrend_Multiplier)["Supertrend"][i] == False
+              or (buy_value * (per) < CLOSE_VALUES[i])) and a == 1:
+            trade_counter = trade_counter + 1
+            sell_value = CLOSE_VALUES[i]
+            a = 0
+            trade_diff = sell_value - buy_value
+            discrete_diff = trade_diff + discrete_diff
+            trade_diff_result.append([trade_counter, {"index": buy_index, "value": buy_value},
+                                      {"index": i, "value": sell_value}, trade_diff, discrete_diff])
+    return trade_diff_result
+
+
+class RecordCollector(logging.Handler):
+    """
+    Keeps the records of a logger in a list, so checks can read the structured fields
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def legacy_ema_backtest(candles, ema_values, rr_ratio_changer, level=logging.WARNING):
+    """
+    Runs repository.ema_initializer and collects what it logs instead of sending it to the console
+    :param candles: dictionary of HIGH, LOW, CLOSE arrays
+    :param ema_values: EMA of the CLOSE values
+    :param rr_ratio_changer: value defined by us
+    :param level: INFO collects every trade and the summary, WARNING none of them, like a backtest normally runs
+    :return: list of logging.LogRecord
+    """
+    high, low, close = candles["HIGH"].tolist(), candles["LOW"].tolist(), candles["CLOSE"].tolist()
+    collector = RecordCollector()
+    previous_level, previous_propagate = repository.logger.level, repository.logger.propagate
+    repository.logger.setLevel(level)
+    repository.logger.propagate = False
+    repository.logger.addHandler(collector)
+    try:
+        repository.ema_initializer(high, close, low, ema_values, rr_ratio_changer, len(close), 1,
+                                   "NSE:TEST-EQ", 2, 1, -1, "INTRADAY", 0, 0)
+    finally:
+        repository.logger.removeHandler(collector)
+        repository.logger.setLevel(previous_level)
+        repository.logger.propagate = previous_propagate
+    return collector.records
+
+
+def bench_ema_backtest(bars=100_000, period=5, rr_ratio_changer=2):
+    """
+    Times backtest.run_ema_backtest against ema_initializer logging at WARNING
+    :param bars: number of candles
+    :param period: EMA period
+    :param rr_ratio_changer: value defined by us
+    :return: speedup
+    """
+    candles = generate_ohlc(bars, volatility=0.004)
+    ema_values = repository.get_ema(candles["CLOSE"], period)
+    new_time = timed(backtest.run_ema_backtest, candles["HIGH"], candles["LOW"], candles["CLOSE"], ema_values,
+                     rr_ratio_changer, repeat=3)
+    legacy_time = timed(legacy_ema_backtest, candles, ema_values, rr_ratio_changer)
+    speedup = legacy_time / new_time
+    print(f"EMA backtest {bars} bars: legacy {legacy_time:.3f}s, new {new_time:.4f}s, speedup {speedup:.0f}x")
+    return speedup
+
+
+def legacy_walk_forward(candles, windows, atr_periods, multipliers, dema_periods, pers):
+    """
+    Walk-forward the plain way, every window computes every indicator again from the first candle
+    """
+    rows = []
+    for train_start, train_end, test_end in windows:
+        history = {column: values[:test_end] for column, values in candles.items()}
+        train_close, test_close = history["CLOSE"][train_start:train_end], history["CLOSE"][train_end:test_end]
+        best = None
+        for atr_period, multiplier, dema_period in itertools.product(atr_periods, multipliers, dema_periods):
+            buy_signal, sell_signal = repository.get_supertrend_dema_signals(history, atr_period, multiplier,
+                                                                             dema_period)
+            for per in pers:
+                buy_indices, sell_indices = repository.get_supertrend_dema_trades(
+                    train_close, buy_signal[train_start:train_end], sell_signal[train_start:train_end], per)
+                pnl = float((train_close[sell_indices] - train_close[buy_indices]).sum())
+                if best is None or pnl > best[0]:
+                    best = (pnl, atr_period, multiplier, dema_period, per, buy_signal, sell_signal)
+        pnl, atr_period, multiplier, dema_period, per, buy_signal, sell_signal = best
+        buy_indices, sell_indices = repository.get_supertrend_dema_trades(
+            test_close, buy_signal[train_end:test_end], sell_signal[train_end:test_end], per)
+        test_pnl = float((test_close[sell_indices] - test_close[buy_indices]).sum())
+        rows.append((atr_period, multiplier, dema_period, per, pnl, test_pnl))
+    return rows
+
+
+def bench_candle_parsing(bars=100_000):
+    """
+    Times get_candle_columns against the original per-candle loop of entry_point.py
+    :param bars: number of candles
+    :return: speedup
+    """
+    entire_stock_data = generate_history_response(bars)
+    new_time = timed(repository.get_candle_columns, entire_stock_data, repeat=5)
+    legacy_time = timed(legacy_parse_candles, entire_stock_data, repeat=5)
+    speedup = legacy_time / new_time
+    print(f"candle parsing {bars} bars: legacy {legacy_time:.4f}s, new {new_time:.4f}s, speedup {speedup:.1f}x")
+    return speedup
+
+
+def bench_matrix_indicators(symbols=500, bars=10_000, atr_period=12, multiplier=3):
+    """
+    Times the matrix indicators against calling get_supertrend, get_dema and get_ema once per symbol, together
+    and one by one
+    :param symbols: number of symbols
+    :param bars: candles per symbol
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: speedup of the three indicators together
+    """
+    histories = [generate_ohlc(bars, seed=row) for row in range(symbols)]
+    high, low, close = (np.stack([candles[column] for candles in histories]) for column in ("HIGH", "LOW", "CLOSE"))
+    matrix_indicators.get_supertrend_matrix(high[:2, :100], low[:2, :100], close[:2, :100], atr_period,
+                                            multiplier)  # JIT warm up
+
+    def per_symbol():
+        for candles in histories:
+            repository.get_supertrend(candles, atr_period, multiplier)
+            repository.get_dema(candles["CLOSE"], 3)
+            repository.get_ema(candles["CLOSE"], 5)
+
+    def matrix():
+        matrix_indicators.get_supertrend_matrix(high, low, close, atr_period, multiplier)
+        matrix_indicators.get_dema_matrix(close, 3)
+        matrix_indicators.get_ema_matrix(close, 5)
+
+    per_symbol_time = timed(per_symbol)
+    matrix_time = timed(matrix, repeat=3)
+    speedup = per_symbol_time / matrix_time
+    print(f"indicators {symbols} x {bars} bars: per symbol {per_symbol_time:.3f}s, matrix {matrix_time:.3f}s, "
+          f"speedup {speedup:.1f}x")
+    pairs = {"supertrend": (lambda: [repository.get_supertrend(candles, atr_period, multiplier)
+                                     for candles in histories],
+                            lambda: matrix_indicators.get_supertrend_matrix(high, low, close, atr_period, multiplier)),
+             "dema": (lambda: [repository.get_dema(candles["CLOSE"], 3) for candles in histories],
+                      lambda: matrix_indicators.get_dema_matrix(close, 3)),
+             "ema": (lambda: [repository.get_ema(candles["CLOSE"], 5) for candles in histories],
+                     lambda: matrix_indicators.get_ema_matrix(close, 5))}
+    for name, (per_symbol_function, matrix_function) in pairs.items():
+        print(f"  {name:<10} speedup {timed(per_symbol_function, repeat=3) / timed(matrix_function, repeat=3):.1f}x")
+    # an EMA cannot beat reading the CLOSE matrix once and writing a new one
+    print(f"  copying the CLOSE matrix takes {timed(np.copy, close, repeat=3) * 1000:.1f} ms, EMA matrix "
+          f"{timed(matrix_indicators.get_ema_matrix, close, 5, repeat=3) * 1000:.1f} ms")
+    return speedup
+
+
+def bench_event_backtest(years=1, minutes_per_day=375, days_per_year=250, budget=1.0):
+    """
+    Times EventBacktest replaying years of 1 minute candles with the EMA breakout strategy
+    :param years: years of 1 minute candles replayed
+    :param minutes_per_day: candles in one session
+    :param days_per_year: sessions in one year
+    :param budget: seconds allowed for the replay, AssertionError above it
+    :return: seconds the replay took
+    """
+    bars = years * days_per_year * minutes_per_day
+    candles = generate_ohlc(bars, volatility=0.0008)
+    ema_values = repository.get_ema(candles["CLOSE"], 20)
+    strategy = backtest.EMABreakoutStrategy(ema_values, 3, 1)
+    elapsed = timed(lambda: backtest.EventBacktest(candles["OPEN"], candles["HIGH"], candles["LOW"], candles["CLOSE"],
+                                                   slippage=0.0005).run(strategy))
+    print(f"EventBacktest {bars} bars of 1 minute candles: {elapsed:.2f}s")
+    assert elapsed < budget, f"{bars} candles took {elapsed:.2f}s"
+    return elapsed
+
+
+def bench_walk_forward(bars=50_000, train_bars=10_000, test_bars=2500, max_workers=2):
+    """
+    Times walk_forward.walk_forward against recomputing every indicator per window
+    :param bars: number of candles
+    :param train_bars: candles in a train window
+    :param test_bars: candles in a test window
+    :param max_workers: number of processes
+    :return: speedup
+    """
+    candles = generate_ohlc(bars)
+    windows = walk_forward.walk_forward_windows(bars, train_bars, test_bars)
+    grid = ((8, 10, 12, 14, 16, 18), (1.5, 2.0, 2.5, 3.0), (3, 5, 7, 9), (1.01, 1.02, 1.03))
+    new_time = timed(lambda: walk_forward.walk_forward(candles, windows, *grid, max_workers=max_workers))
+    legacy_time = timed(legacy_walk_forward, candles, windows, *grid)
+    speedup = legacy_time / new_time
+    print(f"walk_forward {bars} bars, {len(windows)} windows: legacy {legacy_time:.2f}s, new {new_time:.2f}s, "
+          f"speedup {speedup:.1f}x")
+    return speedup
+
+
+def bench_daemon(resolution=5, day_start=1704133800):
+    """
+    Times BarDaemon running a whole session on a virtual clock
+    :param resolution: minutes per candle
+    :param day_start: EPOCH of an IST midnight, the session replayed is that day
+    :return: average seconds per cycle
+    """
+    step = resolution * 60
+    previous_open, previous_close = session_calendar.session_bounds(day_start - 12 * 60 * 60)
+    session_open, session_close = session_calendar.session_bounds(day_start + 12 * 60 * 60)
+    epochs = list(range(previous_open, previous_close, step)) + list(range(session_open, session_close, step))
+    candles = generate_ohlc(len(epochs))
+    rows = [[epoch, *values, 1000.0] for epoch, values in
+            zip(epochs, zip(*(candles[column].tolist() for column in ("OPEN", "HIGH", "LOW", "CLOSE"))))]
+
+    clock = VirtualClock(session_open - 15 * 60)
+    bar_daemon = daemon.BarDaemon("TEST", str(resolution), from_days=3, on_signal=lambda decision: None,
+                                  client=SessionHistoryClient(rows, clock, step), store=False, clock=clock.time,
+                                  sleep=clock.sleep)
+    bar_daemon.load()
+    started = time.perf_counter()
+    cycles = bar_daemon.run()
+    cycle_time = (time.perf_counter() - started) / cycles
+    print(f"BarDaemon {cycles} cycles of a session: {cycle_time * 1000:.2f} ms per cycle")
+    return cycle_time
+
+
+def bench_resample(bars=1_000_000, minutes_list=(5, 15, 60)):
+    """
+    Times resample_many building higher timeframes from 1 minute candles
+    :param bars: 1 minute candles
+    :param minutes_list: higher timeframes built
+    :return: seconds
+    """
+    base = generate_session_candles(bars // 375 + 1)
+    resample_time = timed(resample.resample_many, base, minutes_list, repeat=3)
+    print(f"resample {len(base['EPOCH'])} 1 minute candles to {minutes_list} minutes: {resample_time:.3f}s")
+    return resample_time
+
+
+def bench_session_calendar(bars=1_000_000):
+    """
+    Times session_calendar labelling candles with session day, minutes and position
+    :param bars: number of candles
+    :return: seconds
+    """
+    epochs = generate_session_candles(bars // 375 + 1)["EPOCH"]
+    calendar_time = timed(session_calendar.session_calendar, epochs, repeat=3)
+    print(f"session_calendar {len(epochs)} candles: {calendar_time:.3f}s")
+    return calendar_time
+
+
+def bench_order_book(lookups=100_000):
+    """
+    Times a position lookup of the OrderBook
+    :param lookups: position lookups timed
+    :return: seconds per position lookup
+    """
+    symbol = "NSE:TEST-EQ"
+    book = order_book.OrderBook()
+    book.on_order_placed(repository.create_buy_data(symbol, 2, 10, 1, "INTRADAY", 0, 0), "B1")
+    book.on_fill("B1", 10, 100.0)
+    lookup_time = timed(lambda: [book.position(symbol) for _ in range(lookups)]) / lookups
+    print(f"OrderBook position lookup: {lookup_time * 1e9:.0f} ns")
+    return lookup_time
+
+
+def bench_risk_engine(symbols=500, checks=100_000, budget=5e-6):
+    """
+    Times a RiskEngine check of an open symbol adding to its position while many symbols are open
+    :param symbols: symbols holding a position
+    :param checks: checks timed
+    :param budget: most seconds per check, AssertionError above it
+    :return: seconds per check
+    """
+    book = order_book.OrderBook()
+    risk = risk_engine.RiskEngine(book, max_open_positions=symbols + 1, max_daily_exposure=float("inf"))
+    for number in range(symbols):
+        name = f"NSE:S{number}-EQ"
+        book.on_order_placed(repository.create_buy_data(name, 2, 10, 1, "INTRADAY", 0, 0), name)
+        book.on_fill(name, 10, 100.0)
+    order_data = repository.create_buy_data("NSE:S7-EQ", 1, 10, 1, "INTRADAY", 100.0, 0)
+    assert risk.check(order_data) is None
+    check_time = timed(lambda: [risk.check(order_data) for _ in range(checks)]) / checks
+    print(f"RiskEngine check with {symbols} open positions: {check_time * 1e6:.1f} us")
+    assert check_time < budget, f"a risk check took {check_time * 1e6:.1f} us"
+    return check_time
+
+
+def bench_live_feed(bars=3000, seed_bars=1000, resolution=5, budget=0.001):
+    """
+    Times the step from a bar boundary to the Supertrend decision of the live feed
+    :param bars: number of candles turned into ticks
+    :param seed_bars: candles used to seed the indicators
+    :param resolution: minutes per candle
+    :param budget: most seconds of the 99th percentile, AssertionError above it
+    :return: 99th percentile in seconds
+    """
+    step = resolution * 60
+    sessions = generate_session_candles(bars // (375 // resolution) + 1, resolution)
+    candles = np.array([sessions[column] for column in repository.CANDLE_COLUMNS]).T[:bars]
+    engine = live_feed.SignalEngine(repository.get_candle_columns({"candles": candles[:seed_bars]}), atr_period=12,
+                                    multiplier=3)
+    builder = live_feed.CandleBuilder(resolution)
+    builder.on_bar.append(engine.on_bar)
+    latencies = []
+    for epoch, open_, high, low, close, volume in candles[seed_bars:].tolist():
+        for offset, ltp in ((0, open_), (60, high), (120, low), (step - 1, close)):
+            builder.on_tick(epoch + offset, ltp, volume / 4)
+        started = time.perf_counter()
+        builder.close_due(builder.current_end)
+        latencies.append(time.perf_counter() - started)
+    p99 = np.percentile(latencies, 99)
+    print(f"live feed bar boundary to decision: p99 {p99 * 1000:.3f} ms")
+    assert p99 < budget, f"99th percentile decision took {p99 * 1000:.3f} ms"
+    return p99
+
+
+def bench_indicator_cache(bars=5000, atr_period=12, multiplier=3):
+    """
+    Times IndicatorCache extending a Supertrend by one candle against the batch get_supertrend it replaces
+    :param bars: number of candles
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: speedup
+    """
+    candles = generate_ohlc(bars)
+    high, low, close = candles["HIGH"], candles["LOW"], candles["CLOSE"]
+    cache = indicator_cache.IndicatorCache()
+    cache.supertrend(high[:-1], low[:-1], close[:-1], atr_period, multiplier)
+    extension_time = timed(cache.supertrend, high, low, close, atr_period, multiplier)
+    batch_time = timed(repository.get_supertrend, candles, atr_period, multiplier, repeat=3)
+    speedup = batch_time / extension_time
+    print(f"IndicatorCache one candle extension {extension_time * 1e6:.0f} us, get_supertrend "
+          f"{batch_time * 1e6:.0f} us, speedup {speedup:.0f}x")
+    return speedup
+
+
+def bench_metrics(calls=200_000, budget=1e-6):
+    """
+    Times the overhead of a metrics.timed span
+    :param calls: number of timed calls
+    :param budget: seconds of overhead allowed per span, AssertionError above it
+    :return: seconds of overhead per span
+    """
+    def bare():
+        pass
+
+    spanned = metrics.timed("benchmark.noop")(bare)
+    # best of a few runs, so a busy machine does not fail the budget
+    overhead = min(timed(lambda: [spanned() for _ in range(calls)]) - timed(lambda: [bare() for _ in range(calls)])
+                   for _ in range(5)) / calls
+    print(f"metrics span overhead: {overhead * 1e9:.0f} ns")
+    assert overhead < budget, f"span overhead {overhead * 1e9:.0f} ns"
+    return overhead
+
+
+def _ema_initializer_case(candles, ema_values, rr_ratio_changer):
+    """
+    Runs ema_initializer logging at WARNING, trimming candles it cannot finish on
+    """
+    while True:
+        try:
+            return legacy_ema_backtest(candles, ema_values, rr_ratio_changer)
+        except IndexError:
+            candles = {column: values[:-1] for column, values in candles.items()}
+            ema_values = ema_values[:-1]
+
+
+def suite_cases(bars: int, volatility=0.002):
+    """
+    Builds the hot path calls measured by run_suite, every one on the same synthetic candles
+    :param bars: number of candles
+    :param volatility: standard deviation of the close to close return
+    :return: dictionary of case name to (function, arguments)
+    """
+    candles = generate_ohlc(bars, volatility)
+    ema_values = repository.get_ema(candles["CLOSE"], 5)
+    cases = {
+        "get_candle_columns": (repository.get_candle_columns,
+                               (generate_history_response(bars, volatility=volatility),)),
+        "get_supertrend": (repository.get_supertrend, (candles, 12, 3)),
+        "get_dema": (repository.get_dema, (candles["CLOSE"], 3)),
+        "get_ema": (repository.get_ema, (candles["CLOSE"], 5)),
+        "run_ema_backtest": (backtest.run_ema_backtest,
+                             (candles["HIGH"], candles["LOW"], candles["CLOSE"], ema_values, 2)),
+        "ema_initializer": (_ema_initializer_case, (candles, ema_values, 2)),
+    }
+    # JIT warm up, so compile time is not measured as throughput
+    repository.get_supertrend({column: values[:100] for column, values in candles.items()}, 12, 3)
+    backtest.run_ema_backtest(candles["HIGH"][:100], candles["LOW"][:100], candles["CLOSE"][:100],
+                              ema_values[:100], 2)
+    return cases
+
+
+def measure(function, args, bars: int, repeat=3):
+    """
+    Times a call and records its peak memory, the timed runs are not traced so tracemalloc does not slow them
+    :param function: function to be measured
+    :param args: arguments passed to the function
+    :param bars: number of candles it works on
+    :param repeat: number of timed runs, the fastest one is reported
+    :return: dictionary with seconds, bars_per_second and peak_memory in bytes
+    """
+    seconds = timed(function, *args, repeat=repeat)
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "bars_per_second": bars / seconds, "peak_memory": peak_memory}
+
+
+def run_suite(sizes=SUITE_SIZES, volatility=0.002, cases=None, repeat=None):
+    """
+    Measures every hot path at every size
+    :param sizes: numbers of candles
+    :param volatility: standard deviation of the close to close return of the synthetic candles
+    :param cases: names from suite_cases to run, None runs all of them
+    :param repeat: number of timed runs per measurement, None repeats small sizes more to beat timer noise
+    :return: {case: {bars: measurement}}, bars is a string so the result round trips through JSON
+    """
+    results = {}
+    for bars in sizes:
+        for name, (function, args) in suite_cases(bars, volatility).items():
+            if cases is not None and name not in cases:
+                continue
+            result = measure(function, args, bars, repeat or max(3, min(100, 100_000 // bars)))
+            results.setdefault(name, {})[str(bars)] = result
+            print(f"{name:<20} {bars:>9} bars  {result['bars_per_second']:>14,.0f} bars/s  "
+                  f"peak {result['peak_memory'] / 2 ** 20:8.1f} MiB")
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance=REGRESSION_TOLERANCE):
+    """
+    Lists the measurements that got slower or bigger than the baseline allows
+    :param results: what run_suite returned
+    :param baseline: an earlier run_suite result
+    :param tolerance: fraction of throughput a case may lose, or of peak memory it may gain
+    :return: list of messages, empty when nothing regressed
+    """
+    regressions = []
+    for name, by_size in results.items():
+        for bars, result in by_size.items():
+            reference = baseline.get(name, {}).get(bars)
+            if reference is None:
+                continue
+            if result["bars_per_second"] < reference["bars_per_second"] * (1 - tolerance):
+                regressions.append(f"{name} {bars} bars: {result['bars_per_second']:,.0f} bars/s, "
+                                   f"baseline {reference['bars_per_second']:,.0f}")
+            if result["peak_memory"] > reference["peak_memory"] * (1 + tolerance) + 2 ** 16:
+                regressions.append(f"{name} {bars} bars: peak {result['peak_memory']:,} bytes, "
+                                   f"baseline {reference['peak_memory']:,}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Timings of the repository hot paths, the equivalence and "
+                                                 "behaviour tests are in test_risingsun.py")
+    parser.add_argument("--bars", type=int, default=1_000_000)
+    parser.add_argument("--suite", action="store_true", help="measure bars/sec and peak memory of every hot path")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SUITE_SIZES))
+    parser.add_argument("--volatility", type=float, default=0.002)
+    parser.add_argument("--cases", nargs="+", help="names of the suite cases to run, all by default")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="JSON file the suite is compared with")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    arguments = parser.parse_args()
+
+    if arguments.suite:
+        results = run_suite(arguments.sizes, arguments.volatility, arguments.cases)
+        if arguments.save_baseline:
+            with open(arguments.baseline, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            print(f"Baseline saved to {arguments.baseline}")
+        elif os.path.exists(arguments.baseline):
+            with open(arguments.baseline, "r") as f:
+                regressions = compare_with_baseline(results, json.load(f), arguments.tolerance)
+            for regression in regressions:
+                print(f"REGRESSION {regression}", file=sys.stderr)
+            if regressions:
+                sys.exit(1)
+            print(f"No regression against {arguments.baseline}")
+        else:
+            print(f"No baseline at {arguments.baseline}, run with --save-baseline to store one")
+        sys.exit(0)
+
+    bench_candle_parsing(min(arguments.bars, 100_000))
+    bench_ema_backtest(min(arguments.bars, 100_000))
+    bench_supertrend(arguments.bars)
+    bench_matrix_indicators()
+    bench_event_backtest()
+    bench_walk_forward()
+    bench_daemon()
+    bench_resample(arguments.bars)
+    bench_session_calendar(arguments.bars)
+    bench_order_book()
+    bench_risk_engine()
+    bench_live_feed()
+    bench_indicator_cache()
+    bench_metrics()
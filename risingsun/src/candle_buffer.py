@@ -0,0 +1,100 @@
+import numpy as np
+import repository
+
+
+class CandleBuffer:
+    """
+    Keeps the latest capacity candles in preallocated NumPy storage, one row per column, so memory stays flat in a
+    long session and every column can be handed to TA-Lib or the Supertrend loop as a contiguous view
+    """
+    __slots__ = ("capacity", "data", "start", "end")
+
+    def __init__(self, capacity=5000, headroom=None, dtype=np.float64):
+        """
+        :param capacity: number of candles kept, older ones are dropped
+        :param headroom: extra slots written before the buffer is compacted, defaults to a quarter of capacity
+        :param dtype: float64 works with TA-Lib directly
+        """
+        if headroom is None:
+            headroom = max(capacity // 4, 16)
+        self.capacity = capacity
+        self.data = np.empty((len(repository.CANDLE_COLUMNS), capacity + headroom), dtype=dtype)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _compact(self):
+        """
+        Moves the kept candles to the front of the storage, runs once every headroom appends
+        """
+        length = self.end - self.start
+        self.data[:, :length] = self.data[:, self.start:self.end]
+        self.start = 0
+        self.end = length
+
+    def append(self, epoch, open_, high, low, close, volume=0.0):
+        """
+        Adds one candle
+        :param epoch: EPOCH of the candle
+        :param open_: OPEN
+        :param high: HIGH
+        :param low: LOW
+        :param close: CLOSE
+        :param volume: VOLUME
+        """
+        if self.end == self.data.shape[1]:
+            self._compact()
+        data, end = self.data, self.end
+        data[0, end] = epoch
+        data[1, end] = open_
+        data[2, end] = high
+        data[3, end] = low
+        data[4, end] = close
+        data[5, end] = volume
+        self.end = end + 1
+        if self.end - self.start > self.capacity:
+            self.start += 1
+
+    def extend(self, candle_columns: dict):
+        """
+        Adds many candles at once
+        :param candle_columns: dictionary like repository.get_candle_columns returns
+        """
+        length = len(candle_columns["CLOSE"])
+        if length >= self.capacity:
+            # only the newest capacity candles survive, drop the rest before copying
+            for row, column in enumerate(repository.CANDLE_COLUMNS):
+                self.data[row, :self.capacity] = candle_columns[column][length - self.capacity:]
+            self.start, self.end = 0, self.capacity
+            return
+        if self.end + length > self.data.shape[1]:
+            self.start = max(self.start, self.end + length - self.capacity)
+            self._compact()
+        for row, column in enumerate(repository.CANDLE_COLUMNS):
+            self.data[row, self.end:self.end + length] = candle_columns[column]
+        self.end += length
+        self.start = max(self.start, self.end - self.capacity)
+
+    def __getitem__(self, column: str):
+        """
+        Returns a view of one column, oldest candle first; it is not copied, so take it again after appending
+        :param column: EPOCH, OPEN, HIGH, LOW, CLOSE or VOLUME
+        :return: contiguous NumPy view
+        """
+        return self.data[repository.CANDLE_COLUMNS.index(column), self.start:self.end]
+
+    def columns(self):
+        """
+        Returns views of every column, can be passed to get_supertrend, get_dema, get_ema
+        :return: dictionary of EPOCH, OPEN, HIGH, LOW, CLOSE, VOLUME views
+        """
+        return {column: self.data[row, self.start:self.end] for row, column in enumerate(repository.CANDLE_COLUMNS)}
+
+    def last(self):
+        """
+        Returns the newest candle
+        :return: (epoch, open, high, low, close, volume)
+        """
+        return tuple(self.data[:, self.end - 1].tolist())
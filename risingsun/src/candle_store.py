@@ -0,0 +1,243 @@
+import os
+import json
+import shutil
+import session_calendar
+import numpy as np
+
+STORE_DIRECTORY = "candle_store"
+CANDLE_COLUMNS = ("EPOCH", "OPEN", "HIGH", "LOW", "CLOSE", "VOLUME")  # same order as repository.CANDLE_COLUMNS
+CANDLE_WIDTH = len(CANDLE_COLUMNS)
+PRICE_COLUMNS = ("OPEN", "HIGH", "LOW", "CLOSE")
+MAX_DAYS_PER_REQUEST = {"D": 366, "1D": 366}  # FYERS history() limits, every intraday resolution allows 100 days
+INTRADAY_MAX_DAYS_PER_REQUEST = 100
+
+
+class CandleStore:
+    """
+    Keeps the candles fetched from FYERS on disk so a run only asks the server for the epochs it has not seen
+    before. Every symbol and resolution gets a folder with one raw file per column (EPOCH is the int64 index,
+    prices are float64 or float32) and a meta.json; open_columns() maps the files with np.memmap, so years of
+    candles for the whole universe can be swept while resident memory stays bounded by the OS page cache
+    """
+
+    def __init__(self, directory=STORE_DIRECTORY, price_dtype=np.float64):
+        """
+        :param directory: folder where the candle folders are kept
+        :param price_dtype: float64 reaches TA-Lib without a copy, float32 halves the disk and page cache
+        """
+        self.directory = directory
+        self.price_dtype = np.dtype(price_dtype)
+
+    def _folder(self, symbol: str, resolution: str):
+        """
+        Returns the folder of a symbol and resolution
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param resolution: Time frame of a chart i.e., 5, 15, D
+        :return: path
+        """
+        safe_symbol = symbol.replace(":", "_").replace("/", "_")
+        return os.path.join(self.directory, f"{safe_symbol}_{resolution}")
+
+    @staticmethod
+    def _read_meta(folder: str):
+        meta_path = os.path.join(folder, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_meta(folder: str, meta: dict):
+        with open(os.path.join(folder, "meta.tmp.json"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(folder, "meta.tmp.json"), os.path.join(folder, "meta.json"))
+
+    @staticmethod
+    def _column_dtypes(price_dtype):
+        price_dtype = np.dtype(price_dtype)
+        return {"EPOCH": np.dtype(np.int64), "VOLUME": np.dtype(np.float64),
+                **{column: price_dtype for column in PRICE_COLUMNS}}
+
+    def open_columns(self, symbol: str, resolution: str):
+        """
+        Maps the stored columns read-only, indicator and backtest functions in repository take them directly
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param resolution: Time frame of a chart
+        :return: dictionary of EPOCH, OPEN, HIGH, LOW, CLOSE, VOLUME memory maps (empty arrays if nothing stored)
+        """
+        folder = self._folder(symbol, resolution)
+        meta = self._read_meta(folder)
+        dtypes = self._column_dtypes(self.price_dtype if meta is None else meta["price_dtype"])
+        if meta is None or meta["length"] == 0:
+            return {column: np.empty(0, dtype=dtypes[column]) for column in CANDLE_COLUMNS}
+        return {column: np.memmap(os.path.join(folder, column), dtype=dtypes[column], mode="r",
+                                  shape=(meta["length"],))
+                for column in CANDLE_COLUMNS}
+
+    def load(self, symbol: str, resolution: str):
+        """
+        Returns the stored columns and the epoch range they cover
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param resolution: Time frame of a chart
+        :return: columns (memory maps), covered_from, covered_to
+        """
+        meta = self._read_meta(self._folder(symbol, resolution))
+        if meta is None:
+            return self.open_columns(symbol, resolution), None, None
+        return self.open_columns(symbol, resolution), meta["covered_from"], meta["covered_to"]
+
+    def save(self, symbol: str, resolution: str, candles, covered_from: int, covered_to: int):
+        """
+        Writes all candles of a symbol, replacing what was stored
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param resolution: Time frame of a chart
+        :param candles: array of shape n x 6 sorted by epoch
+        :param covered_from: first epoch that was asked from the server
+        :param covered_to: last epoch that was asked from the server
+        """
+        folder = self._folder(symbol, resolution)
+        meta = {"symbol": symbol, "resolution": resolution, "length": len(candles),
+                "price_dtype": self.price_dtype.str, "covered_from": int(covered_from), "covered_to": int(covered_to)}
+        dtypes = self._column_dtypes(self.price_dtype)
+
+        temporary, old = folder + ".tmp", folder + ".old"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        for index, column in enumerate(CANDLE_COLUMNS):
+            np.ascontiguousarray(candles[:, index], dtype=dtypes[column]).tofile(os.path.join(temporary, column))
+        self._write_meta(temporary, meta)
+
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(folder):
+            os.replace(folder, old)
+        os.replace(temporary, folder)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _replace_tail(self, folder: str, meta: dict, keep: int, candles, covered_to: int):
+        """
+        Overwrites the stored candles from row keep on with newer ones, the older rows are not rewritten
+        :param folder: folder of the symbol
+        :param meta: its meta.json
+        :param keep: rows kept as they are
+        :param candles: array of shape n x 6 sorted by epoch, all later than row keep - 1
+        :param covered_to: last epoch that was asked from the server
+        """
+        dtypes = self._column_dtypes(meta["price_dtype"])
+        for index, column in enumerate(CANDLE_COLUMNS):
+            with open(os.path.join(folder, column), "r+b") as f:
+                f.seek(keep * dtypes[column].itemsize)
+                np.ascontiguousarray(candles[:, index], dtype=dtypes[column]).tofile(f)
+                f.truncate()
+        # meta.json is written last, the length in it is what readers trust
+        self._write_meta(folder, {**meta, "length": keep + len(candles), "covered_to": int(covered_to)})
+
+    def missing_ranges(self, symbol: str, resolution: str, range_from: int, range_to: int):
+        """
+        Returns the epoch ranges that still have to be fetched from the server
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param resolution: Time frame of a chart
+        :param range_from: first epoch needed
+        :param range_to: last epoch needed
+        :return: list of (range_from, range_to)
+        """
+        columns, covered_from, covered_to = self.load(symbol, resolution)
+        if covered_from is None:
+            return [(range_from, range_to)]
+
+        missing = []
+        if range_from < covered_from:
+            missing.append((range_from, covered_from))
+        if range_to > covered_to:
+            # the last stored candle may have been fetched while it was still forming, so fetch it again
+            last_epoch = int(columns["EPOCH"][-1]) if len(columns["EPOCH"]) else covered_to
+            missing.append((min(last_epoch, covered_to), range_to))
+        return missing
+
+    def merge(self, symbol: str, resolution: str, new_candles, range_from: int, range_to: int):
+        """
+        Adds freshly fetched candles to the store, newer values win on the same epoch
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param resolution: Time frame of a chart
+        :param new_candles: array of shape n x 6
+        :param range_from: first epoch that was asked from the server
+        :param range_to: last epoch that was asked from the server
+        """
+        new_candles = np.asarray(new_candles, dtype=np.float64).reshape(-1, CANDLE_WIDTH)
+        _, first_index = np.unique(new_candles[:, 0], return_index=True)
+        new_candles = new_candles[first_index]
+
+        folder = self._folder(symbol, resolution)
+        meta = self._read_meta(folder)
+        if meta is None:
+            self.save(symbol, resolution, new_candles, range_from, range_to)
+            return
+
+        columns = self.open_columns(symbol, resolution)
+        if range_from >= meta["covered_from"] and range_to >= meta["covered_to"]:
+            # the usual case, newer candles: only the tail of every file is touched
+            keep = int(np.searchsorted(columns["EPOCH"], new_candles[0, 0])) if len(new_candles) else meta["length"]
+            del columns  # release the memory maps before the files are written
+            self._replace_tail(folder, meta, keep, new_candles, range_to)
+            return
+
+        stored = np.column_stack([columns[column].astype(np.float64) for column in CANDLE_COLUMNS])
+        del columns
+        combined = np.concatenate([new_candles, stored.reshape(-1, CANDLE_WIDTH)])
+        # np.unique keeps the first occurrence, which is the new candle
+        _, first_index = np.unique(combined[:, 0], return_index=True)
+        self.save(symbol, resolution, combined[first_index], min(meta["covered_from"], range_from),
+                  max(meta["covered_to"], range_to))
+
+    def get(self, symbol: str, resolution: str, range_from: int, range_to: int):
+        """
+        Returns the stored candles between two epochs
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param resolution: Time frame of a chart
+        :param range_from: first epoch
+        :param range_to: last epoch
+        :return: array of shape n x 6
+        """
+        columns = self.open_columns(symbol, resolution)
+        start = np.searchsorted(columns["EPOCH"], range_from, side="left")
+        end = np.searchsorted(columns["EPOCH"], range_to, side="right")
+        return np.column_stack([columns[column][start:end].astype(np.float64)
+                                for column in CANDLE_COLUMNS]).reshape(-1, CANDLE_WIDTH)
+
+    def symbols(self, resolution: str):
+        """
+        Returns every symbol stored at a resolution
+        :param resolution: Time frame of a chart
+        :return: list of symbols like NSE:HINDUNILVR-EQ
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith((".tmp", ".old")):
+                continue
+            meta = self._read_meta(os.path.join(self.directory, name))
+            if meta is not None and meta["resolution"] == resolution:
+                found.append(meta["symbol"])
+        return found
+
+    def iter_universe(self, resolution: str):
+        """
+        Maps every stored symbol one after the other, for strategies that sweep the whole universe
+        :param resolution: Time frame of a chart
+        :return: generator of (symbol, columns)
+        """
+        for symbol in self.symbols(resolution):
+            yield symbol, self.open_columns(symbol, resolution)
+
+
+def split_range(resolution: str, range_from: int, range_to: int):
+    """
+    Splits an epoch range into pieces the FYERS history() call accepts
+    :param resolution: Time frame of a chart
+    :param range_from: first epoch
+    :param range_to: last epoch
+    :return: list of (range_from, range_to)
+    """
+    step = MAX_DAYS_PER_REQUEST.get(resolution, INTRADAY_MAX_DAYS_PER_REQUEST) * session_calendar.SECONDS_IN_DAY
+    return [(start, min(start + step, range_to)) for start in range(range_from, range_to, step)] or \
+        [(range_from, range_to)]
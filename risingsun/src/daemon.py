@@ -0,0 +1,186 @@
+import time
+import signal
+import logs
+import metrics
+import threading
+import live_feed
+import repository
+import access_token
+import candle_buffer
+import session_calendar
+
+SETTLE_SECONDS = 1.0  # wait after a bar closes so FYERS has it in history()
+RETRY_SECONDS = 0.5  # wait before asking again for a bar FYERS does not have yet
+RETRIES = 10
+
+logger = logs.get_logger("daemon")
+
+
+class BarDaemon:
+    """
+    Loads the client, the history and the indicators once, then wakes on every bar close of the session, fetches
+    only the candles closed since the last wake up, updates the indicators and hands the decision to on_signal;
+    returns at market close
+    """
+
+    def __init__(self, stock_name: str, resolution: str, from_days=30, atr_period=12, multiplier=3, dema_period=3,
+                 ema_period=5, on_signal=None, client=None, store=None, capacity=20000, clock=time.time,
+                 sleep=None):
+        """
+        :param stock_name: like HINDUNILVR
+        :param resolution: bar length in minutes as FYERS writes it, 1, 5, 15, ...
+        :param from_days: days of history the indicators are seeded with
+        :param atr_period: Supertrend ATR period
+        :param multiplier: Supertrend multiplier
+        :param dema_period: DEMA period
+        :param ema_period: EMA period
+        :param on_signal: called with the decision dictionary of every closed bar, this is where orders go
+        :param client: object with a FYERS style history() method, None means the FYERS entry point
+        :param store: CandleStore for the history, None means the default one, False skips it
+        :param capacity: candles kept in memory
+        :param clock: returns the current EPOCH, replaced in tests
+        :param sleep: sleeps for some seconds, None waits on the stop event so stop() wakes the daemon at once
+        """
+        if not str(resolution).isdigit():
+            raise ValueError(f"BarDaemon needs a resolution in minutes, got {resolution}")
+        self.symbol = f"NSE:{stock_name}-EQ"
+        self.stock_name = stock_name
+        self.resolution = str(resolution)
+        self.step = int(resolution) * 60
+        self.from_days = from_days
+        self.indicator_periods = (atr_period, multiplier, dema_period, ema_period)
+        self.on_signal = on_signal
+        self.client = client
+        self.store = store
+        self.capacity = capacity
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.sleep = sleep if sleep is not None else self.stopped.wait
+        self.candles = None
+        self.engine = None
+        self.last_epoch = None
+        self.cycle_latency = 0.0
+
+    def stop(self):
+        """
+        Makes run return after the current cycle, safe to call from a signal handler or another thread
+        """
+        self.stopped.set()
+
+    def load(self):
+        """
+        Builds the client and seeds the candle buffer and the indicators with the closed bars of the history
+        """
+        if self.client is None:
+            self.client = access_token.get_fyers_entry_point()
+        now = self.clock()
+        data = repository.pass_stock_data(self.stock_name, self.resolution, self.from_days, to_days=now)
+        data["range_from"] = int(now) - self.from_days * session_calendar.SECONDS_IN_DAY
+        history = repository.get_history_data(data, store=self.store, client=self.client)
+        if history.get("s") not in ("ok", "no_data"):
+            raise RuntimeError(f"History request failed - {history}")
+        candle_columns = repository.get_candle_columns(history)
+        # the bar still forming has no final values yet
+        epochs = candle_columns["EPOCH"]
+        if len(epochs) and session_calendar.next_bar_close(epochs[-1], self.step) > now:
+            candle_columns = {column: values[:-1] for column, values in candle_columns.items()}
+
+        self.candles = candle_buffer.CandleBuffer(self.capacity)
+        self.candles.extend(candle_columns)
+        atr_period, multiplier, dema_period, ema_period = self.indicator_periods
+        self.engine = live_feed.SignalEngine(candle_columns, atr_period, multiplier, dema_period, ema_period,
+                                             on_signal=self.on_signal)
+        self.last_epoch = int(candle_columns["EPOCH"][-1]) if len(candle_columns["EPOCH"]) else None
+        logger.info("Loaded %d candles of %s", len(self.candles), self.symbol,
+                    extra={"event": "daemon_loaded", "symbol": self.symbol, "candles": len(self.candles)})
+
+    def _fetch_closed(self, boundary):
+        """
+        Asks FYERS for the candles after the last one seen that closed by boundary
+        :return: list of candles
+        """
+        range_from = boundary - self.step if self.last_epoch is None else self.last_epoch + self.step
+        data = {"symbol": self.symbol, "resolution": self.resolution, "date_format": "0", "range_from": range_from,
+                "range_to": boundary - 1, "cont_flag": "1"}
+        with metrics.span("repository.history"):
+            response = self.client.history(data)
+        if response.get("s") not in ("ok", "no_data"):
+            logger.warning("History request failed - %s", response, extra={"event": "daemon_fetch_failed"})
+            return []
+        last_epoch = -1 if self.last_epoch is None else self.last_epoch
+        return [candle for candle in response.get("candles", [])
+                if last_epoch < candle[0] and session_calendar.next_bar_close(candle[0], self.step) <= boundary]
+
+    def run_cycle(self, boundary):
+        """
+        Handles the bars closed by boundary, retrying while FYERS does not have the last one yet
+        :param boundary: EPOCH of the bar close
+        :return: decision dictionaries, one per new bar
+        """
+        decisions = []
+        for attempt in range(RETRIES + 1):
+            started = time.perf_counter()
+            with metrics.span("daemon.cycle"):
+                for candle in self._fetch_closed(boundary):
+                    epoch, open_, high, low, close, volume = (float(value) for value in candle[:6])
+                    self.candles.append(epoch, open_, high, low, close, volume)
+                    decisions.append(self.engine.on_bar((int(epoch), open_, high, low, close, volume)))
+                    self.last_epoch = int(epoch)
+            self.cycle_latency = time.perf_counter() - started
+            if (self.last_epoch is not None
+                    and session_calendar.next_bar_close(self.last_epoch, self.step) >= boundary):
+                break
+            if attempt < RETRIES and self.sleep(RETRY_SECONDS):
+                break
+        else:
+            logger.warning("Bar closing at %d is missing", boundary, extra={"event": "daemon_bar_missing",
+                                                                           "symbol": self.symbol})
+        logger.debug("Cycle at %d took %.6f s", boundary, self.cycle_latency,
+                     extra={"event": "daemon_cycle", "bars": len(decisions), "latency": self.cycle_latency})
+        return decisions
+
+    def run(self):
+        """
+        Loads once and runs a cycle on every bar close until the market closes or stop is called
+        :return: number of cycles run
+        """
+        if self.engine is None:
+            self.load()
+        cycles = 0
+        session_close = session_calendar.session_bounds(self.clock())[1]
+        while not self.stopped.is_set():
+            now = self.clock()
+            if now >= session_close:
+                break
+            boundary = session_calendar.next_bar_close(now, self.step)
+            # sleep can return early, so wait again until the bar has really closed
+            while not self.stopped.is_set() and self.clock() < boundary + SETTLE_SECONDS:
+                self.sleep(boundary + SETTLE_SECONDS - self.clock())
+            if self.stopped.is_set():
+                break
+            self.run_cycle(boundary)
+            cycles += 1
+        logger.info("Stopped after %d cycles", cycles, extra={"event": "daemon_stopped", "cycles": cycles})
+        return cycles
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Trade one symbol bar by bar until market close")
+    parser.add_argument("--stock", default="HINDUNILVR")
+    parser.add_argument("--resolution", default="5")
+    parser.add_argument("--days", type=int, default=30, help="days of history the indicators start from")
+    parser.add_argument("--atr", type=int, default=12)
+    parser.add_argument("--multiplier", type=float, default=3)
+    parser.add_argument("--dema", type=int, default=3)
+    arguments = parser.parse_args()
+
+    def log_decision(decision):
+        logger.info("%s", decision, extra={"event": "decision", **decision})
+
+    daemon = BarDaemon(arguments.stock, arguments.resolution, arguments.days, arguments.atr, arguments.multiplier,
+                       arguments.dema, on_signal=log_decision)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: daemon.stop())
+    daemon.run()
@@ -1,6 +1,5 @@
-import access_token
 import repository
-import pandas as pd
+import candle_buffer
 
 STOCK_NAME = "HINDUNILVR"
 RESOLUTION = "5"
@@ -16,12 +15,7 @@ BUY_SIDE = 1
 SELL_SIDE = -1
 
 # Variables
-OPEN_VALUES = []
-HIGH_VALUES = []
-LOW_VALUES = []
-CLOSE_VALUES = []
-EPOCH_VALUES = []
-EMA_VALUES = []
+CANDLE_CAPACITY = 20000  # candles kept in memory
 FLAG = 0
 
 # orderId = ""
@@ -37,23 +31,18 @@ FLAG = 0
 stock_meta_data = repository.pass_stock_data(STOCK_NAME, RESOLUTION, FROM_DAYS)
 
 # Getting the entire data of the stock
-entire_stock_data = access_token.get_fyers_entry_point().history(stock_meta_data)
+entire_stock_data = repository.get_history_data(stock_meta_data)
 
 # length of entire stock data
 length_of_entire_stock_data = len(entire_stock_data['candles'])
 
-for i in range(len((entire_stock_data)["candles"])):
-    EPOCH_VALUES.append((entire_stock_data)["candles"][i][0])
-    OPEN_VALUES.append((entire_stock_data)["candles"][i][1])
-    HIGH_VALUES.append((entire_stock_data)["candles"][i][2])
-    LOW_VALUES.append((entire_stock_data)["candles"][i][3])
-    CLOSE_VALUES.append((entire_stock_data)["candles"][i][4])
+# Candles live in a fixed size buffer, every column is a contiguous numpy view
+candles = candle_buffer.CandleBuffer(CANDLE_CAPACITY)
+candles.extend(repository.get_candle_columns(entire_stock_data))
 #***********************************************************************************************************************
 
 
-dataframe_data = pd.DataFrame(
-    {"HIGH": repository.list_to_numpy_array(HIGH_VALUES), "LOW": repository.list_to_numpy_array(LOW_VALUES),
-     "CLOSE": repository.list_to_numpy_array(CLOSE_VALUES)})
+dataframe_data = candles.columns()
 
 print(repository.get_supertrend(dataframe_data,supertrend_ATR,supertrend_Multiplier))
 
@@ -0,0 +1,246 @@
+import threading
+import collections
+import talib
+import repository
+import streaming_indicators
+import numpy as np
+import pandas as pd
+
+CACHE_SIZE = 64  # series kept, the least recently used one is dropped first
+EXTEND_LIMIT = 256  # new candles fed through the streaming state, a bigger jump is computed again in one batch
+SAMPLES = 8  # values compared besides the last two to tell that a series is the cached one
+
+
+class _Entry:
+    """
+    One cached series: its indicator outputs in buffers with spare room at the end, the streaming state that
+    continues them and a few sampled input values to recognise the series again
+    """
+    __slots__ = ("length", "outputs", "state", "positions", "samples")
+
+    def __init__(self, inputs, outputs, state):
+        self.length = len(inputs[-1])
+        self.outputs = [np.array(values, copy=True) for values in outputs]
+        self.state = state
+        self.remember(inputs)
+
+    def remember(self, inputs):
+        """
+        Samples the inputs at fixed positions, always including the last two candles
+        :param inputs: arrays the indicator was computed from
+        """
+        self.positions = np.unique(np.concatenate([np.linspace(0, self.length - 1, SAMPLES).astype(np.int64),
+                                                   [max(self.length - 2, 0), self.length - 1]]))
+        # compared as raw bytes, cheaper than np.array_equal and NaN matches NaN
+        self.samples = [values[self.positions].tobytes() for values in inputs]
+
+    def matches(self, inputs):
+        """
+        Tells if the inputs start with the cached series, only the sampled positions are compared
+        :param inputs: arrays the indicator is asked for
+        :return: bool
+        """
+        return len(inputs[-1]) >= self.length and all(
+            values[self.positions].tobytes() == samples for values, samples in zip(inputs, self.samples))
+
+    def append(self, rows):
+        """
+        Adds the outputs of new candles, the buffers double when they are full
+        :param rows: one tuple of output values per new candle
+        """
+        end = self.length + len(rows)
+        if end > len(self.outputs[0]):
+            capacity = max(2 * len(self.outputs[0]), end)
+            for index, values in enumerate(self.outputs):
+                grown = np.empty(capacity, dtype=values.dtype)
+                grown[:self.length] = values[:self.length]
+                self.outputs[index] = grown
+        for index, values in enumerate(zip(*rows)):
+            self.outputs[index][self.length:end] = values
+        self.length = end
+
+    def view(self):
+        """
+        :return: read only views of the outputs, appending later never changes what they show
+        """
+        views = []
+        for values in self.outputs:
+            values = values[:self.length]
+            values.flags.writeable = False
+            views.append(values)
+        return views
+
+
+class IndicatorCache:
+    """
+    Remembers indicator results per input series and parameters, a series that grew by a few candles since the
+    last call is extended with the streaming states instead of being computed again
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        """
+        :param maxsize: number of series kept
+        """
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.extensions = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, key, inputs, compute, extend):
+        """
+        Returns the outputs for the inputs from the cache, extending or computing them when needed
+        :param key: indicator name and parameters
+        :param inputs: float64 arrays the indicator is computed from
+        :param compute: function(inputs) returning (outputs, state)
+        :param extend: function(state, inputs, start) returning one tuple of outputs per candle from start on
+        :return: list of read only arrays
+        """
+        n = len(inputs[-1])
+        if n < 2:
+            with self.lock:
+                self.misses += 1
+            return list(compute(inputs)[0])
+        # the first value of every input tells series apart, the samples confirm the rest
+        key = key + tuple(float(values[0]) for values in inputs)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.matches(inputs) and n - entry.length <= EXTEND_LIMIT:
+                self.entries.move_to_end(key)
+                if entry.length == n:
+                    self.hits += 1
+                else:
+                    entry.append(extend(entry.state, inputs, entry.length))
+                    entry.remember(inputs)
+                    self.extensions += 1
+                return entry.view()
+            self.misses += 1
+
+        outputs, state = compute(inputs)
+        entry = _Entry(inputs, outputs, state)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return entry.view()
+
+    def ema(self, close_values, period: int):
+        """
+        Same values as repository.get_ema
+        :param close_values: close values in list or numpy form
+        :param period: Looks for the previous specific number of candles for calculation, user-defined integer
+        :return: read only array
+        """
+        def compute(inputs):
+            return [talib.EMA(inputs[0], period)], streaming_indicators.EMAState.from_history(inputs[0], period)
+
+        def extend(state, inputs, start):
+            return [(state.update(close, close, close),) for close in inputs[0][start:].tolist()]
+
+        return self._get(("EMA", int(period)), [_as_array(close_values)], compute, extend)[0]
+
+    def dema(self, close_values, period: int):
+        """
+        Same values as repository.get_dema
+        :param close_values: close values in list or numpy form
+        :param period: 5 or 10 or 15 in integer value
+        :return: read only array
+        """
+        def compute(inputs):
+            return [talib.DEMA(inputs[0], period)], streaming_indicators.DEMAState.from_history(inputs[0], period)
+
+        def extend(state, inputs, start):
+            return [(state.update(close, close, close),) for close in inputs[0][start:].tolist()]
+
+        return self._get(("DEMA", int(period)), [_as_array(close_values)], compute, extend)[0]
+
+    def supertrend(self, high_values, low_values, close_values, atr_period: int, multiplier):
+        """
+        Same values as repository.get_supertrend_arrays
+        :param high_values: HIGH values
+        :param low_values: LOW values
+        :param close_values: CLOSE values
+        :param atr_period: value defined by us
+        :param multiplier: value defined by us
+        :return: supertrend, final lowerband, final upperband, atr as read only arrays
+        """
+        def compute(inputs):
+            arrays = repository.get_supertrend_arrays(*inputs, atr_period, multiplier)
+            if len(inputs[2]) < atr_period:
+                return arrays, streaming_indicators.SupertrendState.from_history(*inputs, atr_period, multiplier)
+            return arrays, streaming_indicators.SupertrendState.from_arrays(inputs[2], arrays, atr_period, multiplier)
+
+        def extend(state, inputs, start):
+            rows = []
+            for high, low, close in zip(*(values[start:].tolist() for values in inputs)):
+                rows.append((*state.update(high, low, close), state.atr))
+            return rows
+
+        inputs = [_as_array(high_values), _as_array(low_values), _as_array(close_values)]
+        return tuple(self._get(("Supertrend", int(atr_period), float(multiplier)), inputs, compute, extend))
+
+    def stats(self):
+        """
+        :return: dictionary with hits, extensions, misses, evictions and the number of cached series
+        """
+        with self.lock:
+            return {"hits": self.hits, "extensions": self.extensions, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self.entries)}
+
+    def clear(self):
+        """
+        Drops every cached series, the counters are kept
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+def _as_array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+default_cache = IndicatorCache()
+
+
+def get_supertrend(df, atr_period, multiplier, cache=None):
+    """
+    repository.get_supertrend through the indicator cache
+    :param df: Dataframe or dictionary with HIGH, LOW, CLOSE
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :param cache: IndicatorCache, None means default_cache
+    :return: upperband and lowerband
+    """
+    supertrend, final_lowerband, final_upperband, _ = (cache or default_cache).supertrend(
+        df['HIGH'], df['LOW'], df['CLOSE'], atr_period, multiplier)
+    return pd.DataFrame({
+        'Supertrend': supertrend,
+        'Final Lowerband': final_lowerband,
+        'Final Upperband': final_upperband
+    }, index=getattr(df, 'index', None))
+
+
+def get_dema(close_values, time_period: int, cache=None):
+    """
+    repository.get_dema through the indicator cache
+    :param close_values: close values in list or numpy form
+    :param time_period: 5 or 10 or 15 in integer value
+    :param cache: IndicatorCache, None means default_cache
+    :return: DEMA
+    """
+    return (cache or default_cache).dema(close_values, time_period).tolist()
+
+
+def get_ema(close_values, period, cache=None):
+    """
+    repository.get_ema through the indicator cache
+    :param close_values: close values in list or numpy form
+    :param period: user-defined integer
+    :param cache: IndicatorCache, None means default_cache
+    :return: EMA Value
+    """
+    return (cache or default_cache).ema(close_values, period)
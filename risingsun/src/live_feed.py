@@ -0,0 +1,266 @@
+import csv
+import time
+import queue
+import threading
+import repository
+import candle_buffer
+import session_calendar
+import streaming_indicators
+
+
+class ReplayFeed:
+    """
+    Replays ticks saved in a CSV file with epoch,ltp,volume rows, so the live path runs without a network
+    """
+
+    def __init__(self, path: str, speed=None):
+        """
+        :param path: CSV file, a header row is skipped
+        :param speed: None replays as fast as possible, 1.0 keeps the recorded gaps, 10.0 is ten times faster
+        """
+        self.path = path
+        self.speed = speed
+
+    def __iter__(self):
+        previous_epoch = None
+        with open(self.path, "r", newline="") as f:
+            for row in csv.reader(f):
+                try:
+                    epoch, ltp, volume = float(row[0]), float(row[1]), float(row[2])
+                except (ValueError, IndexError):
+                    continue
+                if self.speed and previous_epoch is not None and epoch > previous_epoch:
+                    time.sleep((epoch - previous_epoch) / self.speed)
+                previous_epoch = epoch
+                yield epoch, ltp, volume
+
+
+class QueueFeed:
+    """
+    Feed filled from another thread, for example by the FYERS websocket on_message callback
+    """
+
+    def __init__(self):
+        self.ticks = queue.SimpleQueue()
+
+    def push(self, epoch, ltp, volume=0.0):
+        """
+        Adds one tick
+        :param epoch: exchange time of the tick
+        :param ltp: last traded price
+        :param volume: quantity traded in this tick
+        """
+        self.ticks.put((epoch, ltp, volume))
+
+    def push_clock(self, now):
+        """
+        Adds a clock mark, run_feed closes the bars that ended by now instead of waiting for the next tick
+        :param now: current EPOCH
+        """
+        self.ticks.put((now, None, 0.0))
+
+    def close(self):
+        """
+        Ends the iteration once the queued ticks are consumed
+        """
+        self.ticks.put(None)
+
+    def __iter__(self):
+        while True:
+            tick = self.ticks.get()
+            if tick is None:
+                return
+            yield tick
+
+
+class CandleBuilder:
+    """
+    Aggregates ticks into OHLC bars aligned to the 09:15 session open, closed bars go to a ring buffer and to the
+    on_bar callbacks; a bar closes on close_due at its boundary, or on the first tick after it, and ticks outside
+    the 09:15 - 15:30 session never open a bar
+    """
+
+    def __init__(self, resolution_minutes: int, capacity=5000):
+        """
+        :param resolution_minutes: 1, 5, 15, ...
+        :param capacity: closed bars kept in memory
+        """
+        self.resolution_minutes = resolution_minutes
+        self.step = resolution_minutes * 60
+        self.bars = candle_buffer.CandleBuffer(capacity)
+        self.on_bar = []
+        self.current = None  # [epoch, open, high, low, close, volume] of the forming bar
+        self.current_end = None  # EPOCH the forming bar closes at
+        self.last_closed = None  # EPOCH of the last closed bar
+
+    def bar_start(self, epoch):
+        """
+        Returns the EPOCH of the bar a tick belongs to
+        :param epoch: time of the tick
+        :return: epoch
+        """
+        return session_calendar.bar_start(epoch, self.step)
+
+    def on_tick(self, epoch, ltp, volume=0.0):
+        """
+        Adds one tick, the forming bar is closed when a tick of a later bar arrives; a pre-open or after close
+        tick only closes a bar whose boundary has passed
+        :param epoch: time of the tick
+        :param ltp: last traded price
+        :param volume: quantity traded in this tick
+        :return: the bar that was closed, or None
+        """
+        start = self.bar_start(epoch)
+        current = self.current
+        if current is not None and start == current[0] and epoch < self.current_end:
+            if ltp > current[2]:
+                current[2] = ltp
+            elif ltp < current[3]:
+                current[3] = ltp
+            current[4] = ltp
+            current[5] += volume
+            return None
+        session_open, session_close = session_calendar.session_bounds(epoch)
+        if not session_open <= epoch < session_close:
+            return self.close_due(epoch)
+        if (current is not None and start < current[0]) or (self.last_closed is not None and start <= self.last_closed):
+            return None  # late tick of a bar that is already closed
+
+        closed = self.flush()
+        self.current = [start, ltp, ltp, ltp, ltp, volume]
+        self.current_end = session_calendar.bar_end(start, self.step)
+        return closed
+
+    def close_due(self, now):
+        """
+        Closes the forming bar once its boundary has passed, call it from a timer or the feed loop so the decision
+        does not wait for a tick of the next bar
+        :param now: current EPOCH
+        :return: the bar that was closed, or None
+        """
+        if self.current is not None and now >= self.current_end:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """
+        Closes the forming bar, for example at market close
+        :return: the bar that was closed, or None
+        """
+        if self.current is None:
+            return None
+        bar = tuple(self.current)
+        self.current = None
+        self.last_closed = bar[0]
+        self.bars.append(*bar)
+        for callback in self.on_bar:
+            callback(bar)
+        return bar
+
+
+class SignalEngine:
+    """
+    Keeps Supertrend, DEMA and EMA up to date one closed bar at a time and decides on every bar
+    """
+
+    def __init__(self, candle_columns=None, atr_period=12, multiplier=3, dema_period=3, ema_period=5,
+                 on_signal=None):
+        """
+        :param candle_columns: history to seed the indicators with, like repository.get_candle_columns returns
+        :param atr_period: Supertrend ATR period
+        :param multiplier: Supertrend multiplier
+        :param dema_period: DEMA period
+        :param ema_period: EMA period
+        :param on_signal: called with the decision dictionary of every bar
+        """
+        if candle_columns is None:
+            candle_columns = {column: [] for column in repository.CANDLE_COLUMNS}
+        high, low, close = candle_columns["HIGH"], candle_columns["LOW"], candle_columns["CLOSE"]
+        self.supertrend = streaming_indicators.SupertrendState.from_history(high, low, close, atr_period, multiplier)
+        self.dema = streaming_indicators.DEMAState.from_history(close, dema_period)
+        self.ema = streaming_indicators.EMAState.from_history(close, ema_period)
+        self.previous_high = float(high[-1]) if len(high) else float("nan")
+        self.on_signal = on_signal
+        self.last_latency = 0.0
+
+    def on_bar(self, bar):
+        """
+        Updates the indicators with a closed bar and decides
+        :param bar: (epoch, open, high, low, close, volume)
+        :return: decision dictionary
+        """
+        started = time.perf_counter()
+        epoch, _, high, low, close, _ = bar
+        previous_ema = self.ema.value
+        supertrend, _, _ = self.supertrend.update(high, low, close)
+        dema = self.dema.update(high, low, close)
+        ema = self.ema.update(high, low, close)
+
+        # same conditions as scanner.get_signal
+        if supertrend and close > dema:
+            signal = "BUY"
+        elif not supertrend:
+            signal = "SELL"
+        else:
+            signal = None
+        ema_breakout = previous_ema > self.previous_high and close > self.previous_high
+        self.previous_high = high
+
+        decision = {"epoch": epoch, "signal": signal, "ema_breakout": ema_breakout, "close": close, "dema": dema,
+                    "ema": ema, "supertrend": supertrend}
+        self.last_latency = time.perf_counter() - started
+        if self.on_signal is not None:
+            self.on_signal(decision)
+        return decision
+
+
+def run_feed(feed, builders: list):
+    """
+    Pushes every tick of a feed into the candle builders, returns when the feed ends
+    :param feed: iterable of (epoch, ltp, volume), an ltp of None is a clock mark like QueueFeed.push_clock
+    :param builders: CandleBuilder objects, one per resolution
+    """
+    for epoch, ltp, volume in feed:
+        if ltp is None:
+            for builder in builders:
+                builder.close_due(epoch)
+            continue
+        for builder in builders:
+            builder.on_tick(epoch, ltp, volume)
+    for builder in builders:
+        builder.flush()
+
+
+def start_bar_clock(feed: QueueFeed, step: int, clock=time.time):
+    """
+    Pushes a clock mark into the feed at every bar close from a daemon thread, so bars close on their boundary
+    :param feed: QueueFeed read by run_feed
+    :param step: bar length in seconds, the smallest one of the builders
+    :param clock: returns the current EPOCH
+    :return: threading.Event, set it to stop the thread
+    """
+    stopped = threading.Event()
+
+    def run():
+        while True:
+            boundary = session_calendar.next_bar_close(clock(), step)
+            if stopped.wait(max(boundary - clock(), 0.0)):
+                return
+            feed.push_clock(boundary)
+
+    threading.Thread(target=run, name="bar-clock", daemon=True).start()
+    return stopped
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay ticks from a CSV file through the live indicator engine")
+    parser.add_argument("path", help="CSV file with epoch,ltp,volume rows")
+    parser.add_argument("--resolution", type=int, default=5)
+    parser.add_argument("--speed", type=float, default=None)
+    arguments = parser.parse_args()
+
+    builder = CandleBuilder(arguments.resolution)
+    builder.on_bar.append(SignalEngine(on_signal=print).on_bar)
+    run_feed(ReplayFeed(arguments.path, arguments.speed), [builder])
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+LOGGER_NAME = "risingsun"
+LOG_LEVEL = os.environ.get("RISINGSUN_LOG_LEVEL", "INFO")  # WARNING skips the per trade records and summaries
+LOG_FILE = os.environ.get("RISINGSUN_LOG_FILE")  # JSON lines file, one object per record, if set
+CONSOLE_FORMAT = "%(asctime)s %(levelname)s %(name)s - %(message)s"
+
+# attributes every LogRecord has, whatever else is on a record came from extra= and is a structured field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object with its time, level, logger, message and every extra= field
+    """
+
+    def format(self, record):
+        entry = {"time": record.created, "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts the record on the queue as it is, the message is formatted on the listener thread instead of the
+    trading thread, so pass values as logging arguments and not objects that change afterwards
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _stop_listener():
+    """
+    Writes the queued records, stops the background thread and closes its handlers, so a file is not left open;
+    _listener_lock is held by the caller
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def configure(level=LOG_LEVEL, path=LOG_FILE, console=True, structured_console=False):
+    """
+    Sends every risingsun logger through a queue to a background thread that writes the console and the file
+    :param level: DEBUG, INFO, WARNING, ... or the logging constant
+    :param path: JSON lines file the records are also written to, None writes none
+    :param console: False keeps the console quiet, for example in a backtest sweep
+    :param structured_console: True prints JSON lines on the console as well
+    """
+    global _listener
+    with _listener_lock:
+        _stop_listener()
+
+        handlers = []
+        if console:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(StructuredFormatter() if structured_console
+                                         else logging.Formatter(CONSOLE_FORMAT))
+            handlers.append(console_handler)
+        if path is not None:
+            file_handler = logging.FileHandler(path)
+            file_handler.setFormatter(StructuredFormatter())
+            handlers.append(file_handler)
+
+        records = queue.SimpleQueue()
+        logger = logging.getLogger(LOGGER_NAME)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        logger.addHandler(_QueueHandler(records))
+        logger.setLevel(level)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def shutdown():
+    """
+    Writes the records still queued and stops the background thread, runs at exit
+    """
+    with _listener_lock:
+        _stop_listener()
+
+
+def get_logger(name: str):
+    """
+    Returns the logger of a module, the queue and its thread are set up on first use
+    :param name: module name like repository
+    :return: logging.Logger
+    """
+    if _listener is None:
+        configure()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+atexit.register(shutdown)
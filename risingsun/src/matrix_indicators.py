@@ -0,0 +1,192 @@
+import talib
+import repository
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, the Supertrend then steps through the bars with NumPy across symbols
+    njit = None
+    prange = range
+
+
+def to_matrix(series: list, n_bars=None):
+    """
+    Stacks the histories of many symbols into one (n_symbols, n_bars) matrix, aligned on the newest candle
+    :param series: 1-D arrays or lists, oldest value first, they may have different lengths
+    :param n_bars: columns of the matrix, None fits the longest history; longer histories keep their newest values
+    :return: float64 matrix, shorter histories are padded with NaN at the start
+    """
+    if n_bars is None:
+        n_bars = max((len(values) for values in series), default=0)
+    matrix = np.full((len(series), n_bars), np.nan)
+    for row, values in enumerate(series):
+        values = np.asarray(values, dtype=np.float64)[len(values) - min(len(values), n_bars):]
+        if len(values):
+            matrix[row, n_bars - len(values):] = values
+    return matrix
+
+
+def row_starts(values):
+    """
+    Returns the first column of every row that is not NaN padding
+    :param values: (n_symbols, n_bars) matrix
+    :return: int64 array, n_bars for a row that is all NaN
+    """
+    valid = ~np.isnan(values)
+    return np.where(valid.any(axis=1), valid.argmax(axis=1), values.shape[1]).astype(np.int64)
+
+
+def _supertrend_rows(high, low, close, starts, atr_period, multiplier):
+    """
+    Runs the 1-D Supertrend loop over the unpadded part of every row, rows are spread over the numba threads
+    :return: supertrend, final lowerband, final upperband, atr as (n_symbols, n_bars) matrices
+    """
+    n_symbols, n_bars = close.shape
+    supertrend = np.empty((n_symbols, n_bars), dtype=np.bool_)
+    final_lowerband = np.empty((n_symbols, n_bars))
+    final_upperband = np.empty((n_symbols, n_bars))
+    atr = np.empty((n_symbols, n_bars))
+    for row in prange(n_symbols):
+        start = starts[row]
+        for i in range(start):
+            supertrend[row, i] = False
+            final_lowerband[row, i] = final_upperband[row, i] = atr[row, i] = np.nan
+        # the rows of the outputs are filled in place, nothing is allocated per symbol
+        repository._supertrend_fill(high[row, start:], low[row, start:], close[row, start:], atr_period, multiplier,
+                                    supertrend[row, start:], final_lowerband[row, start:],
+                                    final_upperband[row, start:], atr[row, start:])
+    return supertrend, final_lowerband, final_upperband, atr
+
+
+_supertrend_rows_jit = njit(cache=True, parallel=True)(_supertrend_rows) if njit is not None else None
+
+
+def _supertrend_columns(high_t, low_t, close_t, starts, atr_period, multiplier):
+    """
+    Supertrend stepping through the bars, every step updates all symbols at once, same rules as
+    repository._supertrend_loop
+    :return: supertrend, final lowerband, final upperband, atr as (n_bars, n_symbols) matrices
+    """
+    n_bars, n_symbols = close_t.shape
+    supertrend = np.zeros((n_bars, n_symbols), dtype=np.bool_)
+    final_lowerband = np.full((n_bars, n_symbols), np.nan)
+    final_upperband = np.full((n_bars, n_symbols), np.nan)
+    atr = np.full((n_bars, n_symbols), np.nan)
+
+    decay = 1.0 - 1.0 / atr_period
+    weighted_sum = np.zeros(n_symbols)
+    weight = np.zeros(n_symbols)
+    previous_close = np.full(n_symbols, np.nan)
+    previous_supertrend = np.ones(n_symbols, dtype=np.bool_)
+    previous_lowerband = np.full(n_symbols, np.nan)
+    previous_upperband = np.full(n_symbols, np.nan)
+    for i in range(n_bars):
+        high, low, close = high_t[i], low_t[i], close_t[i]
+        count = i - starts + 1
+        active, first = count >= 1, count == 1
+
+        true_range = np.abs(high - low)
+        gaps = np.maximum(np.abs(high - previous_close), np.abs(previous_close - low))
+        true_range = np.where(first | ~(gaps > true_range), true_range, gaps)
+        weighted_sum = np.where(active, weighted_sum * decay + true_range, 0.0)
+        weight = np.where(active, weight * decay + 1.0, 0.0)
+        atr_i = np.where(count >= atr_period, weighted_sum / np.where(active, weight, 1.0), np.nan)
+
+        hl2 = (high + low) / 2
+        upperband = hl2 + (multiplier * atr_i)
+        lowerband = hl2 - (multiplier * atr_i)
+
+        crossed_up = close > previous_upperband
+        crossed_down = ~crossed_up & (close < previous_lowerband)
+        trend = np.where(first | crossed_up, True, np.where(crossed_down, False, previous_supertrend))
+        continued = ~first & ~crossed_up & ~crossed_down
+        lowerband = np.where(continued & trend & (lowerband < previous_lowerband), previous_lowerband, lowerband)
+        upperband = np.where(continued & ~trend & (upperband > previous_upperband), previous_upperband, upperband)
+        # the first candle keeps both bands, like the 1-D loop
+        upperband = np.where(trend & ~first, np.nan, upperband)
+        lowerband = np.where(~trend & ~first, np.nan, lowerband)
+
+        supertrend[i] = trend & active
+        final_lowerband[i] = np.where(active, lowerband, np.nan)
+        final_upperband[i] = np.where(active, upperband, np.nan)
+        atr[i] = atr_i
+        previous_close, previous_supertrend = close, trend
+        previous_lowerband, previous_upperband = lowerband, upperband
+    return supertrend, final_lowerband, final_upperband, atr
+
+
+def _as_matrix(values):
+    return np.ascontiguousarray(np.atleast_2d(np.asarray(values, dtype=np.float64)))
+
+
+def _talib_rows(function, close, period):
+    """
+    Runs a TA-Lib function over every row into one preallocated matrix, TA-Lib skips the NaN padding at the start
+    of a row by itself. This is deliberately one call per symbol, nothing is vectorised across symbols: an EMA
+    reads every price once and writes every output once, and TA-Lib already does that in C. On 500 x 10k bars
+    the per-row loop, a numba kernel stepping 8 interleaved symbols per bar and one stepping all symbols per bar
+    on the transposed matrix all took about 27 ms, against 13 ms for only copying the matrix; stepping the bars
+    with NumPy was 10 to 20 times slower. EMA is therefore about as fast as calling get_ema per symbol, DEMA only
+    gains by not turning the result into a list like get_dema
+    :param function: talib.EMA or talib.DEMA
+    :param close: (n_symbols, n_bars) CLOSE matrix
+    :param period: time period of the function
+    :return: (n_symbols, n_bars) matrix
+    """
+    close = _as_matrix(close)
+    out = np.empty(close.shape)
+    for row, values in enumerate(close):
+        out[row] = function(values, period)
+    return out
+
+
+def get_ema_matrix(close, period: int):
+    """
+    EMA of many symbols at once, every row matches repository.get_ema of its unpadded values
+    :param close: (n_symbols, n_bars) CLOSE matrix, shorter histories NaN padded at the start
+    :param period: Looks for the previous specific number of candles for calculation, user-defined integer
+    :return: (n_symbols, n_bars) matrix, NaN where the EMA has no value yet
+    """
+    return _talib_rows(talib.EMA, close, int(period))
+
+
+def get_dema_matrix(close, period: int):
+    """
+    DEMA of many symbols at once, every row matches repository.get_dema of its unpadded values
+    :param close: (n_symbols, n_bars) CLOSE matrix, shorter histories NaN padded at the start
+    :param period: 5 or 10 or 15 in integer value
+    :return: (n_symbols, n_bars) matrix, NaN where the DEMA has no value yet
+    """
+    return _talib_rows(talib.DEMA, close, int(period))
+
+
+def get_supertrend_matrix(high, low, close, atr_period: int, multiplier):
+    """
+    Supertrend of many symbols at once, every row matches repository.get_supertrend_arrays of its unpadded values
+    :param high: (n_symbols, n_bars) HIGH matrix, shorter histories NaN padded at the start
+    :param low: LOW matrix padded the same way
+    :param close: CLOSE matrix padded the same way
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: supertrend, final lowerband, final upperband, atr as (n_symbols, n_bars) matrices, padding is
+        False or NaN
+    """
+    high, low, close = _as_matrix(high), _as_matrix(low), _as_matrix(close)
+    starts = row_starts(close)
+    if _supertrend_rows_jit is not None:
+        return _supertrend_rows_jit(high, low, close, starts, int(atr_period), float(multiplier))
+    columns = _supertrend_columns(np.ascontiguousarray(high.T), np.ascontiguousarray(low.T),
+                                  np.ascontiguousarray(close.T), starts, int(atr_period), float(multiplier))
+    return tuple(np.ascontiguousarray(values.T) for values in columns)
+
+
+def get_atr_matrix(high, low, close, atr_period: int):
+    """
+    ATR used by the Supertrend (Wilder smoothing like pandas ewm with adjust=True) of many symbols at once
+    :param high: (n_symbols, n_bars) HIGH matrix, shorter histories NaN padded at the start
+    :param low: LOW matrix padded the same way
+    :param close: CLOSE matrix padded the same way
+    :param atr_period: value defined by us
+    :return: (n_symbols, n_bars) matrix, NaN till atr_period candles are seen
+    """
+    return get_supertrend_matrix(high, low, close, atr_period, 1.0)[3]
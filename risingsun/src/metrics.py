@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+
+ENABLED = os.environ.get("RISINGSUN_METRICS", "1") != "0"  # RISINGSUN_METRICS=0 turns every span into a no-op
+SUB_BUCKETS = 4  # buckets per doubling of the duration, a bucket is at most 25% wide
+MAX_BUCKETS = 64 * SUB_BUCKETS
+EXPORT_PATH = os.environ.get("RISINGSUN_METRICS_PATH")  # Prometheus text file written at exit, if set
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def _bucket_upper_bound(index: int):
+    """
+    Returns the largest duration that falls in a bucket
+    :param index: index in Histogram.counts
+    :return: nanoseconds
+    """
+    bits, sub = divmod(index, SUB_BUCKETS)
+    if bits < 3:
+        return (1 << bits) - 1
+    return ((5 + sub) << (bits - 3)) - 1
+
+
+class Histogram:
+    """
+    Durations of one stage in fixed log buckets, so recording is a few integer operations and never allocates.
+    record() takes no lock to stay well under a microsecond, two threads finishing the same stage in the same
+    instant can lose one count, which does not move the percentiles
+    """
+    __slots__ = ("name", "counts", "total", "maximum")
+
+    def __init__(self, name: str):
+        """
+        :param name: stage name like repository.history
+        """
+        self.name = name
+        self.counts = [0] * MAX_BUCKETS
+        self.total = 0
+        self.maximum = 0
+
+    def record(self, nanoseconds: int):
+        """
+        Adds one duration
+        :param nanoseconds: duration from time.perf_counter_ns
+        """
+        # SUB_BUCKETS linear steps inside every power of two, taken from the bits below the leading one
+        bits = nanoseconds.bit_length()
+        index = bits * SUB_BUCKETS + ((nanoseconds >> (bits - 3)) & 3) if bits >= 3 else bits * SUB_BUCKETS
+        self.counts[index if index < MAX_BUCKETS else MAX_BUCKETS - 1] += 1
+        self.total += nanoseconds
+        if nanoseconds > self.maximum:
+            self.maximum = nanoseconds
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, q: float):
+        """
+        Returns the upper bound of the bucket holding the q-th duration, never above the largest one seen
+        :param q: between 0 and 1, 0.99 is p99
+        :return: seconds
+        """
+        counts = list(self.counts)
+        count = sum(counts)
+        if count == 0:
+            return 0.0
+        rank = max(1, int(q * count + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(_bucket_upper_bound(index), self.maximum) / 1e9
+        return self.maximum / 1e9
+
+    def snapshot(self):
+        """
+        :return: dictionary with count, sum, mean, p50, p95, p99 and max, durations in seconds
+        """
+        count, total, maximum = sum(self.counts), self.total, self.maximum
+        return {"count": count, "sum": total / 1e9, "mean": total / count / 1e9 if count else 0.0,
+                "p50": self.percentile(0.50), "p95": self.percentile(0.95), "p99": self.percentile(0.99),
+                "max": maximum / 1e9}
+
+
+def histogram(name: str):
+    """
+    Returns the histogram of a stage, it is created on first use
+    :param name: stage name like repository.history
+    :return: Histogram
+    """
+    found = _histograms.get(name)
+    if found is None:
+        with _histograms_lock:
+            found = _histograms.setdefault(name, Histogram(name))
+    return found
+
+
+class span:
+    """
+    Times the block of a with statement into the histogram of a stage
+
+        with metrics.span("repository.history"):
+            data = client.history(data2)
+    """
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, name: str):
+        """
+        :param name: stage name like repository.history
+        """
+        self.histogram = histogram(name)
+        self.started = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if ENABLED:
+            self.histogram.record(time.perf_counter_ns() - self.started)
+        return False
+
+
+def timed(name: str):
+    """
+    Decorator timing every call of a function into the histogram of a stage, with RISINGSUN_METRICS=0 the
+    function is returned undecorated
+    :param name: stage name like repository.get_supertrend
+    :return: decorator
+    """
+    def decorator(function):
+        if not ENABLED:
+            return function
+        stage = histogram(name)
+        counts = stage.counts
+        perf_counter_ns = time.perf_counter_ns
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                # Histogram.record inlined, the method call alone would be a third of the budget
+                nanoseconds = perf_counter_ns() - started
+                bits = nanoseconds.bit_length()
+                index = bits * SUB_BUCKETS + ((nanoseconds >> (bits - 3)) & 3) if bits >= 3 else bits * SUB_BUCKETS
+                counts[index if index < MAX_BUCKETS else MAX_BUCKETS - 1] += 1
+                stage.total += nanoseconds
+                if nanoseconds > stage.maximum:
+                    stage.maximum = nanoseconds
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Returns the summary of every stage that recorded at least once
+    :return: {stage: {count, sum, mean, p50, p95, p99, max}}
+    """
+    with _histograms_lock:
+        histograms = list(_histograms.values())
+    return {stage.name: stage.snapshot() for stage in sorted(histograms, key=lambda stage: stage.name)
+            if stage.count}
+
+
+def reset():
+    """
+    Forgets every recorded duration, the stages stay registered
+    """
+    with _histograms_lock:
+        for stage in _histograms.values():
+            stage.counts[:] = [0] * MAX_BUCKETS  # in place, timed() wrappers hold the list
+            stage.total = stage.maximum = 0
+
+
+def dump_json(path=None):
+    """
+    Returns the summary of every stage as JSON
+    :param path: file the JSON is also written to
+    :return: JSON text
+    """
+    text = json.dumps(snapshot(), indent=2)
+    if path is not None:
+        with open(path, "w") as f:
+            f.write(text)
+    return text
+
+
+def dump_prometheus(path=None, metric="risingsun_stage_seconds"):
+    """
+    Returns the summary of every stage in the Prometheus text format, for the node exporter textfile collector
+    :param path: file the text is also written to, replaced atomically so a scrape never reads half of it
+    :param metric: metric name
+    :return: text
+    """
+    lines = [f"# HELP {metric} Duration of the stages of the signal to order pipeline", f"# TYPE {metric} summary"]
+    for name, summary in snapshot().items():
+        for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+            lines.append(f'{metric}{{stage="{name}",quantile="{quantile}"}} {summary[key]:.9f}')
+        lines.append(f'{metric}_sum{{stage="{name}"}} {summary["sum"]:.9f}')
+        lines.append(f'{metric}_count{{stage="{name}"}} {summary["count"]}')
+    text = "\n".join(lines) + "\n"
+    if path is not None:
+        with open(path + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+    return text
+
+
+def export_periodically(path: str, interval=15.0):
+    """
+    Rewrites the Prometheus text file from a daemon thread, for processes that run the whole session
+    :param path: file to write
+    :param interval: seconds between writes
+    :return: threading.Event, set it to stop the thread
+    """
+    stopped = threading.Event()
+
+    def export():
+        while not stopped.wait(interval):
+            dump_prometheus(path)
+
+    threading.Thread(target=export, name="metrics-export", daemon=True).start()
+    return stopped
+
+
+if EXPORT_PATH:
+    atexit.register(dump_prometheus, EXPORT_PATH)
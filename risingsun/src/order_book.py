@@ -0,0 +1,409 @@
+import time
+import queue
+import logs
+import metrics
+import threading
+import access_token
+
+# FYERS order status codes
+CANCELLED = 1
+TRADED = 2
+TRANSIT = 4
+REJECTED = 5
+PENDING = 6
+OPEN_STATUSES = frozenset((TRANSIT, PENDING))
+
+logger = logs.get_logger("order_book")
+
+
+class OrderState:
+    """
+    What the book knows about one order
+    """
+    __slots__ = ("order_id", "symbol", "side", "qty", "filled_qty", "average_price", "status", "type",
+                 "limit_price", "stop_price", "product_type", "updated")
+
+    def __init__(self, order_id, symbol, side, qty, type=2, limit_price=0.0, stop_price=0.0, product_type="",
+                 status=PENDING):
+        self.order_id = str(order_id)
+        self.symbol = symbol
+        self.side = int(side)
+        self.qty = int(qty)
+        self.filled_qty = 0
+        self.average_price = 0.0  # of the filled part
+        self.status = status
+        self.type = int(type)
+        self.limit_price = float(limit_price or 0)
+        self.stop_price = float(stop_price or 0)
+        self.product_type = product_type
+        self.updated = time.time()
+
+    @property
+    def is_open(self):
+        return self.status in OPEN_STATUSES
+
+    @property
+    def remaining_qty(self):
+        return self.qty - self.filled_qty if self.is_open else 0
+
+
+class PositionState:
+    """
+    Net quantity of one symbol, positive is long and negative short
+    """
+    __slots__ = ("symbol", "qty", "average_price", "realised_pnl")
+
+    def __init__(self, symbol, qty=0, average_price=0.0):
+        self.symbol = symbol
+        self.qty = int(qty)
+        self.average_price = float(average_price)
+        self.realised_pnl = 0.0
+
+
+class EventQueue:
+    """
+    Fill event stream filled from another thread, for example by the FYERS order websocket on_message callback
+    """
+
+    def __init__(self):
+        self.events = queue.SimpleQueue()
+
+    def push(self, event: dict):
+        """
+        Adds one event
+        :param event: FYERS order update dictionary
+        """
+        self.events.put(event)
+
+    def close(self):
+        """
+        Ends the iteration once the queued events are consumed
+        """
+        self.events.put(None)
+
+    def __iter__(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            yield event
+
+
+class OrderBook:
+    """
+    Orders and positions kept in memory, updated from order responses and order update events, so the trading
+    loop answers "am I long", "what is open" and "how much is exposed" without a network call; the broker is only
+    asked in reconcile
+    """
+
+    def __init__(self):
+        self.orders = {}  # order ID -> OrderState
+        self.open_orders_by_symbol = {}  # symbol -> {order ID: OrderState} of the open orders
+        self.positions = {}  # symbol -> PositionState
+        self.gross_exposure = 0.0  # sum of abs(qty) * average price over the positions
+        self.active_symbols = set()  # symbols with a position or an open order
+        # called with (order, qty, price, realised PnL, quantity that opened or grew the position) for every fill,
+        # the order already counts the fill; the lock is held
+        self.fill_listeners = []
+        self.order_listeners = []  # called with the OrderState after every change of an order, the lock is held
+        self.lock = threading.Lock()
+        self.last_reconcile = None
+
+    def _refresh_active(self, symbol):
+        position = self.positions.get(symbol)
+        if (position is not None and position.qty) or self.open_orders_by_symbol.get(symbol):
+            self.active_symbols.add(symbol)
+        else:
+            self.active_symbols.discard(symbol)
+
+    def _track_open(self, order):
+        open_orders = self.open_orders_by_symbol.setdefault(order.symbol, {})
+        if order.is_open:
+            open_orders[order.order_id] = order
+        else:
+            open_orders.pop(order.order_id, None)
+        self._refresh_active(order.symbol)
+        for listener in self.order_listeners:
+            listener(order)
+
+    def on_order_placed(self, order_data: dict, order_id):
+        """
+        Records an order FYERS accepted
+        :param order_data: dictionary made by repository.create_buy_data or create_sell_data
+        :param order_id: ID in the place_order response
+        """
+        order = OrderState(order_id, order_data["symbol"], order_data["side"], order_data["qty"],
+                           order_data.get("type", 2), order_data.get("limitPrice"), order_data.get("stopPrice"),
+                           order_data.get("productType", ""))
+        with self.lock:
+            known = self.orders.get(order.order_id)
+            if known is not None:
+                return  # an update event was faster than the response
+            self.orders[order.order_id] = order
+            self._track_open(order)
+
+    def _apply_fill(self, order, qty, price):
+        """
+        Moves the position of the order's symbol by one fill, the lock is held by the caller
+        """
+        position = self.positions.get(order.symbol)
+        if position is None:
+            position = self.positions[order.symbol] = PositionState(order.symbol)
+        self.gross_exposure -= abs(position.qty) * position.average_price
+
+        signed_qty = order.side * qty
+        realised = 0.0
+        closed = 0
+        if position.qty and (position.qty > 0) != (signed_qty > 0):
+            closed = min(abs(position.qty), qty)
+            realised = (price - position.average_price) * closed * (1 if position.qty > 0 else -1)
+            position.realised_pnl += realised
+            if qty > abs(position.qty):
+                position.average_price = price  # went through flat into the other side
+        else:
+            position.average_price = ((position.average_price * abs(position.qty) + price * qty)
+                                      / (abs(position.qty) + qty))
+        position.qty += signed_qty
+        if position.qty == 0:
+            position.average_price = 0.0
+        self.gross_exposure += abs(position.qty) * position.average_price
+        self._refresh_active(order.symbol)
+        for listener in self.fill_listeners:
+            listener(order, qty, price, realised, qty - closed)
+
+    def _apply_difference(self, symbol, broker):
+        """
+        Moves the position of a symbol to the broker's by fills of a stand in order, for trades the book has no
+        order for; a reduction is valued at the local average price since its exit price is not known. The lock is
+        held by the caller
+        """
+        broker_qty, broker_price = (0, 0.0) if broker is None else (broker.qty, broker.average_price)
+        position = self.positions.get(symbol)
+        qty, price = (0, 0.0) if position is None else (position.qty, position.average_price)
+        if qty == broker_qty:
+            return
+        if qty and (broker_qty == 0 or (qty > 0) != (broker_qty > 0) or abs(broker_qty) < abs(qty)):
+            closed = abs(qty) if (qty > 0) != (broker_qty > 0) or not broker_qty else abs(qty) - abs(broker_qty)
+            self._apply_fill(OrderState("reconcile", symbol, -1 if qty > 0 else 1, closed), closed, price)
+            qty -= closed if qty > 0 else -closed
+        if qty != broker_qty:
+            # the price that moves the average of the position to the broker's
+            added = abs(broker_qty) - abs(qty)
+            fill_price = (abs(broker_qty) * broker_price - abs(qty) * price) / added
+            self._apply_fill(OrderState("reconcile", symbol, 1 if broker_qty > 0 else -1, added), added, fill_price)
+
+    def on_order_update(self, update: dict):
+        """
+        Applies a FYERS order update, filledQty and tradedPrice are totals of the order so an update seen twice or
+        out of order never counts a fill twice
+        :param update: dictionary with id, status, filledQty, tradedPrice and, for orders not placed through this
+            book, symbol, side, qty, type, limitPrice, stopPrice, productType
+        """
+        with self.lock:
+            self._apply_update(update)
+
+    def _apply_update(self, update):
+        """
+        Body of on_order_update, the lock is held by the caller
+        """
+        order_id = str(update["id"])
+        order = self.orders.get(order_id)
+        if order is None:
+            order = self.orders[order_id] = OrderState(
+                order_id, update["symbol"], update["side"], update["qty"], update.get("type", 2),
+                update.get("limitPrice"), update.get("stopPrice"), update.get("productType", ""))
+        if "qty" in update:
+            order.qty = int(update["qty"])  # modified orders
+        filled_qty = int(update.get("filledQty", order.filled_qty))
+        new_qty = filled_qty - order.filled_qty
+        if new_qty > 0:
+            # the price of the new part follows from the average of the whole fill
+            traded_price = float(update.get("tradedPrice") or 0)
+            price = (traded_price * filled_qty - order.average_price * order.filled_qty) / new_qty
+            order.filled_qty, order.average_price = filled_qty, traded_price
+        if "status" in update:
+            order.status = int(update["status"])
+        elif order.filled_qty >= order.qty:
+            order.status = TRADED
+        order.updated = time.time()
+        if new_qty > 0:
+            # the order is already updated, so a fill listener sees the filled part and what is left in one step
+            self._apply_fill(order, new_qty, price)
+        self._track_open(order)
+
+    def on_fill(self, order_id, qty: int, price: float):
+        """
+        Applies one fill of an order known to the book, for feeds that send every trade
+        :param order_id: ID of the order
+        :param qty: quantity of this fill
+        :param price: price of this fill
+        """
+        with self.lock:
+            # read and applied under one lock, so two fills of the same order at once are both counted
+            order = self.orders[str(order_id)]
+            filled_qty = order.filled_qty + qty
+            average_price = (order.average_price * order.filled_qty + price * qty) / filled_qty
+            self._apply_update({"id": order_id, "filledQty": filled_qty, "tradedPrice": average_price})
+
+    def consume(self, events):
+        """
+        Applies every event of a stream, returns when the stream ends
+        :param events: iterable of FYERS order update dictionaries, like EventQueue
+        """
+        for event in events:
+            self.on_order_update(event)
+
+    def position(self, symbol: str) -> int:
+        """
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :return: net quantity, 0 when flat
+        """
+        position = self.positions.get(symbol)
+        return 0 if position is None else position.qty
+
+    def average_price(self, symbol: str) -> float:
+        """
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :return: average price of the open position, 0 when flat
+        """
+        position = self.positions.get(symbol)
+        return 0.0 if position is None else position.average_price
+
+    def exposure(self, symbol=None) -> float:
+        """
+        :param symbol: like NSE:HINDUNILVR-EQ, None sums every symbol
+        :return: abs(quantity) * average price
+        """
+        if symbol is None:
+            return self.gross_exposure
+        position = self.positions.get(symbol)
+        return 0.0 if position is None else abs(position.qty) * position.average_price
+
+    def open_orders(self, symbol: str):
+        """
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :return: list of the OrderState objects still working
+        """
+        with self.lock:
+            return list(self.open_orders_by_symbol.get(symbol, {}).values())
+
+    def get_order(self, order_id):
+        """
+        :param order_id: ID of the order
+        :return: OrderState or None
+        """
+        return self.orders.get(str(order_id))
+
+    @metrics.timed("order_book.reconcile")
+    def reconcile(self, client=None):
+        """
+        Replaces the book with the broker's order book and positions and reports where they disagreed; orders
+        that changed locally after the broker was asked, and the positions of their symbols, are kept as they are
+        since the broker's answer is older. Fills the book missed go through the fill listeners like any other
+        fill, so the RiskEngine's day counters see them
+        :param client: object with FyersModel orderbook() and positions(), None means the FYERS entry point
+        :return: list of difference dictionaries, None when the broker could not be asked
+        """
+        if client is None:
+            client = access_token.get_fyers_entry_point()
+        asked = time.time()
+        order_response, position_response = client.orderbook(), client.positions()
+        if order_response.get("s") != "ok" or position_response.get("s") != "ok":
+            logger.warning("Reconcile failed - %s %s", order_response, position_response,
+                           extra={"event": "reconcile_failed"})
+            return None
+
+        orders = {}
+        for entry in order_response.get("orderBook") or []:
+            order = OrderState(entry["id"], entry["symbol"], entry["side"], entry["qty"], entry.get("type", 2),
+                               entry.get("limitPrice"), entry.get("stopPrice"), entry.get("productType", ""),
+                               int(entry.get("status", PENDING)))
+            order.filled_qty = int(entry.get("filledQty", 0))
+            order.average_price = float(entry.get("tradedPrice") or 0)
+            orders[order.order_id] = order
+        positions = {}
+        for entry in position_response.get("netPositions") or []:
+            # FYERS has one row per symbol and product type, the book nets them per symbol
+            qty = int(entry.get("netQty", 0))
+            if not qty:
+                continue
+            price = float(entry.get("netAvg", entry.get("avgPrice", 0.0)))
+            position = positions.get(entry["symbol"])
+            if position is None:
+                positions[entry["symbol"]] = PositionState(entry["symbol"], qty, price)
+                continue
+            # average weighted by size, so the exposure is the sum of the rows' exposures
+            cost, size = abs(position.qty) * position.average_price + abs(qty) * price, abs(position.qty) + abs(qty)
+            position.qty += qty
+            position.average_price = cost / size
+        positions = {symbol: position for symbol, position in positions.items() if position.qty}
+
+        with self.lock:
+            newer = {order_id: order for order_id, order in self.orders.items() if order.updated >= asked}
+            newer_symbols = {order.symbol for order in newer.values()}
+            differences = []
+            for symbol in (set(self.positions) | set(positions)) - newer_symbols:
+                local, broker = self.position(symbol), positions[symbol].qty if symbol in positions else 0
+                if local != broker:
+                    differences.append({"symbol": symbol, "local_qty": local, "broker_qty": broker})
+            for order_id in (set(self.orders) | set(orders)) - set(newer):
+                local, broker = self.orders.get(order_id), orders.get(order_id)
+                local_state = None if local is None else (local.status, local.filled_qty)
+                broker_state = None if broker is None else (broker.status, broker.filled_qty)
+                if local_state != broker_state:
+                    differences.append({"order_id": order_id, "local": local_state, "broker": broker_state})
+
+            for order_id, order in orders.items():
+                local = self.orders.get(order_id)
+                if order_id in newer or order.filled_qty <= (0 if local is None else local.filled_qty):
+                    continue
+                filled_qty, average_price = (0, 0.0) if local is None else (local.filled_qty, local.average_price)
+                new_qty = order.filled_qty - filled_qty
+                price = (order.average_price * order.filled_qty - average_price * filled_qty) / new_qty
+                self._apply_fill(order, new_qty, price)
+            for symbol in (set(self.positions) | set(positions)) - newer_symbols:
+                self._apply_difference(symbol, positions.get(symbol))
+
+            for symbol, position in self.positions.items():
+                # realised PnL is only known locally, keep it
+                if symbol in positions:
+                    positions[symbol].realised_pnl = position.realised_pnl
+            orders.update(newer)
+            for symbol in newer_symbols:
+                if symbol in self.positions:
+                    positions[symbol] = self.positions[symbol]
+                else:
+                    positions.pop(symbol, None)
+            self.orders = orders
+            self.positions = positions
+            self.open_orders_by_symbol = {}
+            for order in orders.values():
+                self._track_open(order)
+            self.gross_exposure = sum(abs(position.qty) * position.average_price for position in positions.values())
+            self.active_symbols = {symbol for symbol, position in positions.items() if position.qty} | {
+                symbol for symbol, open_orders in self.open_orders_by_symbol.items() if open_orders}
+            self.last_reconcile = time.time()
+
+        for difference in differences:
+            logger.warning("Book differed from the broker - %s", difference,
+                           extra={"event": "reconcile_difference", **difference})
+        return differences
+
+    def reconcile_periodically(self, client=None, interval=60.0):
+        """
+        Reconciles from a daemon thread, the trading loop keeps reading the book in between
+        :param client: object with FyersModel orderbook() and positions(), None means the FYERS entry point
+        :param interval: seconds between reconciles
+        :return: threading.Event, set it to stop the thread
+        """
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.wait(interval):
+                try:
+                    self.reconcile(client)
+                except Exception:
+                    logger.exception("Reconcile failed", extra={"event": "reconcile_failed"})
+
+        threading.Thread(target=run, name="order-book-reconcile", daemon=True).start()
+        return stopped
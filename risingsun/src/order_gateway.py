@@ -0,0 +1,196 @@
+import asyncio
+import access_token
+from concurrent.futures import ThreadPoolExecutor
+
+FYERS_BASKET_LIMIT = 10  # orders accepted by one place_basket_orders call
+
+
+class OrderRejected(Exception):
+    """
+    Raised through the order future when FYERS does not accept an order
+    """
+
+    def __init__(self, response):
+        super().__init__(f"Order rejected - {response}")
+        self.response = response
+
+
+class OrderGateway:
+    """
+    Queues orders made by repository.create_buy_data / create_sell_data and sends them without blocking the
+    caller, orders that arrive together go out together (as a basket when the client supports it)
+    """
+
+    def __init__(self, client=None, max_batch=FYERS_BASKET_LIMIT, batch_window=0.001, max_workers=20, book=None,
+                 risk=None):
+        """
+        :param client: object with the FyersModel order methods, None means the FYERS entry point
+        :param max_batch: most orders sent in one basket
+        :param batch_window: seconds to wait for more orders before sending a batch
+        :param max_workers: HTTP calls in flight at the same time
+        :param book: order_book.OrderBook that records every accepted order, None uses the book of risk
+        :param risk: risk_engine.RiskEngine, an order breaking a limit fails with RiskRejected and is never sent
+        """
+        self.client = client
+        self.book = risk.book if book is None and risk is not None else book
+        self.risk = risk
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.queue = None
+        self.worker = None
+        self.dispatches = set()
+
+    def _get_client(self):
+        if self.client is None:
+            self.client = access_token.get_fyers_entry_point()
+        return self.client
+
+    async def _call(self, method_name: str, data):
+        """
+        Runs a blocking client method on the thread pool
+        :param method_name: FyersModel method like place_order
+        :param data: argument of the method
+        :return: response
+        """
+        method = getattr(self._get_client(), method_name)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, method, data)
+
+    def submit(self, order_data: dict):
+        """
+        Queues an order and returns at once
+        :param order_data: dictionary made by create_buy_data or create_sell_data
+        :return: asyncio future resolving to the order ID
+        """
+        loop = asyncio.get_running_loop()
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = loop.create_task(self._run())
+        future = loop.create_future()
+        reservation = None
+        if self.risk is not None:
+            # approved and reserved at once, so orders submitted together cannot all pass the same limit
+            try:
+                reservation = self.risk.approve(order_data)
+            except Exception as error:
+                future.set_exception(error)
+                return future
+        if self.book is not None:
+            future.add_done_callback(lambda done: self._record(order_data, reservation, done))
+        self.queue.put_nowait((order_data, future))
+        return future
+
+    def _record(self, order_data, reservation, future):
+        if not future.cancelled() and future.exception() is None:
+            self.book.on_order_placed(order_data, future.result())
+            if self.risk is not None:
+                self.risk.bind(reservation, future.result())
+        elif self.risk is not None:
+            self.risk.release(reservation)
+
+    async def place_orders(self, orders: list):
+        """
+        Places many orders concurrently
+        :param orders: dictionaries made by create_buy_data or create_sell_data
+        :return: list of order IDs, or the exception of each failed order
+        """
+        return await asyncio.gather(*[self.submit(order_data) for order_data in orders], return_exceptions=True)
+
+    async def modify_order(self, modify_data: dict):
+        """
+        :param modify_data: contains all details as per FYERS API to modify order
+        :return: FYERS response
+        """
+        return await self._call("modify_order", modify_data)
+
+    async def cancel_order(self, cancel_order_id: dict):
+        """
+        :param cancel_order_id: contains all details as per FYERS API to cancel order
+        :return: FYERS response
+        """
+        return await self._call("cancel_order", cancel_order_id)
+
+    async def exit_order(self, exit_order_data: dict):
+        """
+        :param exit_order_data: contains all details as per FYERS API to exit positions
+        :return: FYERS response
+        """
+        return await self._call("exit_positions", exit_order_data)
+
+    async def _run(self):
+        """
+        Takes everything waiting in the queue, up to max_batch, and dispatches it without waiting for the reply
+        """
+        running = True
+        while running:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            if self.batch_window:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+            self.dispatches.add(task)
+            task.add_done_callback(self.dispatches.discard)
+
+    async def _dispatch(self, batch: list):
+        """
+        Sends one batch, as a basket when possible, otherwise as concurrent single orders
+        :param batch: list of (order_data, future)
+        """
+        if len(batch) > 1 and hasattr(self._get_client(), "place_basket_orders"):
+            try:
+                response = await self._call("place_basket_orders", [order_data for order_data, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    _settle(future, error=error)
+                return
+            replies = response.get("data") if isinstance(response, dict) else None
+            if not isinstance(replies, list) or len(replies) != len(batch):
+                for _, future in batch:
+                    _settle(future, error=OrderRejected(response))
+                return
+            for (_, future), reply in zip(batch, replies):
+                _settle_reply(future, reply.get("body", reply))
+            return
+
+        async def place_one(order_data, future):
+            try:
+                _settle_reply(future, await self._call("place_order", order_data))
+            except Exception as error:
+                _settle(future, error=error)
+
+        await asyncio.gather(*[place_one(order_data, future) for order_data, future in batch])
+
+    async def close(self):
+        """
+        Sends what is still queued, waits for the replies and stops the gateway
+        """
+        if self.worker is not None and not self.worker.done():
+            self.queue.put_nowait(None)
+            await self.worker
+        if self.dispatches:
+            await asyncio.gather(*self.dispatches, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+
+def _settle_reply(future, reply):
+    if isinstance(reply, dict) and reply.get("s") == "ok" and "id" in reply:
+        _settle(future, result=reply["id"])
+    else:
+        _settle(future, error=OrderRejected(reply))
+
+
+def _settle(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
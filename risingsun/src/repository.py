@@ -1,15 +1,31 @@
 import time
+import logs
+import itertools
+import metrics
 import access_token
+import candle_store
 import numpy as np
 import pandas as pd
 import talib
 from datetime import datetime
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the Supertrend loop runs as plain Python without it
+    njit = None
+
 MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November',
           'December']
 
-CURRENT_TIME = int(time.time())
+CANDLE_COLUMNS = ("EPOCH", "OPEN", "HIGH", "LOW", "CLOSE", "VOLUME")  # order of values in a FYERS candle
+
+logger = logs.get_logger("repository")
+
+CURRENT_TIME = int(time.time())  # import time of the module, pass_stock_data reads the clock on every call instead
 MARKET_OPEN_TIME = 9.25  # in hours
+MARKET_CLOSE_TIME = 15.5  # in hours
+FUNDS = 50000  # money a backtest starts with
+RISK_PER_TRADE = 500  # most money lost on one trade when its stop loss is hit
 
 
 def get_custom_epoch(days: int) -> int:
@@ -31,9 +47,7 @@ def get_custom_date(days: int):
     :return: date
     """
     epoch_time = get_custom_epoch(days)
-    year = time.localtime(epoch_time)[0]
-    month = time.localtime(epoch_time)[1]
-    date = time.localtime(epoch_time)[2]
+    year, month, date = time.localtime(epoch_time)[:3]
     months_in_name = MONTHS[month - 1]
     return f"{date} {months_in_name}, {year}"
 
@@ -44,79 +58,118 @@ def get_current_day_time_hour():
     :return: days (float)
     '''
     now = datetime.now()
-    current_hour, current_minute = int(now.strftime("%H")), int(now.strftime("%M"))
-    current_time_in_hours = current_hour + (current_minute / 60)
+    current_time_in_hours = now.hour + (now.minute / 60)
     return (current_time_in_hours - MARKET_OPEN_TIME) / 24
 
 
-def pass_stock_data(stock_name: str, resolution: str, from_days: int, to_days=CURRENT_TIME, cont_flag="1",
+def pass_stock_data(stock_name: str, resolution: str, from_days: int, to_days=None, cont_flag="1",
                     date_format="0", ):
     """
     Returns the dictionary(key-value pair)
     :param stock_name:
     :param resolution: Time frame of a chart i.e., 5min, 10min, 15min, etc.
     :param from_days: Data lene ke liye defined days pehle se
-    :param to_days: Current Time is already defined
+    :param to_days: EPOCH the data ends at, None means the time of this call
     :param cont_flag: Flag need for FYERS API
     :param date_format: As defined in the FYERS API
     :return:data
     """
-    print("\nGenerating String of Stock Meta Data")
     data = {"symbol": f"NSE:{stock_name}-EQ", "resolution": f"{resolution}", "date_format": f"{date_format}",
             "range_from": get_custom_epoch(from_days),
-            "range_to": CURRENT_TIME, "cont_flag": "1"}
-    print("Generated String of Stock Meta Data is - \n", data, "\n")
+            "range_to": int(time.time()) if to_days is None else int(to_days), "cont_flag": "1"}
+    logger.debug("Generated String of Stock Meta Data is - %s", data, extra={"event": "stock_meta_data", **data})
     return data
 
 
-def get_history_data(data2: dict):
+@metrics.timed("repository.get_history_data")
+def get_history_data(data2: dict, store=None, client=None):
     """
-    Return the dictionary which contains Stock data
-    :param data2:
+    Return the dictionary which contains Stock data, only the candles missing from the local store are fetched
+    :param data2: dictionary made by pass_stock_data
+    :param store: CandleStore to use, None means the default one on disk, False skips the store
+    :param client: object with a FYERS style history() method, None means the FYERS entry point
     :return: data
     """
-
-    data = access_token.get_fyers_entry_point().history(data2)
-    return data
-
-
-def get_supertrend(df, atr_period, multiplier):
-    """
-    Returns the values of Supertrend
-    :param df: Excel jaisa table dikhta hain Dataframe  mein, else wo list rahegi
+    if client is None:
+        client = access_token.get_fyers_entry_point()
+    if store is False:
+        with metrics.span("repository.history"):
+            return client.history(data2)
+    if store is None:
+        store = candle_store.CandleStore()
+
+    symbol, resolution = data2["symbol"], data2["resolution"]
+    range_from, range_to = int(data2["range_from"]), int(data2["range_to"])
+    for missing_from, missing_to in store.missing_ranges(symbol, resolution, range_from, range_to):
+        fetched = []
+        for chunk_from, chunk_to in candle_store.split_range(resolution, missing_from, missing_to):
+            with metrics.span("repository.history"):
+                data = client.history({**data2, "range_from": chunk_from, "range_to": chunk_to})
+            if data.get("s") not in ("ok", "no_data"):
+                return data
+            fetched.extend(data.get("candles", []))
+        with metrics.span("repository.candle_store_merge"):
+            store.merge(symbol, resolution, np.array(fetched, dtype=np.float64), missing_from, missing_to)
+
+    return {"s": "ok", "candles": store.get(symbol, resolution, range_from, range_to)}
+
+
+@metrics.timed("repository.get_candle_columns")
+def get_candle_columns(history_data: dict):
+    """
+    Converts the candles of a FYERS history() response into contiguous column arrays
+    :param history_data: dictionary returned by get_history_data
+    :return: dictionary of EPOCH, OPEN, HIGH, LOW, CLOSE, VOLUME float64 arrays
+    """
+    candles = history_data.get("candles", [])
+    if isinstance(candles, np.ndarray):
+        candles = candles.reshape(-1, len(CANDLE_COLUMNS))
+    else:
+        candles = np.fromiter(itertools.chain.from_iterable(candles), dtype=np.float64,
+                              count=len(candles) * len(CANDLE_COLUMNS)).reshape(-1, len(CANDLE_COLUMNS))
+    # one transposed copy makes every column contiguous, so TA-Lib and the Supertrend loop use it without copying
+    columns = np.ascontiguousarray(candles.T)
+    return dict(zip(CANDLE_COLUMNS, columns))
+
+
+def _supertrend_fill(high, low, close, atr_period, multiplier, supertrend, final_lowerband, final_upperband, atr):
+    """
+    Single pass Supertrend written into arrays the caller owns (numba compiles this when it is installed)
+    :param high: HIGH values, float64 array or list
+    :param low: LOW values, float64 array or list
+    :param close: CLOSE values, float64 array or list
     :param atr_period: value defined by us
     :param multiplier: value defined by us
-    :return: upperband and lowerband
-    """
-    high = df['HIGH']
-    low = df['LOW']
-    close = df['CLOSE']
-
-    # calculate ATR
-    price_diffs = [high - low,
-                   high - close.shift(),
-                   close.shift() - low]
-    true_range = pd.concat(price_diffs, axis=1)
-    true_range = true_range.abs().max(axis=1)
-
-    # default ATR calculation in supertrend indicator
-    atr = true_range.ewm(alpha=1 / atr_period, min_periods=atr_period).mean()
-
-    # df['atr'] = df['tr'].rolling(atr_period).mean()
-
-    # HL2 is simply the average of high and low prices
-    hl2 = (high + low) / 2
-
-    # upperband and lowerband calculation
-    # notice that final bands are set to be equal to the respective bands
-    final_upperband = upperband = hl2 + (multiplier * atr)
-    final_lowerband = lowerband = hl2 - (multiplier * atr)
-
-    # initialize Supertrend column to True
-    supertrend = [True] * len(df)
-
-    for i in range(1, len(df.index)):
-        curr, prev = i, i - 1
+    :param supertrend: bool array of len(close) the trend goes to
+    :param final_lowerband: float64 array of len(close)
+    :param final_upperband: float64 array of len(close)
+    :param atr: float64 array of len(close)
+    """
+    n = len(close)
+
+    # ATR is the same as pandas ewm(alpha=1 / atr_period, min_periods=atr_period).mean() with adjust=True
+    decay = 1.0 - 1.0 / atr_period
+    weighted_sum = 0.0
+    weight = 0.0
+
+    for curr in range(n):
+        prev = curr - 1
+
+        true_range = abs(high[curr] - low[curr])
+        if curr > 0:
+            true_range = max(true_range, abs(high[curr] - close[prev]), abs(close[prev] - low[curr]))
+        weighted_sum = weighted_sum * decay + true_range
+        weight = weight * decay + 1.0
+        atr[curr] = weighted_sum / weight if curr >= atr_period - 1 else np.nan
+
+        # HL2 is simply the average of high and low prices
+        hl2 = (high[curr] + low[curr]) / 2
+        final_upperband[curr] = hl2 + (multiplier * atr[curr])
+        final_lowerband[curr] = hl2 - (multiplier * atr[curr])
+
+        if curr == 0:
+            supertrend[curr] = True
+            continue
 
         # if current close price crosses above upperband
         if close[curr] > final_upperband[prev]:
@@ -129,24 +182,84 @@ def get_supertrend(df, atr_period, multiplier):
             supertrend[curr] = supertrend[prev]
 
             # adjustment to the final bands
-            if supertrend[curr] == True and final_lowerband[curr] < final_lowerband[prev]:
+            if supertrend[curr] and final_lowerband[curr] < final_lowerband[prev]:
                 final_lowerband[curr] = final_lowerband[prev]
-            if supertrend[curr] == False and final_upperband[curr] > final_upperband[prev]:
+            if not supertrend[curr] and final_upperband[curr] > final_upperband[prev]:
                 final_upperband[curr] = final_upperband[prev]
 
         # to remove bands according to the trend direction
-        if supertrend[curr] == True:
+        if supertrend[curr]:
             final_upperband[curr] = np.nan
         else:
             final_lowerband[curr] = np.nan
 
+
+def _supertrend_loop(high, low, close, atr_period, multiplier):
+    """
+    Single pass Supertrend over plain arrays (numba compiles this when it is installed)
+    :param high: HIGH values, float64 array or list
+    :param low: LOW values, float64 array or list
+    :param close: CLOSE values, float64 array or list
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: supertrend, final lowerband, final upperband, atr
+    """
+    n = len(close)
+    supertrend = np.empty(n, dtype=np.bool_)
+    final_lowerband = np.empty(n, dtype=np.float64)
+    final_upperband = np.empty(n, dtype=np.float64)
+    atr = np.empty(n, dtype=np.float64)
+    _supertrend_fill(high, low, close, atr_period, multiplier, supertrend, final_lowerband, final_upperband, atr)
+    return supertrend, final_lowerband, final_upperband, atr
+
+
+if njit is not None:
+    _supertrend_fill = njit(cache=True)(_supertrend_fill)
+    _supertrend_jit = njit(cache=True)(_supertrend_loop)
+else:
+    _supertrend_jit = None
+
+
+def get_supertrend_arrays(high, low, close, atr_period, multiplier):
+    """
+    Returns the values of Supertrend as NumPy arrays, without going through pandas
+    :param high: HIGH values
+    :param low: LOW values
+    :param close: CLOSE values
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: supertrend, final lowerband, final upperband, atr
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+
+    if _supertrend_jit is not None:
+        return _supertrend_jit(high, low, close, int(atr_period), float(multiplier))
+    # plain Python floats index a lot faster than NumPy scalars
+    return _supertrend_loop(high.tolist(), low.tolist(), close.tolist(), int(atr_period), float(multiplier))
+
+
+@metrics.timed("repository.get_supertrend")
+def get_supertrend(df, atr_period, multiplier):
+    """
+    Returns the values of Supertrend
+    :param df: Excel jaisa table dikhta hain Dataframe  mein, else wo list rahegi
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :return: upperband and lowerband
+    """
+    supertrend, final_lowerband, final_upperband, _ = get_supertrend_arrays(df['HIGH'], df['LOW'], df['CLOSE'],
+                                                                            atr_period, multiplier)
+
     return pd.DataFrame({
         'Supertrend': supertrend,
         'Final Lowerband': final_lowerband,
         'Final Upperband': final_upperband
-    }, index=df.index)
+    }, index=getattr(df, 'index', None))
 
 
+@metrics.timed("repository.get_dema")
 def get_dema(close_values: list, time_period: int):
     """
     Returns the value of DEMA
@@ -155,7 +268,7 @@ def get_dema(close_values: list, time_period: int):
     :return: DEMA
     """
 
-    dema = talib.DEMA(np.array(close_values), timeperiod=time_period)
+    dema = talib.DEMA(np.asarray(close_values, dtype=np.float64), timeperiod=time_period)
     return dema.tolist()
 
 
@@ -167,7 +280,7 @@ def get_dema_last_value(close_values: list, time_period: int):
     :return: DEMA
     """
 
-    dema = talib.DEMA(np.array(close_values), timeperiod=time_period)
+    dema = talib.DEMA(np.asarray(close_values, dtype=np.float64), timeperiod=time_period)
     return dema[-1]
 
 
@@ -190,6 +303,7 @@ def list_to_npdf(list: list):
     return pd.DataFrame(numpy_list)
 
 
+@metrics.timed("repository.get_ema")
 def get_ema(close_values, period):
     """
     Gives the EMA value
@@ -197,11 +311,103 @@ def get_ema(close_values, period):
     :param period: Looks for the previous specific number of candles for calculation, user-defined integer
     :return: EMA Value
     """
-    value = talib.EMA(np.array(close_values), period)
+    value = talib.EMA(np.asarray(close_values, dtype=np.float64), period)
 
     return value
 
 
+def _supertrend_dema_loop(close, buy_signal, supertrend, per):
+    """
+    Pairs every buy with its sell for the Supertrend + DEMA strategy (numba compiles this when installed)
+    :param close: CLOSE values
+    :param buy_signal: True where Supertrend is up and CLOSE is above DEMA
+    :param supertrend: Supertrend column, a False candle sells
+    :param per: sell percentage criteria, CLOSE above buy value * per also sells
+    :return: buy indices, sell indices
+    """
+    n = len(close)
+    buy_indices = np.empty(n // 2 + 1, dtype=np.int64)
+    sell_indices = np.empty(n // 2 + 1, dtype=np.int64)
+    trade_counter = 0
+    buy_value = 0.0
+    a = 0
+
+    for i in range(n):
+        if a != 1:
+            if buy_signal[i]:
+                buy_indices[trade_counter] = i
+                buy_value = close[i]
+                a = 1
+        elif not supertrend[i] or buy_value * per < close[i]:
+            sell_indices[trade_counter] = i
+            trade_counter += 1
+            a = 0
+
+    return buy_indices[:trade_counter], sell_indices[:trade_counter]
+
+
+_supertrend_dema_jit = njit(cache=True)(_supertrend_dema_loop) if njit is not None else None
+
+
+def get_supertrend_dema_signals(df, atr_period, multiplier, dema_time_period):
+    """
+    Computes Supertrend and DEMA once and returns the buy and sell conditions of every candle
+    :param df: HIGH, LOW, CLOSE columns (Dataframe or dictionary of arrays)
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :param dema_time_period: DEMA period
+    :return: buy signal, sell signal (boolean arrays)
+    """
+    close = np.asarray(df['CLOSE'], dtype=np.float64)
+    supertrend = get_supertrend_arrays(df['HIGH'], df['LOW'], close, atr_period, multiplier)[0]
+    dema = talib.DEMA(close, timeperiod=dema_time_period)
+    return supertrend & (close > dema), ~supertrend
+
+
+def get_supertrend_dema_trades(close_values, buy_signal, sell_signal, per):
+    """
+    Returns the candles where the Supertrend + DEMA strategy buys and sells
+    :param close_values: CLOSE values
+    :param buy_signal: buy condition from get_supertrend_dema_signals
+    :param sell_signal: sell condition from get_supertrend_dema_signals
+    :param per: sell percentage criteria
+    :return: buy indices, sell indices
+    """
+    close = np.asarray(close_values, dtype=np.float64)
+    buy_signal = np.asarray(buy_signal, dtype=np.bool_)
+    supertrend = ~np.asarray(sell_signal, dtype=np.bool_)
+    if _supertrend_dema_jit is not None:
+        return _supertrend_dema_jit(close, buy_signal, supertrend, float(per))
+    return _supertrend_dema_loop(close.tolist(), buy_signal.tolist(), supertrend.tolist(), float(per))
+
+
+@metrics.timed("repository.get_trade_diff_result")
+def get_trade_diff_result(df, atr_period, multiplier, dema_time_period, per):
+    """
+    Runs the Supertrend + DEMA strategy of experiments.py in linear time
+    :param df: HIGH, LOW, CLOSE columns (Dataframe or dictionary of arrays)
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :param dema_time_period: DEMA period
+    :param per: sell percentage criteria
+    :return: list of [serial_number, buy_dict, sell_dict, trade_diff, discrete_diff]
+    """
+    close = np.asarray(df['CLOSE'], dtype=np.float64)
+    buy_signal, sell_signal = get_supertrend_dema_signals(df, atr_period, multiplier, dema_time_period)
+    buy_indices, sell_indices = get_supertrend_dema_trades(close, buy_signal, sell_signal, per)
+    buy_values, sell_values = close[buy_indices], close[sell_indices]
+    trade_diffs = sell_values - buy_values
+    discrete_diffs = np.cumsum(trade_diffs)
+
+    trade_diff_result = []
+    for serial_number, (buy_index, buy_value, sell_index, sell_value, trade_diff, discrete_diff) in enumerate(
+            zip(buy_indices.tolist(), buy_values.tolist(), sell_indices.tolist(), sell_values.tolist(),
+                trade_diffs.tolist(), discrete_diffs.tolist()), start=1):
+        trade_diff_result.append([serial_number, {"index": buy_index, "value": buy_value},
+                                  {"index": sell_index, "value": sell_value}, trade_diff, discrete_diff])
+    return trade_diff_result
+
+
 def ema_initializer(HIGH_VALUES,
                     CLOSE_VALUES,
                     LOW_VALUES,
@@ -245,9 +451,8 @@ def ema_initializer(HIGH_VALUES,
                 buy_value = CLOSE_VALUES[i + 1]
                 total_amount_invested = buy_value * quantity
 
-                print("Index at BUY candle is = ", i)
-                print("Stop loss is = ", stop_loss)
-                print("BUY\n")
+                logger.info("BUY at index %d, stop loss is = %s", i, stop_loss,
+                            extra={"event": "buy", "index": i, "price": buy_value, "stop_loss": stop_loss})
 
                 min = LOW_VALUES[i] if LOW_VALUES[i] < LOW_VALUES[i + 1] else LOW_VALUES[i + 1]
                 stop_loss = min
@@ -283,10 +488,9 @@ def ema_initializer(HIGH_VALUES,
             trade_counter = trade_counter + 1
             stop_loss_counter = stop_loss_counter + 1
 
-            print(("2nd"))
-            print("Index at SELL candle is = ", i)
-            print("PnL value is = ", profit_loss_value)
-            print("SELL")
+            logger.info("SELL (2nd) at index %d, PnL value is = %s", i, profit_loss_value,
+                        extra={"event": "sell", "rule": "stop_loss", "index": i, "price": sell_value,
+                               "pnl": profit_loss_value})
 
         # STOP LOSS method-2 for Sell
         elif ((CLOSE_VALUES[i] < stop_loss) and FLAG == 1 and rr_method2_breaker_flag == 1):
@@ -294,13 +498,11 @@ def ema_initializer(HIGH_VALUES,
             rr_method2_breaker_flag = 0
 
             sell_value = CLOSE_VALUES[i + 1]
-            print("sell /2 ==== 2")
             # sell_order(create_sell_data(symbol,type,quantity2,SELL_SIDE,product_type,sell_value,stop_price))
 
-            print(("2nd"))
-            print("Index at SELL candle is = ", i)
-            print("PnL value is = ", profit_loss_value)
-            print("SELL")
+            logger.info("SELL /2 (2nd) at index %d, PnL value is = %s", i, profit_loss_value,
+                        extra={"event": "sell", "rule": "stop_loss_2", "index": i, "price": sell_value,
+                               "pnl": profit_loss_value})
 
         # Target method for Sell
         elif ((CLOSE_VALUES[i] > target_value1) and FLAG == 1 and rr_method2_breaker_flag == 1):
@@ -308,14 +510,12 @@ def ema_initializer(HIGH_VALUES,
             rr_method2_breaker_flag = 0
 
             sell_value = CLOSE_VALUES[i + 1]
-            print("sell /2 ====2 ")
 
             # sell_order(create_sell_data(symbol,type,quantity2,SELL_SIDE,product_type,sell_value,stop_price))
 
-            print(("2nd"))
-            print("Index at SELL candle is = ", i)
-            print("PnL value is = ", profit_loss_value)
-            print("SELL")
+            logger.info("SELL /2 (2nd) at index %d, PnL value is = %s", i, profit_loss_value,
+                        extra={"event": "sell", "rule": "target_2", "index": i, "price": sell_value,
+                               "pnl": profit_loss_value})
 
         # RR method for Sell
         elif ((CLOSE_VALUES[i] >= target_value1) and FLAG == 1):
@@ -326,10 +526,9 @@ def ema_initializer(HIGH_VALUES,
             final_pnl += profit_loss_value
             trade_counter = trade_counter + 1
 
-            print(("3rd"))
-            print("Index at SELL candle is = ", i)
-            print("PnL value is = ", profit_loss_value)
-            print("SELL")
+            logger.info("SELL (3rd) at index %d, PnL value is = %s", i, profit_loss_value,
+                        extra={"event": "sell", "rule": "target", "index": i, "price": sell_value,
+                               "pnl": profit_loss_value})
 
         # # RR method-2 for Sell
         # elif((CLOSE_VALUES[i] >= target_value2) and (rr_method2_breaker_flag == 0 ) ):
@@ -341,68 +540,108 @@ def ema_initializer(HIGH_VALUES,
         # # sell_order(create_sell_data(symbol,type,quantity2,SELL_SIDE,product_type,sell_value,stop_price))
         #     stop_loss = buy_value
 
-        else:
-            print("")
+    logger.info("Number of trades executed = %d, Final PnL is = %s, Number of stop loss hit = %d",
+                trade_counter, final_pnl, stop_loss_counter,
+                extra={"event": "backtest_summary", "symbol": symbol, "trade_count": trade_counter,
+                       "final_pnl": final_pnl, "stop_loss_count": stop_loss_counter})
+    # same keys as backtest.run_ema_backtest, callers print what they need whatever the log level
+    return {"trade_count": trade_counter, "final_pnl": final_pnl, "stop_loss_count": stop_loss_counter}
 
-    print("Number of trades executed = ", trade_counter)
-    print("Final PnL is = ", final_pnl)
-    print("Number of stop loss hit = ", stop_loss_counter)
 
-
-def place_order(buy_data):
+@metrics.timed("repository.place_order")
+def place_order(buy_data, book=None, risk=None):
     """
     Order place karta hain FYERS app mein
     :param buy_data: contains all details as per FYERS API to place order
-    :return: prints and returns placed order ID
-    """
+    :param book: order_book.OrderBook that records the placed order, None uses the book of risk
+    :param risk: risk_engine.RiskEngine, raises RiskRejected before FYERS is called if a limit is broken
+    :return: logs and returns placed order ID
+    """
+    reservation = None
+    if risk is not None:
+        reservation = risk.approve(buy_data)
+        book = risk.book if book is None else book
     orderId = ""
-    placed_order = access_token.get_fyers_entry_point().place_order(buy_data)
-    orderId = orderId + placed_order["id"]
-    print("Placed Order is - ", placed_order)
+    try:
+        placed_order = access_token.get_fyers_entry_point().place_order(buy_data)
+        orderId = orderId + placed_order["id"]
+    except Exception:
+        if risk is not None:
+            risk.release(reservation)
+        raise
+    if book is not None:
+        book.on_order_placed(buy_data, orderId)
+    if risk is not None:
+        risk.bind(reservation, orderId)
+    logger.info("Placed Order is - %s", placed_order, extra={"event": "place_order", "response": placed_order})
     return orderId
 
 
+@metrics.timed("repository.modify_order")
 def modify_order(modify_data):
     """
     Order Modify karta hain FYERS app mein
     :param modify_data: contains all details as per FYERS API to modify order
-    :return: prints and returns modified order ID
+    :return: logs and returns modified order ID
     """
     modified_order = access_token.get_fyers_entry_point().modify_order(modify_data)
-    print("Modified order is - ", modified_order)
+    logger.info("Modified order is - %s", modified_order,
+                extra={"event": "modify_order", "response": modified_order})
     return modified_order
 
 
+@metrics.timed("repository.cancel_order")
 def cancel_order(cancel_order_id):
     """
     Order Cancel karta hain FYERS app mein
     :param cancel_data: contains all details as per FYERS API to cancel order
-    :return: prints and returns cancelled order ID
+    :return: logs and returns cancelled order ID
     """
     cancelled_order = access_token.get_fyers_entry_point().cancel_order(cancel_order_id)
-    print("Cancelled order - ", cancelled_order)
+    logger.info("Cancelled order - %s", cancelled_order,
+                extra={"event": "cancel_order", "response": cancelled_order})
     return cancelled_order
 
 
+@metrics.timed("repository.exit_order")
 def exit_order(exit_order_data):
     """
     Order Exit karta hain FYERS app mein
     :param exit_data: contains all details as per FYERS API to exit order
-    :return: prints and returns exited order ID
+    :return: logs and returns exited order ID
     """
     exit_order = access_token.get_fyers_entry_point().exit_positions(exit_order_data)
-    print("Exited order - ", exit_order)
+    logger.info("Exited order - %s", exit_order, extra={"event": "exit_order", "response": exit_order})
     return exit_order
 
 
-def sell_order(sell_data):
+@metrics.timed("repository.sell_order")
+def sell_order(sell_data, book=None, risk=None):
     """
     Order Sell karta hain FYERS app mein
     :param modify_data: contains all details as per FYERS API to sell order
-    :return: prints and returns sold order ID
-    """
-    sold_order = access_token.get_fyers_entry_point().place_order(sell_data)
-    print("Sold order - ", sold_order)
+    :param book: order_book.OrderBook that records the placed order, None uses the book of risk
+    :param risk: risk_engine.RiskEngine, raises RiskRejected before FYERS is called if a limit is broken
+    :return: logs and returns sold order ID
+    """
+    reservation = None
+    if risk is not None:
+        reservation = risk.approve(sell_data)
+        book = risk.book if book is None else book
+    try:
+        sold_order = access_token.get_fyers_entry_point().place_order(sell_data)
+    except Exception:
+        if risk is not None:
+            risk.release(reservation)
+        raise
+    if sold_order.get("s") == "ok":
+        if book is not None:
+            book.on_order_placed(sell_data, sold_order["id"])
+        if risk is not None:
+            risk.bind(reservation, sold_order["id"])
+    elif risk is not None:
+        risk.release(reservation)
+    logger.info("Sold order - %s", sold_order, extra={"event": "sell_order", "response": sold_order})
     return sold_order
 
 
@@ -489,8 +728,16 @@ def create_sell_data(symbol,
 
     return sell_data
 
-def quantity(funds,stop_loss):
-
-    funds = 50000
-    risk_per_trade = 500
-    stoploss =
+def quantity(funds, stop_loss, buy_value, risk_per_trade=RISK_PER_TRADE):
+    """
+    Number of shares to buy so that hitting the stop loss loses at most risk_per_trade
+    :param funds: money available, the shares bought never cost more than this
+    :param stop_loss: price the position is sold at if the trade goes wrong
+    :param buy_value: price the shares are bought at
+    :param risk_per_trade: most money lost when the stop loss is hit
+    :return: whole number of shares, 0 when the stop loss is not below the buy value or funds are too low
+    """
+    risk_per_share = buy_value - stop_loss
+    if risk_per_share <= 0 or buy_value <= 0:
+        return 0
+    return max(int(min(risk_per_trade / risk_per_share, funds / buy_value)), 0)
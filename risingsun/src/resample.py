@@ -0,0 +1,138 @@
+import repository
+import candle_buffer
+import session_calendar
+import numpy as np
+
+
+def resample(candle_columns: dict, minutes: int):
+    """
+    Builds higher timeframe candles from finer ones, e.g. 15 or 60 minute candles from the 5 minute history
+    :param candle_columns: dictionary like repository.get_candle_columns returns, oldest candle first
+    :param minutes: bar length of the higher timeframe, the last bar of a day ends at market close
+    :return: dictionary of EPOCH, OPEN, HIGH, LOW, CLOSE, VOLUME arrays; like FYERS history() the last candle may
+        still be forming
+    """
+    epochs = session_calendar.bar_starts(candle_columns["EPOCH"], minutes)
+    if not len(epochs):
+        return {column: np.asarray(candle_columns[column])[:0] for column in repository.CANDLE_COLUMNS}
+    # every group of candles sharing a bar start becomes one bar, reduceat aggregates all groups at once
+    starts = np.flatnonzero(np.concatenate(([True], epochs[1:] != epochs[:-1])))
+    ends = np.append(starts[1:], len(epochs)) - 1
+    return {
+        "EPOCH": epochs[starts].astype(np.asarray(candle_columns["EPOCH"]).dtype),
+        "OPEN": np.asarray(candle_columns["OPEN"])[starts],
+        "HIGH": np.maximum.reduceat(np.asarray(candle_columns["HIGH"]), starts),
+        "LOW": np.minimum.reduceat(np.asarray(candle_columns["LOW"]), starts),
+        "CLOSE": np.asarray(candle_columns["CLOSE"])[ends],
+        "VOLUME": np.add.reduceat(np.asarray(candle_columns["VOLUME"]), starts),
+    }
+
+
+def resample_many(candle_columns: dict, minutes_list):
+    """
+    Builds every higher timeframe from one fetch of the finest one
+    :param candle_columns: dictionary like repository.get_candle_columns returns
+    :param minutes_list: bar lengths like (15, 60)
+    :return: dictionary of minutes to candle columns
+    """
+    return {minutes: resample(candle_columns, minutes) for minutes in minutes_list}
+
+
+class Resampler:
+    """
+    Builds higher timeframe bars one closed base bar at a time, a bar is closed as soon as the base bar that
+    ends it arrives; closed bars go to a ring buffer and to the on_bar callbacks like live_feed.CandleBuilder
+    """
+
+    def __init__(self, base_minutes: int, minutes: int, capacity=5000):
+        """
+        :param base_minutes: bar length of the bars fed in
+        :param minutes: bar length built, a multiple of base_minutes
+        :param capacity: closed bars kept in memory
+        """
+        if minutes % base_minutes:
+            raise ValueError(f"{minutes} minute bars cannot be built from {base_minutes} minute bars")
+        self.base_step = base_minutes * 60
+        self.minutes = minutes
+        self.step = minutes * 60
+        self.bars = candle_buffer.CandleBuffer(capacity)
+        self.on_bar = []
+        self.current = None  # [epoch, open, high, low, close, volume] of the forming bar
+        self.current_end = None  # EPOCH the forming bar ends at
+        self.last_closed = None  # EPOCH of the last closed bar
+
+    def bar_start(self, epoch):
+        """
+        Returns the EPOCH of the bar a base bar belongs to
+        :param epoch: EPOCH of the base bar
+        :return: epoch
+        """
+        return session_calendar.bar_start(epoch, self.step)
+
+    def bar_end(self, start):
+        """
+        Returns the EPOCH a bar ends at, the last bar of the day is cut at market close
+        :param start: EPOCH of the bar
+        :return: epoch
+        """
+        return session_calendar.bar_end(start, self.step)
+
+    def on_base_bar(self, bar):
+        """
+        Adds one closed base bar, can be appended to CandleBuilder.on_bar
+        :param bar: (epoch, open, high, low, close, volume)
+        :return: the bar that was closed, or None
+        """
+        epoch, open_, high, low, close, volume = bar
+        start = self.bar_start(epoch)
+        current = self.current
+        if (current is not None and start < current[0]) or (self.last_closed is not None and start <= self.last_closed):
+            return None  # late base bar of a bar that is already closed, the forming bar is left alone
+        closed = None
+        if current is not None and start != current[0]:
+            # the base bars that would have ended the forming bar never came
+            closed = self.flush()
+            current = None
+        if current is None:
+            current = self.current = [start, open_, high, low, close, volume]
+            self.current_end = self.bar_end(start)
+        else:
+            if high > current[2]:
+                current[2] = high
+            if low < current[3]:
+                current[3] = low
+            current[4] = close
+            current[5] += volume
+        if int(epoch) + self.base_step >= self.current_end:
+            closed = self.flush()
+        return closed
+
+    def extend(self, candle_columns: dict):
+        """
+        Adds many closed base bars at once
+        :param candle_columns: dictionary like repository.get_candle_columns returns
+        """
+        for bar in zip(*(np.asarray(candle_columns[column]).tolist() for column in repository.CANDLE_COLUMNS)):
+            self.on_base_bar(bar)
+
+    @property
+    def forming(self):
+        """
+        :return: the bar not closed yet as (epoch, open, high, low, close, volume), or None
+        """
+        return None if self.current is None else tuple(self.current)
+
+    def flush(self):
+        """
+        Closes the forming bar, for example at market close
+        :return: the bar that was closed, or None
+        """
+        if self.current is None:
+            return None
+        bar = tuple(self.current)
+        self.current = None
+        self.last_closed = bar[0]
+        self.bars.append(*bar)
+        for callback in self.on_bar:
+            callback(bar)
+        return bar
@@ -0,0 +1,240 @@
+import time
+import logs
+import itertools
+import threading
+import repository
+import order_book
+import session_calendar
+
+MAX_SYMBOL_EXPOSURE = 50000  # most money in one symbol, counted at the average price
+MAX_DAILY_EXPOSURE = 250000  # most money put into new positions in one day
+MAX_OPEN_POSITIONS = 5  # symbols with a position or a working order
+MAX_DAILY_LOSS = 1500  # no new positions once the realised loss of the day reaches this
+
+logger = logs.get_logger("risk_engine")
+
+
+class RiskRejected(Exception):
+    """
+    Raised when an order breaks a risk limit, before it is sent to FYERS
+    """
+
+    def __init__(self, reason, order_data):
+        super().__init__(f"Order rejected by risk - {reason}")
+        self.reason = reason
+        self.order_data = order_data
+
+
+class RiskEngine:
+    """
+    Sizes trades by the money risked down to the stop loss and checks every order against per symbol and per day
+    limits before place_order; positions come from an order_book.OrderBook and the day's counters are kept up to
+    date by its fills, so a check is a few dictionary lookups whatever the number of symbols.
+    An approved order reserves its value until it fills, is cancelled or is rejected, so orders still working
+    count against the limits as much as filled ones. The book's lock is taken before the engine's, in the same
+    order as the book's listeners, so a check never sees a fill half applied
+    """
+
+    def __init__(self, book: order_book.OrderBook, funds=repository.FUNDS, risk_per_trade=repository.RISK_PER_TRADE,
+                 max_symbol_exposure=MAX_SYMBOL_EXPOSURE, max_daily_exposure=MAX_DAILY_EXPOSURE,
+                 max_open_positions=MAX_OPEN_POSITIONS, max_daily_loss=MAX_DAILY_LOSS, clock=time.time):
+        """
+        :param book: OrderBook the orders and fills go through
+        :param funds: money available for trading
+        :param risk_per_trade: most money lost when a stop loss is hit
+        :param max_symbol_exposure: most money in one symbol
+        :param max_daily_exposure: most money put into new positions in one day
+        :param max_open_positions: most symbols with a position or a working order
+        :param max_daily_loss: realised loss of the day that stops new positions, exits are always allowed
+        :param clock: returns the current EPOCH, the day counters restart on a new IST day
+        """
+        self.book = book
+        self.funds = funds
+        self.risk_per_trade = risk_per_trade
+        self.max_symbol_exposure = max_symbol_exposure
+        self.max_daily_exposure = max_daily_exposure
+        self.max_open_positions = max_open_positions
+        self.max_daily_loss = max_daily_loss
+        self.clock = clock
+        self.day = None
+        self.day_exposure = 0.0  # money put into new or bigger positions today
+        self.day_pnl = 0.0  # realised today
+        self.realised_pnl = 0.0  # realised since the engine started
+        self.rejections = 0
+        self.last_prices = {}  # symbol -> price from on_price
+        self.reservations = {}  # reservation token or order ID -> [symbol, price, quantity not filled yet]
+        self.reserved_exposure = {}  # symbol -> value of its reservations
+        self.reserved_orders = {}  # symbol -> number of its reservations
+        self.reserved_total = 0.0
+        self.tokens = itertools.count(1)
+        self.lock = threading.Lock()
+        book.fill_listeners.append(self._on_fill)
+        book.order_listeners.append(self._on_order)
+
+    def _roll_day(self):
+        day = session_calendar.session_day(self.clock())
+        if day != self.day:
+            self.day = day
+            self.day_exposure = 0.0
+            self.day_pnl = 0.0
+
+    def _on_fill(self, order, qty, price, realised, opened_qty):
+        """
+        Keeps the day counters up to date and shrinks the order's reservation by the fill in the same step, called
+        by the OrderBook for every fill
+        """
+        with self.lock:
+            self._roll_day()
+            self.day_pnl += realised
+            self.realised_pnl += realised
+            self.day_exposure += opened_qty * price
+            entry = self.reservations.get(order.order_id)
+            if entry is not None:
+                self._set_reserved(order.order_id, entry, min(entry[2], order.remaining_qty))
+
+    def _on_order(self, order):
+        """
+        Shrinks the reservation of an order to its unfilled quantity, called by the OrderBook for every order change
+        """
+        with self.lock:
+            entry = self.reservations.get(order.order_id)
+            if entry is not None:
+                self._set_reserved(order.order_id, entry, min(entry[2], order.remaining_qty))
+
+    def _set_reserved(self, key, entry, qty):
+        symbol, price, reserved_qty = entry
+        change = (qty - reserved_qty) * price
+        self.reserved_exposure[symbol] += change
+        self.reserved_total += change
+        entry[2] = qty
+        if qty <= 0:
+            del self.reservations[key]
+            self.reserved_orders[symbol] -= 1
+            if not self.reserved_orders[symbol]:
+                del self.reserved_orders[symbol]
+                del self.reserved_exposure[symbol]
+
+    def bind(self, token, order_id):
+        """
+        Moves a reservation to the order ID FYERS gave the order, its fills and cancellation then release it
+        :param token: returned by approve, None is ignored
+        :param order_id: ID in the place_order response
+        """
+        with self.book.lock, self.lock:
+            entry = self.reservations.pop(token, None)
+            if entry is None:
+                return
+            order_id = str(order_id)
+            self.reservations[order_id] = entry
+            order = self.book.get_order(order_id)
+            if order is not None:
+                # the order changed in the book before the response came back
+                self._set_reserved(order_id, entry, min(entry[2], order.remaining_qty))
+
+    def release(self, token):
+        """
+        Gives back the reservation of an order that was never placed
+        :param token: returned by approve, None is ignored
+        """
+        with self.lock:
+            entry = self.reservations.get(token)
+            if entry is not None:
+                self._set_reserved(token, entry, 0)
+
+    def on_price(self, symbol: str, price: float):
+        """
+        Remembers the last price of a symbol, market orders are valued at it
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param price: last traded or CLOSE price
+        """
+        self.last_prices[symbol] = price
+
+    @property
+    def available_funds(self):
+        """
+        :return: funds plus the PnL realised since the engine started
+        """
+        return self.funds + self.realised_pnl
+
+    def quantity(self, symbol: str, buy_value: float, stop_loss: float):
+        """
+        Shares to buy so that the stop loss loses at most risk_per_trade, cut down to the room left under the
+        symbol and day exposure limits
+        :param symbol: like NSE:HINDUNILVR-EQ
+        :param buy_value: price the shares are bought at
+        :param stop_loss: price the position is sold at if the trade goes wrong
+        :return: whole number of shares, 0 when nothing may be bought
+        """
+        with self.book.lock, self.lock:
+            self._roll_day()
+            qty = repository.quantity(self.available_funds, stop_loss, buy_value, self.risk_per_trade)
+            room = min(self.max_symbol_exposure - self.book.exposure(symbol) - self.reserved_exposure.get(symbol, 0.0),
+                       self.max_daily_exposure - self.day_exposure - self.reserved_total)
+        return max(min(qty, int(room // buy_value) if buy_value > 0 else 0), 0)
+
+    def check(self, order_data: dict, price=None):
+        """
+        Checks an order against every limit
+        :param order_data: dictionary made by repository.create_buy_data or create_sell_data
+        :param price: expected fill price, None uses the limit or stop price of the order or the last on_price
+        :return: None when the order may go out, otherwise the reason it may not
+        """
+        with self.book.lock, self.lock:
+            return self._check(order_data, price)[0]
+
+    def _check(self, order_data, price):
+        """
+        :return: (reason or None, price the order is valued at, None for exits which reserve nothing), both locks
+            are held by the caller
+        """
+        self._roll_day()
+        symbol, qty, side = order_data["symbol"], int(order_data["qty"]), int(order_data["side"])
+        position = self.book.position(symbol)
+        if position and (position > 0) != (side > 0) and qty <= abs(position):
+            return None, None  # exits only make the risk smaller
+        if self.day_pnl <= -self.max_daily_loss:
+            return f"daily loss {-self.day_pnl:.2f} reached the limit {self.max_daily_loss}", None
+        active = self.book.active_symbols
+        if symbol not in active and symbol not in self.reserved_orders:
+            # symbols only reserved are not in the book yet
+            open_positions = len(active) + sum(1 for reserved in self.reserved_orders if reserved not in active)
+            if open_positions >= self.max_open_positions:
+                return f"{open_positions} open positions, the limit is {self.max_open_positions}", None
+        if price is None:
+            price = float(order_data.get("limitPrice") or order_data.get("stopPrice")
+                          or self.last_prices.get(symbol, 0))
+        if price <= 0:
+            return "no price to value the order at", None
+        value = qty * price
+        symbol_exposure = self.book.exposure(symbol) + self.reserved_exposure.get(symbol, 0.0) + value
+        if symbol_exposure > self.max_symbol_exposure:
+            return f"{symbol} exposure would be {symbol_exposure:.2f}, the limit is {self.max_symbol_exposure}", None
+        day_exposure = self.day_exposure + self.reserved_total + value
+        if day_exposure > self.max_daily_exposure:
+            return f"exposure of the day would be {day_exposure:.2f}, the limit is {self.max_daily_exposure}", None
+        return None, price
+
+    def approve(self, order_data: dict, price=None):
+        """
+        Raises RiskRejected if the order breaks a limit, otherwise reserves its value until bind and the order's
+        fills or cancellation, or release, give it back
+        :param order_data: dictionary made by repository.create_buy_data or create_sell_data
+        :param price: expected fill price, None uses the limit or stop price of the order or the last on_price
+        :return: reservation token for bind or release, None for exits
+        """
+        with self.book.lock, self.lock:
+            reason, price = self._check(order_data, price)
+            if reason is None:
+                if price is None:
+                    return None
+                token = next(self.tokens)
+                symbol, qty = order_data["symbol"], int(order_data["qty"])
+                self.reservations[token] = [symbol, price, 0]
+                self.reserved_exposure[symbol] = self.reserved_exposure.get(symbol, 0.0)
+                self.reserved_orders[symbol] = self.reserved_orders.get(symbol, 0) + 1
+                self._set_reserved(token, self.reservations[token], qty)
+                return token
+            self.rejections += 1
+        logger.warning("Order rejected by risk - %s", reason,
+                       extra={"event": "risk_rejected", "symbol": order_data["symbol"], "reason": reason})
+        raise RiskRejected(reason, order_data)
@@ -0,0 +1,205 @@
+import time
+import argparse
+import logs
+import threading
+import repository
+import matrix_indicators
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+FYERS_REQUESTS_PER_SECOND = 10
+
+logger = logs.get_logger("scanner")
+
+
+class RateLimiter:
+    """
+    Token bucket shared by threads, lets at most rate calls start in any period seconds
+    """
+
+    def __init__(self, rate: float, period=1.0):
+        """
+        :param rate: number of calls allowed per period
+        :param period: seconds
+        """
+        self.rate = rate
+        self.period = period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.period)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.period / self.rate
+            time.sleep(wait)
+
+
+def get_signal(candle_columns: dict, atr_period=12, multiplier=3, dema_period=3, ema_period=5, cache=None):
+    """
+    Returns the condition of the last candle of one symbol
+    :param candle_columns: dictionary like repository.get_candle_columns returns
+    :param atr_period: Supertrend ATR period
+    :param multiplier: Supertrend multiplier
+    :param dema_period: DEMA period
+    :param ema_period: EMA period
+    :param cache: IndicatorCache, repeated scans of a growing history then only compute the new candles
+    :return: dictionary with signal BUY, SELL or None and the indicator values it came from
+    """
+    high, low, close = candle_columns["HIGH"], candle_columns["LOW"], candle_columns["CLOSE"]
+    if len(close) < 2:
+        return {"signal": None, "ema_breakout": False}
+    if cache is not None:
+        supertrend = cache.supertrend(high, low, close, atr_period, multiplier)[0]
+        dema = cache.dema(close, dema_period)[-1]
+        ema = cache.ema(close, ema_period)
+    else:
+        supertrend = repository.get_supertrend_arrays(high, low, close, atr_period, multiplier)[0]
+        dema = repository.get_dema(close, dema_period)[-1]
+        ema = repository.get_ema(close, ema_period)
+
+    # Supertrend + DEMA strategy, same conditions as experiments.py
+    if supertrend[-1] and close[-1] > dema:
+        signal = "BUY"
+    elif not supertrend[-1]:
+        signal = "SELL"
+    else:
+        signal = None
+    # EMA breakout of ema_initializer: EMA above the previous HIGH and the last CLOSE breaks it
+    ema_breakout = bool(ema[-2] > high[-2] and close[-1] > high[-2])
+
+    return {"signal": signal, "ema_breakout": ema_breakout, "close": float(close[-1]), "dema": float(dema),
+            "ema": float(ema[-1]), "supertrend": bool(supertrend[-1]), "epoch": int(candle_columns["EPOCH"][-1])}
+
+
+def get_signals(candle_columns_by_symbol: dict, atr_period=12, multiplier=3, dema_period=3, ema_period=5):
+    """
+    get_signal for many symbols at once, the indicators run over one NaN padded matrix per column
+    :param candle_columns_by_symbol: {symbol: dictionary like repository.get_candle_columns returns}
+    :param atr_period: Supertrend ATR period
+    :param multiplier: Supertrend multiplier
+    :param dema_period: DEMA period
+    :param ema_period: EMA period
+    :return: {symbol: dictionary like get_signal returns}
+    """
+    symbols = list(candle_columns_by_symbol)
+    if not symbols:
+        return {}
+    columns = [candle_columns_by_symbol[symbol] for symbol in symbols]
+    high = matrix_indicators.to_matrix([candles["HIGH"] for candles in columns])
+    low = matrix_indicators.to_matrix([candles["LOW"] for candles in columns])
+    close = matrix_indicators.to_matrix([candles["CLOSE"] for candles in columns])
+    supertrend = matrix_indicators.get_supertrend_matrix(high, low, close, atr_period, multiplier)[0]
+    dema = matrix_indicators.get_dema_matrix(close, dema_period)
+    ema = matrix_indicators.get_ema_matrix(close, ema_period)
+
+    signals = {}
+    for row, (symbol, candles) in enumerate(zip(symbols, columns)):
+        if len(candles["CLOSE"]) < 2:
+            signals[symbol] = {"signal": None, "ema_breakout": False}
+            continue
+        # every history ends in the last column, same conditions as get_signal
+        last_close, last_dema, previous_high = close[row, -1], dema[row, -1], high[row, -2]
+        if supertrend[row, -1] and last_close > last_dema:
+            signal = "BUY"
+        elif not supertrend[row, -1]:
+            signal = "SELL"
+        else:
+            signal = None
+        ema_breakout = bool(ema[row, -2] > previous_high and last_close > previous_high)
+        signals[symbol] = {"signal": signal, "ema_breakout": ema_breakout, "close": float(last_close),
+                           "dema": float(last_dema), "ema": float(ema[row, -1]),
+                           "supertrend": bool(supertrend[row, -1]), "epoch": int(candles["EPOCH"][-1])}
+    return signals
+
+
+def scan_store(store, resolution="5", symbols=None, bars=None, **indicator_parameters):
+    """
+    Scans the candles already in a CandleStore without calling FYERS, all symbols in one batch
+    :param store: candle_store.CandleStore
+    :param resolution: Time frame of a chart
+    :param symbols: FYERS symbols like NSE:HINDUNILVR-EQ, None scans every stored symbol
+    :param bars: newest candles used per symbol, None uses everything stored
+    :param indicator_parameters: atr_period, multiplier, dema_period, ema_period for get_signals
+    :return: list of dictionaries, one per symbol with a signal
+    """
+    if symbols is None:
+        symbols = store.symbols(resolution)
+    candle_columns_by_symbol = {}
+    for symbol in symbols:
+        columns = store.open_columns(symbol, resolution)
+        candle_columns_by_symbol[symbol] = {column: values[-bars:] if bars else values
+                                            for column, values in columns.items()}
+    return [{"symbol": symbol, **result}
+            for symbol, result in get_signals(candle_columns_by_symbol, **indicator_parameters).items()
+            if result["signal"] or result["ema_breakout"]]
+
+
+def scan(symbols: list, resolution="5", from_days=5, max_workers=16, rate_limit=FYERS_REQUESTS_PER_SECOND,
+         client=None, store=None, **indicator_parameters):
+    """
+    Fetches the history of every symbol concurrently and returns the ones with a buy or sell condition right now,
+    a symbol whose fetch fails is logged and skipped
+    :param symbols: stock names like HINDUNILVR
+    :param resolution: Time frame of a chart i.e., 5min, 10min, 15min, etc.
+    :param from_days: days of history to fetch
+    :param max_workers: number of fetches in flight
+    :param rate_limit: history() calls started per second
+    :param client: object with a FYERS style history() method, None means the FYERS entry point
+    :param store: CandleStore passed to repository.get_history_data
+    :param indicator_parameters: atr_period, multiplier, dema_period, ema_period for get_signals
+    :return: list of dictionaries, one per symbol with a signal
+    """
+    limiter = RateLimiter(rate_limit)
+
+    def fetch(stock_name):
+        limiter.acquire()
+        stock_meta_data = repository.pass_stock_data(stock_name, resolution, from_days)
+        return repository.get_history_data(stock_meta_data, store=store, client=client)
+
+    candle_columns_by_symbol = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch, stock_name): stock_name for stock_name in symbols}
+        # candles are parsed while the slower fetches are still in flight
+        for future in as_completed(futures):
+            stock_name = futures[future]
+            try:
+                history_data = future.result()
+            except Exception as error:
+                logger.warning("Skipping %s: %r", stock_name, error,
+                               extra={"event": "scan_skipped", "stock_name": stock_name})
+                continue
+            if history_data.get("s") != "ok":
+                logger.warning("Skipping %s: %s", stock_name, history_data,
+                               extra={"event": "scan_skipped", "stock_name": stock_name})
+                continue
+            candle_columns_by_symbol[stock_name] = repository.get_candle_columns(history_data)
+
+    return [{"symbol": symbol, **result}
+            for symbol, result in get_signals(candle_columns_by_symbol, **indicator_parameters).items()
+            if result["signal"] or result["ema_breakout"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan a watchlist for Supertrend/DEMA/EMA conditions")
+    parser.add_argument("symbols", nargs="*", help="stock names like HINDUNILVR")
+    parser.add_argument("--watchlist", help="file with one stock name per line")
+    parser.add_argument("--resolution", default="5")
+    parser.add_argument("--days", type=float, default=5)
+    arguments = parser.parse_args()
+
+    symbols = list(arguments.symbols)
+    if arguments.watchlist:
+        with open(arguments.watchlist, "r") as f:
+            symbols += [line.strip() for line in f if line.strip()]
+
+    for row in sorted(scan(symbols, arguments.resolution, arguments.days), key=lambda row: row["symbol"]):
+        print(row)
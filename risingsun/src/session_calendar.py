@@ -0,0 +1,199 @@
+import numpy as np
+
+SECONDS_IN_DAY = 24 * 60 * 60
+IST_OFFSET = 5 * 60 * 60 + 30 * 60  # seconds between UTC and IST
+SESSION_OPEN_SECONDS = 9 * 60 * 60 + 15 * 60  # 09:15 IST, bars are aligned to it
+SESSION_CLOSE_SECONDS = 15 * 60 * 60 + 30 * 60  # 15:30 IST, the last bar ends here
+SESSION_MINUTES = (SESSION_CLOSE_SECONDS - SESSION_OPEN_SECONDS) // 60
+
+
+def session_day(epoch) -> int:
+    """
+    Returns the IST day of one EPOCH, the scalar session_days for the live path
+    :param epoch: EPOCH value
+    :return: days since 1 January 1970 IST
+    """
+    return (int(epoch) + IST_OFFSET) // SECONDS_IN_DAY
+
+
+def session_bounds(epoch):
+    """
+    Returns the market open and close of the IST day an EPOCH falls on
+    :param epoch: any time of the day
+    :return: (open epoch, close epoch)
+    """
+    day_start = int(epoch) - (int(epoch) + IST_OFFSET) % SECONDS_IN_DAY
+    return day_start + SESSION_OPEN_SECONDS, day_start + SESSION_CLOSE_SECONDS
+
+
+def bar_start(epoch, step: int) -> int:
+    """
+    Returns the EPOCH of the bar an EPOCH belongs to, bars start at 09:15 IST every day
+    :param epoch: time of a tick or of a finer bar
+    :param step: bar length in seconds
+    :return: epoch
+    """
+    session_open = session_bounds(epoch)[0]
+    return session_open + (int(epoch) - session_open) // step * step
+
+
+def bar_end(start, step: int) -> int:
+    """
+    Returns the EPOCH a bar closes at, the last bar of the day is cut at market close
+    :param start: EPOCH of the bar
+    :param step: bar length in seconds
+    :return: epoch
+    """
+    session_close = session_bounds(start)[1]
+    end = int(start) + step
+    return session_close if start < session_close < end else end
+
+
+def next_bar_close(epoch, step: int) -> int:
+    """
+    Returns the first bar boundary after an EPOCH, bars are aligned to the market open and the last one of the
+    day is cut at the market close
+    :param epoch: current time
+    :param step: bar length in seconds
+    :return: EPOCH the bar forming at epoch closes at
+    """
+    session_open, session_close = session_bounds(epoch)
+    if epoch < session_open:
+        return session_open + step
+    if epoch >= session_close:
+        return session_bounds(epoch + SECONDS_IN_DAY)[0] + step
+    return bar_end(bar_start(epoch, step), step)
+
+
+def _as_epochs(epochs):
+    return np.asarray(epochs).astype(np.int64)
+
+
+def session_days(epochs):
+    """
+    Returns the IST day of every EPOCH as a day number, equal numbers are the same session
+    :param epochs: EPOCH values
+    :return: int64 array of days since 1 January 1970 IST
+    """
+    return (_as_epochs(epochs) + IST_OFFSET) // SECONDS_IN_DAY
+
+
+def session_dates(epochs):
+    """
+    Returns the IST date of every EPOCH
+    :param epochs: EPOCH values
+    :return: datetime64[D] array
+    """
+    return session_days(epochs).astype("datetime64[D]")
+
+
+def minutes_since_open(epochs):
+    """
+    Returns the minutes between the 09:15 IST market open of its day and every EPOCH
+    :param epochs: EPOCH values
+    :return: int64 array, negative before the open
+    """
+    return ((_as_epochs(epochs) + IST_OFFSET) % SECONDS_IN_DAY - SESSION_OPEN_SECONDS) // 60
+
+
+def bar_starts(epochs, minutes: int):
+    """
+    Returns the EPOCH of the bar every EPOCH belongs to, bars start at 09:15 IST every day
+    :param epochs: EPOCH values
+    :param minutes: bar length
+    :return: int64 array
+    """
+    epochs = _as_epochs(epochs)
+    session_open = epochs - (epochs + IST_OFFSET) % SECONDS_IN_DAY + SESSION_OPEN_SECONDS
+    step = minutes * 60
+    return session_open + (epochs - session_open) // step * step
+
+
+def bar_of_day(epochs, minutes: int):
+    """
+    Returns the clock slot of every candle in its session, 0 is the bar starting at 09:15; a missing candle leaves
+    its slot out instead of moving the later ones
+    :param epochs: EPOCH values
+    :param minutes: minutes per candle
+    :return: int64 array
+    """
+    return minutes_since_open(epochs) // minutes
+
+
+def in_session_mask(epochs):
+    """
+    :param epochs: EPOCH values
+    :return: True where the EPOCH is between market open and market close
+    """
+    seconds = (_as_epochs(epochs) + IST_OFFSET) % SECONDS_IN_DAY
+    return (seconds >= SESSION_OPEN_SECONDS) & (seconds < SESSION_CLOSE_SECONDS)
+
+
+def session_calendar(epochs, minutes=1):
+    """
+    Works out everything about the session of every candle in one pass
+    :param epochs: EPOCH values, oldest first like get_history_data returns them
+    :param minutes: minutes per candle, for bar_of_day
+    :return: dictionary of
+        day: IST day number,
+        minutes: minutes since the market open,
+        bar_of_day: clock slot of the candle in its session like bar_of_day, 0 is the bar starting at 09:15,
+        position: candles of the same day before this one, 0 for the first candle of a session,
+        remaining: candles of the same day after this one, 0 for the last candle of a session
+    """
+    epochs = _as_epochs(epochs)
+    n = len(epochs)
+    local_seconds = epochs + IST_OFFSET
+    days = local_seconds // SECONDS_IN_DAY
+    minutes_since = (local_seconds - days * SECONDS_IN_DAY - SESSION_OPEN_SECONDS) // 60
+
+    new_day = np.ones(n, dtype=np.bool_)
+    new_day[1:] = days[1:] != days[:-1]
+    starts = np.flatnonzero(new_day)
+    ends = np.append(starts[1:], n)[:len(starts)]
+    index = np.arange(n)
+    return {
+        "day": days,
+        "minutes": minutes_since,
+        "bar_of_day": minutes_since // minutes,
+        "position": index - np.repeat(starts, ends - starts),
+        "remaining": np.repeat(ends, ends - starts) - index - 1,
+    }
+
+
+def first_bars_mask(epochs, minutes: int, count=1):
+    """
+    Selects the first clock slots of every session, the INDEX_LIST of experiments.py for any number of days; like
+    last_bars_mask the slot comes from the clock, so a day missing its 09:15 candle has one candle fewer selected
+    :param epochs: EPOCH values
+    :param minutes: minutes per candle
+    :param count: slots taken from the start of every session
+    :return: boolean array
+    """
+    return bar_of_day(epochs, minutes) < count
+
+
+def last_bars_mask(epochs, minutes: int, count=1):
+    """
+    Selects the last clock slots of every session, count=1 is the bar that ends at market close; the slot comes
+    from the clock, so the newest candle of a session still running is not taken for the last one
+    :param epochs: EPOCH values
+    :param minutes: minutes per candle
+    :param count: slots taken from the end of every session
+    :return: boolean array
+    """
+    slots = -(-SESSION_MINUTES // minutes)
+    return bar_of_day(epochs, minutes) >= slots - count
+
+
+def session_slices(epochs):
+    """
+    Returns where every session starts and ends, so per day work can slice the columns instead of looping bars
+    :param epochs: EPOCH values, oldest first
+    :return: (day numbers, start indices, end indices) with end exclusive
+    """
+    days = session_days(epochs)
+    if not len(days):
+        return days, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+    return days[starts], starts, np.append(starts[1:], len(days))
@@ -0,0 +1,220 @@
+import math
+import repository
+import numpy as np
+import talib
+
+
+class EMAState:
+    """
+    EMA that moves forward one candle at a time, same values as repository.get_ema
+    """
+    __slots__ = ("period", "alpha", "value", "count", "seed_sum")
+
+    def __init__(self, period: int):
+        """
+        :param period: Looks for the previous specific number of candles for calculation, user-defined integer
+        """
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.value = math.nan
+        self.count = 0
+        self.seed_sum = 0.0
+
+    @classmethod
+    def from_history(cls, close_values, period: int):
+        """
+        Seeds the state from the closing prices we already have
+        :param close_values: close values in list or numpy form
+        :param period: Looks for the previous specific number of candles for calculation
+        :return: EMAState
+        """
+        state = cls(period)
+        close_values = np.asarray(close_values, dtype=np.float64)
+        if len(close_values) < period:
+            for close in close_values.tolist():
+                state.update(close, close, close)
+        else:
+            state.value = float(repository.get_ema(close_values, period)[-1])
+            state.count = len(close_values)
+        return state
+
+    def update(self, high, low, close):
+        """
+        Adds one candle
+        :param high: HIGH of the candle (not used by EMA)
+        :param low: LOW of the candle (not used by EMA)
+        :param close: CLOSE of the candle
+        :return: EMA value, nan till period candles are seen
+        """
+        self.count += 1
+        if self.count < self.period:
+            self.seed_sum += close
+        elif self.count == self.period:
+            # TA-Lib seeds the EMA with the simple average of the first period closes
+            self.value = (self.seed_sum + close) / self.period
+        else:
+            self.value += self.alpha * (close - self.value)
+        return self.value
+
+
+class DEMAState:
+    """
+    DEMA that moves forward one candle at a time, same values as repository.get_dema
+    """
+    __slots__ = ("period", "first_ema", "second_ema", "value")
+
+    def __init__(self, period: int):
+        """
+        :param period: 5 or 10 or 15 in integer value
+        """
+        self.period = period
+        self.first_ema = EMAState(period)
+        self.second_ema = EMAState(period)
+        self.value = math.nan
+
+    @classmethod
+    def from_history(cls, close_values, period: int):
+        """
+        Seeds the state from the closing prices we already have
+        :param close_values: close values in list or numpy form
+        :param period: 5 or 10 or 15 in integer value
+        :return: DEMAState
+        """
+        state = cls(period)
+        close_values = np.asarray(close_values, dtype=np.float64)
+        state.first_ema = EMAState.from_history(close_values, period)
+        if len(close_values) >= period:
+            first_ema_values = talib.EMA(close_values, period)[period - 1:]
+            state.second_ema = EMAState.from_history(first_ema_values, period)
+            state.value = 2 * state.first_ema.value - state.second_ema.value
+        return state
+
+    def update(self, high, low, close):
+        """
+        Adds one candle
+        :param high: HIGH of the candle (not used by DEMA)
+        :param low: LOW of the candle (not used by DEMA)
+        :param close: CLOSE of the candle
+        :return: DEMA value, nan till 2 * period - 1 candles are seen
+        """
+        first = self.first_ema.update(high, low, close)
+        if math.isnan(first):
+            return self.value
+        second = self.second_ema.update(first, first, first)
+        self.value = 2 * first - second
+        return self.value
+
+
+class SupertrendState:
+    """
+    Supertrend that moves forward one candle at a time, same values as repository.get_supertrend
+    """
+    __slots__ = ("atr_period", "multiplier", "decay", "weighted_sum", "weight", "count", "atr", "prev_close",
+                 "supertrend", "final_lowerband", "final_upperband")
+
+    def __init__(self, atr_period: int, multiplier):
+        """
+        :param atr_period: value defined by us
+        :param multiplier: value defined by us
+        """
+        self.atr_period = atr_period
+        self.multiplier = multiplier
+        self.decay = 1.0 - 1.0 / atr_period
+        self.weighted_sum = 0.0
+        self.weight = 0.0
+        self.count = 0
+        self.atr = math.nan
+        self.prev_close = math.nan
+        self.supertrend = True
+        self.final_lowerband = math.nan
+        self.final_upperband = math.nan
+
+    @classmethod
+    def from_history(cls, high_values, low_values, close_values, atr_period: int, multiplier):
+        """
+        Seeds the state from the candles we already have
+        :param high_values: HIGH values
+        :param low_values: LOW values
+        :param close_values: CLOSE values
+        :param atr_period: value defined by us
+        :param multiplier: value defined by us
+        :return: SupertrendState
+        """
+        state = cls(atr_period, multiplier)
+        n = len(close_values)
+        if n < atr_period:
+            for high, low, close in zip(np.asarray(high_values, dtype=np.float64).tolist(),
+                                        np.asarray(low_values, dtype=np.float64).tolist(),
+                                        np.asarray(close_values, dtype=np.float64).tolist()):
+                state.update(high, low, close)
+            return state
+
+        return cls.from_arrays(close_values, repository.get_supertrend_arrays(
+            high_values, low_values, close_values, atr_period, multiplier), atr_period, multiplier)
+
+    @classmethod
+    def from_arrays(cls, close_values, supertrend_arrays, atr_period: int, multiplier):
+        """
+        Seeds the state from a Supertrend that was already computed, at least atr_period candles long
+        :param close_values: CLOSE values
+        :param supertrend_arrays: supertrend, final lowerband, final upperband, atr of get_supertrend_arrays
+        :param atr_period: value defined by us
+        :param multiplier: value defined by us
+        :return: SupertrendState
+        """
+        state = cls(atr_period, multiplier)
+        n = len(close_values)
+        supertrend, final_lowerband, final_upperband, atr = supertrend_arrays
+        # the ATR weights form a geometric series, so the running sums can be rebuilt from the last ATR
+        state.weight = n if state.decay == 1.0 else (1.0 - state.decay ** n) / (1.0 - state.decay)
+        state.weighted_sum = float(atr[-1]) * state.weight
+        state.count = n
+        state.atr = float(atr[-1])
+        state.prev_close = float(close_values[-1])
+        state.supertrend = bool(supertrend[-1])
+        state.final_lowerband = float(final_lowerband[-1])
+        state.final_upperband = float(final_upperband[-1])
+        return state
+
+    def update(self, high, low, close):
+        """
+        Adds one candle
+        :param high: HIGH of the candle
+        :param low: LOW of the candle
+        :param close: CLOSE of the candle
+        :return: supertrend, final lowerband, final upperband
+        """
+        true_range = abs(high - low)
+        if self.count > 0:
+            true_range = max(true_range, abs(high - self.prev_close), abs(self.prev_close - low))
+        self.weighted_sum = self.weighted_sum * self.decay + true_range
+        self.weight = self.weight * self.decay + 1.0
+        self.count += 1
+        self.atr = self.weighted_sum / self.weight if self.count >= self.atr_period else math.nan
+
+        hl2 = (high + low) / 2
+        final_upperband = hl2 + (self.multiplier * self.atr)
+        final_lowerband = hl2 - (self.multiplier * self.atr)
+
+        if self.count > 1:
+            if close > self.final_upperband:
+                supertrend = True
+            elif close < self.final_lowerband:
+                supertrend = False
+            else:
+                supertrend = self.supertrend
+                if supertrend and final_lowerband < self.final_lowerband:
+                    final_lowerband = self.final_lowerband
+                if not supertrend and final_upperband > self.final_upperband:
+                    final_upperband = self.final_upperband
+
+            if supertrend:
+                final_upperband = math.nan
+            else:
+                final_lowerband = math.nan
+            self.supertrend = supertrend
+
+        self.prev_close = close
+        self.final_lowerband = final_lowerband
+        self.final_upperband = final_upperband
+        return self.supertrend, final_lowerband, final_upperband
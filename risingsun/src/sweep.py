@@ -0,0 +1,189 @@
+import os
+import argparse
+import itertools
+import repository
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in every worker process by attach_shared and _attach_candles
+_attached_blocks = []
+_shared_candles = None
+_dema_cache = {}
+
+
+class SharedArrays:
+    """
+    Arrays in shared memory blocks, the worker processes of a pool map them with attach_shared instead of receiving
+    pickled copies; the blocks are removed when the with block ends
+    """
+
+    def __init__(self, arrays: list):
+        """
+        :param arrays: numpy arrays copied into the blocks, or (shape, dtype) for blocks the workers fill
+        """
+        self.blocks = []
+        self.specs = []  # (block name, shape, dtype) of every array, the initargs of attach_shared
+        for array in arrays:
+            shape, dtype = (array.shape, array.dtype) if isinstance(array, np.ndarray) else array
+            dtype = np.dtype(dtype)
+            block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+            self.blocks.append(block)
+            self.specs.append((block.name, tuple(shape), dtype.str))
+            if isinstance(array, np.ndarray):
+                np.ndarray(shape, dtype=dtype, buffer=block.buf)[...] = array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def attach_shared(specs: list):
+    """
+    Maps the arrays of a SharedArrays in a worker process, the blocks stay open for the life of the worker
+    :param specs: SharedArrays.specs
+    :return: list of arrays
+    """
+    _attached_blocks[:] = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    return [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            for block, (_, shape, dtype) in zip(_attached_blocks, specs)]
+
+
+def shared_candles(candle_columns: dict):
+    """
+    :param candle_columns: dictionary with HIGH, LOW, CLOSE arrays
+    :return: (3, candles) float64 array of HIGH, LOW, CLOSE for SharedArrays
+    """
+    return np.array([candle_columns["HIGH"], candle_columns["LOW"], candle_columns["CLOSE"]], dtype=np.float64)
+
+
+def score_trades(close, buy_signal, sell_signal, per):
+    """
+    Runs the Supertrend + DEMA trades of experiments.py on the signals and scores them
+    :param close: CLOSE array
+    :param buy_signal: boolean array, Supertrend green and CLOSE above DEMA
+    :param sell_signal: boolean array, Supertrend red
+    :param per: sell percentage criteria
+    :return: (PnL, number of trades, win rate)
+    """
+    buy_indices, sell_indices = repository.get_supertrend_dema_trades(close, buy_signal, sell_signal, per)
+    trade_diffs = close[sell_indices] - close[buy_indices]
+    trade_count = len(trade_diffs)
+    return float(trade_diffs.sum()), trade_count, float((trade_diffs > 0).mean()) if trade_count else 0.0
+
+
+def _attach_candles(specs: list):
+    """
+    Worker initializer, maps the HIGH, LOW, CLOSE block shared by the parent
+    :param specs: SharedArrays.specs of the candles
+    """
+    global _shared_candles
+    _shared_candles = attach_shared(specs)[0]
+    _dema_cache.clear()
+
+
+def _evaluate(atr_period: int, multiplier: float, dema_periods: list, pers: list):
+    """
+    Scores every DEMA period and per for one Supertrend setting, Supertrend is computed once for all of them
+    :param atr_period: Supertrend ATR period
+    :param multiplier: Supertrend multiplier
+    :param dema_periods: DEMA periods to try
+    :param pers: sell percentage criteria to try
+    :return: list of result dictionaries
+    """
+    high, low, close = _shared_candles
+    supertrend = repository.get_supertrend_arrays(high, low, close, atr_period, multiplier)[0]
+    sell_signal = ~supertrend
+    results = []
+    for dema_period in dema_periods:
+        if dema_period not in _dema_cache:
+            _dema_cache[dema_period] = close > np.asarray(repository.get_dema(close, dema_period))
+        buy_signal = supertrend & _dema_cache[dema_period]
+        for per in pers:
+            final_pnl, trade_count, win_rate = score_trades(close, buy_signal, sell_signal, per)
+            results.append({"atr_period": atr_period, "multiplier": multiplier, "dema_period": dema_period,
+                            "per": per, "trade_count": trade_count, "final_pnl": final_pnl, "win_rate": win_rate})
+    return results
+
+
+def _run(candle_columns: dict, tasks: list, max_workers=None):
+    """
+    Runs the tasks over a process pool sharing the candles through shared memory
+    :param candle_columns: dictionary with HIGH, LOW, CLOSE arrays
+    :param tasks: list of (atr_period, multiplier, dema_periods, pers)
+    :param max_workers: number of processes, defaults to the CPU count
+    :return: results table ranked by final PnL
+    """
+    with SharedArrays([shared_candles(candle_columns)]) as shared, \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_candles,
+                                initargs=(shared.specs,)) as executor:
+        futures = [executor.submit(_evaluate, *task) for task in tasks]
+        results = [row for future in futures for row in future.result()]
+
+    table = pd.DataFrame(results, columns=["atr_period", "multiplier", "dema_period", "per", "trade_count",
+                                           "final_pnl", "win_rate"])
+    return table.sort_values("final_pnl", ascending=False, ignore_index=True)
+
+
+def grid_search(candle_columns: dict, atr_periods, multipliers, dema_periods, pers, max_workers=None):
+    """
+    Tries every combination of the given values
+    :param candle_columns: dictionary with HIGH, LOW, CLOSE arrays, like repository.get_candle_columns returns
+    :param atr_periods: Supertrend ATR periods
+    :param multipliers: Supertrend multipliers
+    :param dema_periods: DEMA periods
+    :param pers: sell percentage criteria
+    :param max_workers: number of processes, defaults to the CPU count
+    :return: results table ranked by final PnL
+    """
+    tasks = [(atr_period, multiplier, list(dema_periods), list(pers))
+             for atr_period, multiplier in itertools.product(atr_periods, multipliers)]
+    return _run(candle_columns, tasks, max_workers)
+
+
+def random_search(candle_columns: dict, samples: int, atr_periods=(5, 30), multipliers=(1.0, 5.0),
+                  dema_periods=(2, 30), pers=(1.005, 1.1), seed=None, max_workers=None):
+    """
+    Tries randomly drawn combinations, integer ranges include both ends
+    :param candle_columns: dictionary with HIGH, LOW, CLOSE arrays, like repository.get_candle_columns returns
+    :param samples: number of combinations
+    :param atr_periods: (min, max) Supertrend ATR period
+    :param multipliers: (min, max) Supertrend multiplier
+    :param dema_periods: (min, max) DEMA period
+    :param pers: (min, max) sell percentage criteria
+    :param seed: seed of the random generator
+    :param max_workers: number of processes, defaults to the CPU count
+    :return: results table ranked by final PnL
+    """
+    rng = np.random.default_rng(seed)
+    drawn = zip(rng.integers(atr_periods[0], atr_periods[1] + 1, samples).tolist(),
+                np.round(rng.uniform(*multipliers, samples), 2).tolist(),
+                rng.integers(dema_periods[0], dema_periods[1] + 1, samples).tolist(),
+                np.round(rng.uniform(*pers, samples), 4).tolist())
+    tasks = [(atr_period, multiplier, [dema_period], [per]) for atr_period, multiplier, dema_period, per in drawn]
+    return _run(candle_columns, tasks, max_workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Supertrend + DEMA parameter sweep over the cached candles")
+    parser.add_argument("--stock", default="HINDUNILVR")
+    parser.add_argument("--resolution", default="5")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--samples", type=int, default=0, help="random search size, 0 runs the grid")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--top", type=int, default=20)
+    arguments = parser.parse_args()
+
+    stock_meta_data = repository.pass_stock_data(arguments.stock, arguments.resolution, arguments.days)
+    candle_columns = repository.get_candle_columns(repository.get_history_data(stock_meta_data))
+    if arguments.samples:
+        table = random_search(candle_columns, arguments.samples, max_workers=arguments.workers)
+    else:
+        table = grid_search(candle_columns, range(5, 31), np.arange(1.0, 5.01, 0.5), range(2, 21),
+                            np.round(np.arange(1.005, 1.1, 0.005), 3), max_workers=arguments.workers)
+    print(table.head(arguments.top).to_string())
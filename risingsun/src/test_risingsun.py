@@ -0,0 +1,1176 @@
+"""
+Equivalence and behaviour tests of the optimised hot paths, run with pytest; benchmark.py keeps the timings
+"""
+from benchmark import generate_ohlc, generate_history_response, generate_session_candles, legacy_parse_candles, \
+    legacy_get_supertrend, legacy_trade_diff_result, legacy_ema_backtest, legacy_walk_forward, legacy_resample, \
+    legacy_session_calendar, VirtualClock, SessionHistoryClient, RecordCollector
+import os
+import json
+import time
+import itertools
+import types
+import asyncio
+import tempfile
+import threading
+import logging
+import logs
+import access_token
+import metrics
+import indicator_cache
+import scanner
+import daemon
+import resample
+import session_calendar
+import backtest
+import walk_forward
+import sweep
+import live_feed
+import candle_buffer
+import order_gateway
+import order_book
+import risk_engine
+import candle_store
+import repository
+import streaming_indicators
+import matrix_indicators
+import pytest
+import numpy as np
+import pandas as pd
+
+
+def test_supertrend(bars=20000, atr_period=12, multiplier=3):
+    """
+    Fails if get_supertrend does not match the original pandas implementation
+    :param bars: number of candles to compare on
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    """
+    dataframe_data = pd.DataFrame(generate_ohlc(bars))
+    expected = legacy_get_supertrend(dataframe_data, atr_period, multiplier)
+    actual = repository.get_supertrend(dataframe_data, atr_period, multiplier)
+
+    assert (expected['Supertrend'].to_numpy() == actual['Supertrend'].to_numpy()).all(), "Supertrend differs"
+    for column in ('Final Lowerband', 'Final Upperband'):
+        np.testing.assert_allclose(actual[column].to_numpy(), expected[column].to_numpy(), rtol=1e-9,
+                                   err_msg=f"{column} differs")
+
+
+def test_streaming_indicators(bars=5000, seed_bars=1000, atr_period=12, multiplier=3, time_period=3):
+    """
+    Fails if the streaming indicator states drift from the batch functions
+    :param bars: number of candles to compare on
+    :param seed_bars: candles used to seed the states, the rest go through update()
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :param time_period: EMA and DEMA period
+    """
+    candles = generate_ohlc(bars)
+    high, low, close = candles["HIGH"], candles["LOW"], candles["CLOSE"]
+
+    for seed in (0, 2, seed_bars):
+        supertrend_state = streaming_indicators.SupertrendState.from_history(high[:seed], low[:seed], close[:seed],
+                                                                             atr_period, multiplier)
+        ema_state = streaming_indicators.EMAState.from_history(close[:seed], time_period)
+        dema_state = streaming_indicators.DEMAState.from_history(close[:seed], time_period)
+        streamed = [(supertrend_state.update(h, l, c), ema_state.update(h, l, c), dema_state.update(h, l, c))
+                    for h, l, c in zip(high[seed:].tolist(), low[seed:].tolist(), close[seed:].tolist())]
+
+        supertrend, final_lowerband, final_upperband, _ = repository.get_supertrend_arrays(high, low, close,
+                                                                                           atr_period, multiplier)
+        assert [row[0][0] for row in streamed] == supertrend[seed:].tolist(), "Supertrend differs"
+        np.testing.assert_allclose([row[0][1] for row in streamed], final_lowerband[seed:], rtol=1e-9)
+        np.testing.assert_allclose([row[0][2] for row in streamed], final_upperband[seed:], rtol=1e-9)
+        np.testing.assert_allclose([row[1] for row in streamed], repository.get_ema(close, time_period)[seed:],
+                                   rtol=1e-9)
+        np.testing.assert_allclose([row[2] for row in streamed], repository.get_dema(close, time_period)[seed:],
+                                   rtol=1e-9)
+
+
+def test_candle_columns(bars=100_000):
+    """
+    Fails if get_candle_columns differs from the original per-candle loop of entry_point.py
+    :param bars: number of candles
+    """
+    entire_stock_data = generate_history_response(bars)
+    expected = legacy_parse_candles(entire_stock_data)
+    actual = repository.get_candle_columns(entire_stock_data)
+    for column in ("HIGH", "LOW", "CLOSE"):
+        assert (expected[column].to_numpy() == actual[column]).all(), f"{column} differs"
+
+
+class FakeHistoryClient:
+    """
+    Stands in for the FYERS client, serves history() from a prepared response and records every request
+    """
+
+    def __init__(self, history_data: dict):
+        self.candles = history_data["candles"]
+        self.requests = []
+
+    def history(self, data):
+        self.requests.append((data["range_from"], data["range_to"]))
+        candles = [candle for candle in self.candles if data["range_from"] <= candle[0] <= data["range_to"]]
+        return {"s": "ok" if candles else "no_data", "candles": candles}
+
+
+class FakeFyersClient(FakeHistoryClient):
+    """
+    FakeHistoryClient that also accepts every order at once, stands in for the whole FYERS client
+    """
+
+    def __init__(self, history_data: dict):
+        super().__init__(history_data)
+        self.orders = []
+
+    def place_order(self, data):
+        self.orders.append(data)
+        return {"s": "ok", "code": 1101, "message": "Order submitted successfully", "id": str(len(self.orders))}
+
+
+def test_entry_point(bars=300):
+    """
+    Fails if a stub passed to set_fyers_entry_point is not what place_order and get_history_data
+    call, or if reset_fyers_entry_point does not make the next call build a new client
+    :param bars: number of candles served by the stub
+    """
+    history_data = generate_history_response(bars)
+    stub = FakeFyersClient(history_data)
+    query = {"symbol": "NSE:TEST-EQ", "resolution": "5", "date_format": "0", "cont_flag": "1",
+             "range_from": history_data["candles"][0][0], "range_to": history_data["candles"][-1][0]}
+    previous_client = access_token._fyers_client
+    fyers_model, get_access_token = access_token.fyersModel, access_token.get_access_token
+    builds = []
+    try:
+        access_token.set_fyers_entry_point(stub)
+        assert access_token.get_fyers_entry_point() is stub
+        buy_data = repository.create_buy_data("NSE:TEST-EQ", 2, 1, 1, "INTRADAY", 0, 0)
+        assert repository.place_order(buy_data) == "1" and stub.orders == [buy_data]
+        assert repository.get_history_data(query, store=False)["candles"] == history_data["candles"]
+        assert stub.requests == [(query["range_from"], query["range_to"])]
+
+        # no login and no network, the rebuilt client comes from a stand in FyersModel
+        access_token.fyersModel = types.SimpleNamespace(FyersModel=lambda **kwargs: builds.append(kwargs) or kwargs)
+        access_token.get_access_token = lambda: "TOKEN"
+        access_token.reset_fyers_entry_point()
+        client = access_token.get_fyers_entry_point()
+        assert client is not stub and access_token.get_fyers_entry_point() is client
+        assert len(builds) == 1 and builds[0]["token"] == "TOKEN"
+
+        # an expired token also removes access_token.txt of the working directory
+        working_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                with open("access_token.txt", "w") as f:
+                    f.write("EXPIRED")
+                access_token.reset_fyers_entry_point(token_expired=True)
+                assert not os.path.exists("access_token.txt") and access_token._fyers_client is None
+            finally:
+                os.chdir(working_directory)
+    finally:
+        access_token.fyersModel, access_token.get_access_token = fyers_model, get_access_token
+        access_token.set_fyers_entry_point(previous_client)
+
+
+def test_candle_store(bars=3000):
+    """
+    Fails if get_history_data refetches candles the store already has
+    :param bars: number of candles served by the fake client
+    """
+    history_data = generate_history_response(bars)
+    epochs = [candle[0] for candle in history_data["candles"]]
+    client = FakeHistoryClient(history_data)
+    query = {"symbol": "NSE:TEST-EQ", "resolution": "5", "date_format": "0", "cont_flag": "1"}
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = candle_store.CandleStore(directory)
+        middle = {**query, "range_from": epochs[1000], "range_to": epochs[2000]}
+        first = repository.get_history_data(middle, store=store, client=client)
+        assert len(first["candles"]) == 1001 and client.requests == [(epochs[1000], epochs[2000])]
+
+        client.requests.clear()
+        again = repository.get_history_data(middle, store=store, client=client)
+        assert (again["candles"] == first["candles"]).all()
+        assert client.requests == []
+
+        # newer candles only rewrite the tail of the column files, older ones rebuild them
+        client.requests.clear()
+        repository.get_history_data({**query, "range_from": epochs[1000], "range_to": epochs[2500]}, store=store,
+                                    client=client)
+        wider = repository.get_history_data({**query, "range_from": epochs[0], "range_to": epochs[-1]}, store=store,
+                                            client=client)
+        assert client.requests == [(epochs[2000], epochs[2500]), (epochs[0], epochs[1000]), (epochs[2500], epochs[-1])]
+        assert (wider["candles"] == np.array(history_data["candles"], dtype=np.float64)).all()
+
+        # the memory mapped columns go straight into the indicator and backtest functions
+        symbol, columns = next(store.iter_universe("5"))
+        assert symbol == "NSE:TEST-EQ" and isinstance(columns["CLOSE"], np.memmap)
+        expected = repository.get_supertrend_arrays(wider["candles"][:, 2], wider["candles"][:, 3],
+                                                    wider["candles"][:, 4], 12, 3)[1]
+        np.testing.assert_array_equal(repository.get_supertrend(columns, 12, 3)["Final Lowerband"], expected)
+        repository.get_trade_diff_result(columns, 12, 3, 3, 1.03)
+
+        small = candle_store.CandleStore(os.path.join(directory, "float32"), price_dtype=np.float32)
+        repository.get_history_data({**query, "range_from": epochs[0], "range_to": epochs[-1]}, store=small,
+                                    client=client)
+        assert small.open_columns("NSE:TEST-EQ", "5")["CLOSE"].dtype == np.float32
+        np.testing.assert_allclose(small.open_columns("NSE:TEST-EQ", "5")["CLOSE"], wider["candles"][:, 4],
+                                   rtol=1e-6)
+
+
+class FakeBroker:
+    """
+    Stands in for the FYERS client on the order path, every call sleeps for one round trip
+    """
+
+    def __init__(self, round_trip=0.05):
+        self.round_trip = round_trip
+        self.next_id = 0
+
+    def _reply(self):
+        self.next_id += 1
+        return {"s": "ok", "code": 1101, "message": "Order submitted successfully", "id": str(self.next_id)}
+
+    def place_order(self, data):
+        time.sleep(self.round_trip)
+        return self._reply()
+
+
+class FakeBasketBroker(FakeBroker):
+    """
+    FakeBroker that also takes a basket of orders in one call
+    """
+
+    def place_basket_orders(self, data):
+        time.sleep(self.round_trip)
+        return {"s": "ok", "data": [{"statusCode": 200, "body": self._reply()} for _ in data]}
+
+
+def test_order_gateway(orders=20, round_trip=0.05):
+    """
+    Fails if simultaneous exits through the OrderGateway take much more than one round trip
+    :param orders: number of sell orders fired together
+    :param round_trip: seconds the fake broker takes per call
+    """
+    sell_orders = [repository.create_sell_data(f"NSE:TEST{i}-EQ", 2, 1, -1, "INTRADAY", 0, 0) for i in range(orders)]
+
+    async def fire(broker):
+        gateway = order_gateway.OrderGateway(client=broker)
+        start = time.perf_counter()
+        order_ids = await gateway.place_orders(sell_orders)
+        elapsed = time.perf_counter() - start
+        await gateway.close()
+        return order_ids, elapsed
+
+    for broker_class in (FakeBasketBroker, FakeBroker):
+        broker = broker_class(round_trip)
+        order_ids, elapsed = asyncio.run(fire(broker))
+        assert sorted(order_ids, key=int) == [str(i) for i in range(1, orders + 1)], order_ids
+        assert elapsed < 3 * round_trip, f"{orders} orders took {elapsed:.3f}s"
+
+
+class FakeReconcileBroker(FakeBasketBroker):
+    """
+    FakeBasketBroker that also answers orderbook() and positions() from prepared lists
+    """
+
+    def __init__(self, round_trip=0.0):
+        super().__init__(round_trip)
+        self.order_entries = []
+        self.position_entries = []
+
+    def orderbook(self):
+        return {"s": "ok", "orderBook": self.order_entries}
+
+    def positions(self):
+        return {"s": "ok", "netPositions": self.position_entries}
+
+
+def test_order_book():
+    """
+    Fails if the OrderBook loses an order, counts a fill twice or does not take the broker's state on reconcile
+    """
+    symbol = "NSE:TEST-EQ"
+    book = order_book.OrderBook()
+    broker = FakeReconcileBroker()
+
+    async def place(orders):
+        gateway = order_gateway.OrderGateway(client=broker, book=book)
+        order_ids = await gateway.place_orders(orders)
+        await gateway.close()
+        return order_ids
+
+    buy_id, other_id = asyncio.run(place([repository.create_buy_data(symbol, 1, 10, 1, "INTRADAY", 101, 0),
+                                          repository.create_buy_data("NSE:OTHER-EQ", 2, 3, 1, "INTRADAY", 0, 0)]))
+    assert [order.order_id for order in book.open_orders(symbol)] == [buy_id] and book.position(symbol) == 0
+
+    events = order_book.EventQueue()
+    consumer = threading.Thread(target=book.consume, args=(events,))
+    consumer.start()
+    events.push({"id": buy_id, "filledQty": 5, "tradedPrice": 100.0, "status": order_book.PENDING})
+    events.push({"id": buy_id, "filledQty": 10, "tradedPrice": 101.0, "status": order_book.TRADED})
+    events.push({"id": buy_id, "filledQty": 10, "tradedPrice": 101.0, "status": order_book.TRADED})  # repeated
+    events.close()
+    consumer.join()
+    assert book.position(symbol) == 10 and book.average_price(symbol) == 101.0 and not book.open_orders(symbol)
+    assert book.exposure() == book.exposure(symbol) == 1010.0
+
+    sell_data = repository.create_sell_data(symbol, 2, 4, -1, "INTRADAY", 0, 0)
+    book.on_order_placed(sell_data, "S1")
+    book.on_fill("S1", 4, 110.0)
+    assert book.position(symbol) == 6 and book.positions[symbol].realised_pnl == 36.0
+    assert book.get_order("S1").status == order_book.TRADED and book.exposure() == 606.0
+
+    # the broker has one more share and the other order filled outside the book's events
+    broker.order_entries = [
+        {"id": buy_id, "symbol": symbol, "side": 1, "qty": 10, "filledQty": 10, "tradedPrice": 101.0, "status": 2},
+        {"id": other_id, "symbol": "NSE:OTHER-EQ", "side": 1, "qty": 3, "filledQty": 3, "tradedPrice": 50.0,
+         "status": 2},
+        {"id": "S1", "symbol": symbol, "side": -1, "qty": 4, "filledQty": 4, "tradedPrice": 110.0, "status": 2}]
+    broker.position_entries = [{"symbol": symbol, "netQty": 7, "netAvg": 101.0},
+                               {"symbol": "NSE:OTHER-EQ", "netQty": 3, "netAvg": 50.0}]
+    differences = book.reconcile(broker)
+    assert {"symbol": symbol, "local_qty": 6, "broker_qty": 7} in differences
+    assert {"order_id": other_id, "local": (order_book.PENDING, 0), "broker": (order_book.TRADED, 3)} in differences
+    assert book.position(symbol) == 7 and book.position("NSE:OTHER-EQ") == 3 and book.exposure() == 857.0
+    assert book.positions[symbol].realised_pnl == 36.0 and book.reconcile(broker) == []
+
+    # one row per product type is netted, an order placed while the broker is asked is kept
+    broker.position_entries = [{"symbol": symbol, "netQty": 7, "netAvg": 101.0, "productType": "INTRADAY"},
+                               {"symbol": "NSE:OTHER-EQ", "netQty": 3, "netAvg": 50.0, "productType": "INTRADAY"},
+                               {"symbol": "NSE:OTHER-EQ", "netQty": 2, "netAvg": 60.0, "productType": "CNC"}]
+    snapshot = broker.orderbook
+
+    def orderbook_then_place():
+        response = snapshot()
+        book.on_order_placed(repository.create_buy_data("NSE:LATE-EQ", 2, 1, 1, "INTRADAY", 0, 0), "LATE")
+        return response
+
+    broker.orderbook = orderbook_then_place
+    differences = book.reconcile(broker)
+    assert differences == [{"symbol": "NSE:OTHER-EQ", "local_qty": 3, "broker_qty": 5}], differences
+    assert book.position("NSE:OTHER-EQ") == 5 and book.exposure("NSE:OTHER-EQ") == 270.0
+    assert book.get_order("LATE") is not None and "NSE:LATE-EQ" in book.active_symbols
+
+    # single trades of one order filled from two threads at once are all counted
+    book.on_order_placed(repository.create_buy_data("NSE:BUSY-EQ", 2, 10000, 1, "INTRADAY", 0, 0), "BUSY")
+    fillers = [threading.Thread(target=lambda: [book.on_fill("BUSY", 1, 10.0) for _ in range(5000)])
+               for _ in range(2)]
+    for filler in fillers:
+        filler.start()
+    for filler in fillers:
+        filler.join()
+    assert book.position("NSE:BUSY-EQ") == 10000 and book.get_order("BUSY").status == order_book.TRADED
+
+
+def test_risk_reservation_during_fill():
+    """
+    Fails if a fill is counted both as day exposure and as reservation at any moment, or if approve reads the book
+    while another thread holds its lock
+    """
+    book = order_book.OrderBook()
+    risk = risk_engine.RiskEngine(book, max_symbol_exposure=10000, max_daily_exposure=10000)
+    symbol = "NSE:TEST-EQ"
+    buy_data = repository.create_buy_data(symbol, 1, 10, 1, "INTRADAY", 100.0, 0)
+    risk.bind(risk.approve(buy_data), "B1")
+    book.on_order_placed(buy_data, "B1")
+    counted = []
+    book.fill_listeners.append(lambda *fill: counted.append(risk.day_exposure + risk.reserved_total))
+    book.on_fill("B1", 4, 100.0)
+    book.on_order_update({"id": "B1", "filledQty": 10, "tradedPrice": 100.0, "status": order_book.TRADED})
+    assert counted == [1000.0, 1000.0] and not risk.reservations
+
+    approved = []
+    with book.lock:
+        approver = threading.Thread(target=lambda: approved.append(risk.approve(
+            repository.create_buy_data("NSE:OTHER-EQ", 1, 10, 1, "INTRADAY", 100.0, 0))))
+        approver.start()
+        approver.join(0.05)
+        assert approver.is_alive() and not approved, "approve did not wait for the book lock"
+    approver.join()
+    assert len(approved) == 1 and risk.reserved_total == 1000.0
+
+
+def test_reconcile_then_risk_check():
+    """
+    Fails if fills and positions found by reconcile do not reach the RiskEngine's day counters and reservations
+    """
+    clock = VirtualClock(1704166200)
+    book = order_book.OrderBook()
+    risk = risk_engine.RiskEngine(book, max_symbol_exposure=10000, max_daily_exposure=3000, max_open_positions=5,
+                                  max_daily_loss=100, clock=clock.time)
+    symbol, other, outside = "NSE:TEST-EQ", "NSE:OTHER-EQ", "NSE:OUTSIDE-EQ"
+    buy_data = repository.create_buy_data(symbol, 1, 10, 1, "INTRADAY", 100.0, 0)
+    risk.bind(risk.approve(buy_data), "B1")
+    book.on_order_placed(buy_data, "B1")
+    sell_data = repository.create_sell_data(other, 2, 5, -1, "INTRADAY", 0, 0)
+    book.on_order_placed(repository.create_buy_data(other, 2, 5, 1, "INTRADAY", 0, 0), "O1")
+    book.on_fill("O1", 5, 100.0)
+    book.on_order_placed(sell_data, "S1")
+    assert risk.reserved_total == 1000.0 and risk.day_exposure == 500.0
+
+    # B1 filled and S1 sold at a loss while the book was not listening, a position came from outside the book
+    broker = FakeReconcileBroker()
+    broker.order_entries = [
+        {"id": "B1", "symbol": symbol, "side": 1, "qty": 10, "filledQty": 10, "tradedPrice": 100.0, "status": 2},
+        {"id": "O1", "symbol": other, "side": 1, "qty": 5, "filledQty": 5, "tradedPrice": 100.0, "status": 2},
+        {"id": "S1", "symbol": other, "side": -1, "qty": 5, "filledQty": 5, "tradedPrice": 80.0, "status": 2}]
+    broker.position_entries = [{"symbol": symbol, "netQty": 10, "netAvg": 100.0},
+                               {"symbol": outside, "netQty": 4, "netAvg": 250.0}]
+    book.reconcile(broker)
+    assert book.position(symbol) == 10 and book.position(other) == 0 and book.exposure(outside) == 1000.0
+    assert book.positions[symbol].realised_pnl == 0.0 and risk.day_pnl == -100.0
+    assert risk.day_exposure == 2500.0 and risk.reserved_total == 0.0 and not risk.reservations
+    assert "daily loss" in risk.check(repository.create_buy_data("NSE:NEW-EQ", 1, 1, 1, "INTRADAY", 100.0, 0))
+    assert book.reconcile(broker) == [] and risk.day_exposure == 2500.0
+
+    # the broker closed the outside position, nothing was realised that the book knows of
+    broker.position_entries = broker.position_entries[:1]
+    book.reconcile(broker)
+    assert book.position(outside) == 0 and risk.day_exposure == 2500.0 and risk.day_pnl == -100.0
+    clock.now += 24 * 60 * 60
+    assert risk.check(repository.create_buy_data("NSE:NEW-EQ", 1, 30, 1, "INTRADAY", 100.0, 0)) is None
+    assert "day" in risk.check(repository.create_buy_data("NSE:NEW-EQ", 1, 31, 1, "INTRADAY", 100.0, 0))
+
+
+def test_risk_engine():
+    """
+    Fails if the RiskEngine sizes a trade wrongly, lets an order break a limit, stops an exit or does not restart
+    its day counters
+    """
+    clock = VirtualClock(1704166200)  # 09:00 IST
+    book = order_book.OrderBook()
+    risk = risk_engine.RiskEngine(book, funds=50000, risk_per_trade=500, max_symbol_exposure=20000,
+                                  max_daily_exposure=30000, max_open_positions=2, max_daily_loss=300, clock=clock.time)
+    symbol, other, third = "NSE:TEST-EQ", "NSE:OTHER-EQ", "NSE:THIRD-EQ"
+
+    # 500 risked over a 2 rupee stop is 250 shares, the symbol limit leaves room for 200 at 100
+    assert risk.quantity(symbol, 100.0, 98.0) == 200 and risk.quantity(symbol, 100.0, 90.0) == 50
+    buy_data = repository.create_buy_data(symbol, 1, 200, 1, "INTRADAY", 100.0, 0)
+    assert risk.check(buy_data) is None
+    assert "TEST" in risk.check(repository.create_buy_data(symbol, 1, 201, 1, "INTRADAY", 100.0, 0))
+    assert risk.check(repository.create_buy_data(symbol, 2, 10, 1, "INTRADAY", 0, 0)) is not None  # no price
+    risk.on_price(symbol, 100.0)
+    assert risk.check(repository.create_buy_data(symbol, 2, 10, 1, "INTRADAY", 0, 0)) is None
+
+    book.on_order_placed(buy_data, "B1")
+    book.on_fill("B1", 200, 100.0)
+    assert risk.day_exposure == 20000.0 and risk.quantity(symbol, 100.0, 98.0) == 0
+    with pytest.raises(risk_engine.RiskRejected) as rejected:
+        repository.place_order(repository.create_buy_data(symbol, 1, 1, 1, "INTRADAY", 100.0, 0), risk=risk)
+    assert symbol in rejected.value.reason and risk.rejections == 1
+
+    # the day limit is 30000 and 20000 is used
+    assert risk.quantity(other, 100.0, 98.0) == 100
+    assert "day" in risk.check(repository.create_buy_data(other, 1, 101, 1, "INTRADAY", 100.0, 0))
+    other_data = repository.create_buy_data(other, 1, 50, 1, "INTRADAY", 100.0, 0)
+    book.on_order_placed(other_data, "O1")  # a working order takes a position slot
+    assert "open positions" in risk.check(repository.create_buy_data(third, 1, 1, 1, "INTRADAY", 10.0, 0))
+
+    # losing 400 on the exit stops new positions but never the exits
+    sell_data = repository.create_sell_data(symbol, 2, 100, -1, "INTRADAY", 0, 0)
+    assert risk.check(sell_data, 96.0) is None
+    book.on_order_placed(sell_data, "S1")
+    book.on_fill("S1", 100, 96.0)
+    assert risk.day_pnl == -400.0 and risk.day_exposure == 20000.0 and risk.available_funds == 49600.0
+    assert "daily loss" in risk.check(repository.create_buy_data(symbol, 1, 1, 1, "INTRADAY", 96.0, 0))
+    assert risk.check(repository.create_sell_data(symbol, 2, 100, -1, "INTRADAY", 0, 0), 95.0) is None
+    assert risk.check(repository.create_sell_data(symbol, 2, 101, -1, "INTRADAY", 0, 0), 95.0) is not None
+
+    async def submit():
+        gateway = order_gateway.OrderGateway(client=FakeReconcileBroker(), book=book, risk=risk)
+        try:
+            await gateway.submit(repository.create_buy_data(other, 1, 1, 1, "INTRADAY", 100.0, 0))
+            return None
+        except risk_engine.RiskRejected as error:
+            return error.reason
+        finally:
+            await gateway.close()
+
+    assert "daily loss" in asyncio.run(submit())
+
+    # the next IST day starts with fresh counters, the positions stay
+    clock.now += 24 * 60 * 60
+    assert risk.check(repository.create_buy_data(other, 1, 50, 1, "INTRADAY", 100.0, 0)) is None
+    assert risk.day_pnl == 0.0 and risk.day_exposure == 0.0 and book.position(symbol) == 100
+
+    # working orders count as much as filled ones until they fill or are cancelled
+    book = order_book.OrderBook()
+    risk = risk_engine.RiskEngine(book, max_symbol_exposure=10000, max_daily_exposure=25000, max_open_positions=2,
+                                  clock=clock.time)
+    working = repository.create_buy_data(symbol, 1, 10, 1, "INTRADAY", 900.0, 0)
+    approved = []
+    for _ in range(10):
+        try:
+            approved.append(risk.approve(working))
+        except risk_engine.RiskRejected:
+            pass
+    assert len(approved) == 1 and risk.reserved_total == 9000.0
+    risk.bind(approved[0], "W1")
+    book.on_order_placed(working, "W1")
+    book.on_order_update({"id": "W1", "filledQty": 4, "tradedPrice": 900.0, "status": order_book.PENDING})
+    assert risk.reserved_total == 5400.0 and book.exposure(symbol) + risk.reserved_exposure[symbol] == 9000.0
+    assert risk.check(repository.create_buy_data(symbol, 1, 2, 1, "INTRADAY", 900.0, 0)) is not None
+    book.on_order_update({"id": "W1", "status": order_book.CANCELLED})
+    assert risk.reserved_total == 0.0 and not risk.reservations and risk.day_exposure == 3600.0
+    assert risk.check(repository.create_buy_data(symbol, 1, 7, 1, "INTRADAY", 900.0, 0)) is None
+    risk.release(risk.approve(repository.create_buy_data(other, 1, 10, 1, "INTRADAY", 900.0, 0)))
+    assert not risk.reservations and not risk.reserved_orders
+
+    # a batch through the gateway is approved one order at a time against the orders before it
+    async def place(orders):
+        gateway = order_gateway.OrderGateway(client=FakeReconcileBroker(), risk=risk)
+        results = await gateway.place_orders(orders)
+        await gateway.close()
+        return results
+
+    batch = [repository.create_buy_data(f"NSE:NEW{number}-EQ", 1, 1, 1, "INTRADAY", 100.0, 0) for number in range(8)]
+    results = asyncio.run(place(batch))
+    placed = [result for result in results if isinstance(result, str)]
+    assert len(placed) == 1 and all(isinstance(result, risk_engine.RiskRejected) for result in results[1:])
+    assert len(book.active_symbols) == 2 and set(risk.reservations) == set(placed)
+
+
+def test_candle_buffer(bars=10000, capacity=3000):
+    """
+    Fails if the CandleBuffer does not hold exactly the newest capacity candles
+    :param bars: number of candles pushed through
+    :param capacity: candles kept
+    """
+    candles = generate_ohlc(bars)
+    candles["EPOCH"] = np.arange(bars, dtype=np.float64)
+    candles["VOLUME"] = np.ones(bars)
+    rows = list(zip(*(candles[column].tolist() for column in repository.CANDLE_COLUMNS)))
+
+    appended = candle_buffer.CandleBuffer(capacity)
+    for row in rows:
+        appended.append(*row)
+    extended = candle_buffer.CandleBuffer(capacity)
+    for start in range(0, bars, 700):
+        extended.extend({column: values[start:start + 700] for column, values in candles.items()})
+
+    for buffer in (appended, extended):
+        assert len(buffer) == min(bars, capacity) and buffer.last() == rows[-1]
+        for column in repository.CANDLE_COLUMNS:
+            assert buffer[column].flags["C_CONTIGUOUS"]
+            assert (buffer[column] == candles[column][-capacity:]).all(), f"{column} differs"
+        assert buffer.data.nbytes <= 1.25 * capacity * len(repository.CANDLE_COLUMNS) * 8 + 1024
+
+
+def test_live_feed(bars=3000, seed_bars=1000, resolution=5):
+    """
+    Fails if ticks replayed from a file do not rebuild the candles and the batch Supertrend, or if bars do not
+    close on their boundary without waiting for the next tick
+    :param bars: number of candles turned into ticks
+    :param seed_bars: candles used to seed the indicators
+    :param resolution: minutes per candle
+    """
+    step = resolution * 60
+    sessions = generate_session_candles(bars // (375 // resolution) + 1, resolution)
+    candles = np.array([sessions[column] for column in repository.CANDLE_COLUMNS]).T[:bars]
+    ticks = [(epoch + offset, ltp, volume / 4)
+             for epoch, open_, high, low, close, volume in candles[seed_bars:].tolist()
+             for offset, ltp in ((0, open_), (60, high), (120, low), (step - 1, close))]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "ticks.csv")
+        with open(path, "w") as f:
+            f.write("epoch,ltp,volume\n")
+            for epoch, ltp, volume in ticks:
+                f.write(f"{epoch:.0f},{ltp!r},{volume!r}\n")
+
+        columns = repository.get_candle_columns({"candles": candles[:seed_bars]})
+        engine = live_feed.SignalEngine(columns, atr_period=12, multiplier=3)
+        builder = live_feed.CandleBuilder(resolution)
+        decisions = []
+        builder.on_bar.append(lambda bar: decisions.append(engine.on_bar(bar)))
+        live_feed.run_feed(live_feed.ReplayFeed(path), [builder])
+
+    for row, column in enumerate(repository.CANDLE_COLUMNS[:5]):
+        assert np.allclose(builder.bars[column], candles[seed_bars:, row]), f"{column} of the bars differs"
+    supertrend = repository.get_supertrend_arrays(candles[:, 2], candles[:, 3], candles[:, 4], 12, 3)[0]
+    assert [decision["supertrend"] for decision in decisions] == supertrend[seed_bars:].tolist()
+
+    # clock marks close every bar at its boundary
+    engine = live_feed.SignalEngine(columns, atr_period=12, multiplier=3)
+    builder = live_feed.CandleBuilder(resolution)
+    closed = []
+    builder.on_bar.append(lambda bar: closed.append(engine.on_bar(bar)))
+    for index in range(0, len(ticks), 4):
+        for tick in ticks[index:index + 4]:
+            builder.on_tick(*tick)
+        builder.close_due(builder.current_end)
+        assert builder.current is None, "a bar waited for the next tick"
+    assert closed == decisions
+
+    # the 15:15 hour bar closes at 15:30, a tick after the close does not reopen it
+    hour = live_feed.CandleBuilder(60)
+    session_close = session_calendar.session_bounds(1704166200)[1]
+    hour.on_tick(session_close - 600, 100.0, 1.0)
+    assert hour.close_due(session_close - 1) is None and hour.close_due(session_close)[0] == session_close - 900
+    assert hour.on_tick(session_close + 60, 101.0, 1.0) is None and hour.current is None
+
+    # the bar clock pushes a mark at the next boundary, the queued tick's bar closes without another tick
+    now = time.time()
+    offset = session_calendar.next_bar_close(now, 60) - now - 0.02
+    feed = live_feed.QueueFeed()
+    minute = live_feed.CandleBuilder(1)
+    feed.push(now + offset, 100.0, 1.0)
+    stopped = live_feed.start_bar_clock(feed, 60, clock=lambda: time.time() + offset)
+    consumer = threading.Thread(target=live_feed.run_feed, args=(feed, [minute]))
+    consumer.start()
+    deadline = time.time() + 1.0
+    while not len(minute.bars) and time.time() < deadline:
+        time.sleep(0.005)
+    closed_on_time = len(minute.bars)
+    stopped.set()
+    feed.close()
+    consumer.join()
+    assert closed_on_time == 1, "the bar clock did not close the bar"
+
+
+def test_live_feed_session_hours(day_start=1704133800):
+    """
+    Fails if a pre-open or after close tick opens a bar outside the 09:15 - 15:30 session
+    :param day_start: EPOCH of an IST midnight
+    """
+    session_open, session_close = session_calendar.session_bounds(day_start + 12 * 60 * 60)
+    ticks = [session_open - 16 * 60, session_open - 1, session_open, session_open + 7 * 60, session_close - 20 * 60,
+             session_close - 1, session_close, session_close + 5, session_close + 4 * 60, session_close + 15 * 60]
+    for resolution in (1, 5, 15, 60):
+        builder = live_feed.CandleBuilder(resolution)
+        for epoch in ticks:
+            builder.on_tick(epoch, 100.0, 1.0)
+        builder.on_tick(session_open + 24 * 60 * 60 - 60, 100.0, 1.0)  # pre-open of the next day
+        assert builder.current is None, f"{resolution} minute bar open outside the session"
+        starts = builder.bars["EPOCH"].astype(np.int64)
+        assert session_calendar.in_session_mask(starts).all(), f"{resolution} minute bar outside the session"
+        assert starts[0] == session_open and starts[-1] == session_calendar.bar_start(session_close - 1,
+                                                                                       resolution * 60)
+
+
+def test_daemon(resolution=5, day_start=1704133800):
+    """
+    Fails if BarDaemon misses a bar of the session, fetches more than the newest bars, decides
+    differently from the batch Supertrend or keeps running after market close
+    :param resolution: minutes per candle
+    :param day_start: EPOCH of an IST midnight, the session replayed is that day
+    """
+    step = resolution * 60
+    previous_open, previous_close = session_calendar.session_bounds(day_start - 12 * 60 * 60)
+    session_open, session_close = session_calendar.session_bounds(day_start + 12 * 60 * 60)
+    epochs = list(range(previous_open, previous_close, step)) + list(range(session_open, session_close, step))
+    candles = generate_ohlc(len(epochs))
+    rows = [[epoch, *values] for epoch, values in
+            zip(epochs, zip(*(candles[column].tolist() for column in ("OPEN", "HIGH", "LOW", "CLOSE"))))]
+    rows = [row + [1000.0] for row in rows]
+
+    assert session_calendar.next_bar_close(session_open - 600, step) == session_open + step
+    assert session_calendar.next_bar_close(session_open + step, step) == session_open + 2 * step
+    assert session_calendar.next_bar_close(session_close - 1, 60 * 60) == session_close
+
+    clock = VirtualClock(session_open - 15 * 60)
+    late = (session_open + 10 * step, session_open + 40 * step)
+    client = SessionHistoryClient(rows, clock, step, late)
+    decisions = []
+    bar_daemon = daemon.BarDaemon("TEST", str(resolution), from_days=3, on_signal=decisions.append, client=client,
+                                  store=False, clock=clock.time, sleep=clock.sleep)
+    bar_daemon.load()
+    cycles = bar_daemon.run()
+
+    session_bars = (session_close - session_open) // step
+    assert cycles == session_bars, f"{cycles} cycles"
+    assert [decision["epoch"] for decision in decisions] == epochs[-session_bars:]
+    assert session_close <= clock.time() < session_close + 60, "daemon did not stop at market close"
+    # after the history request every request gets the newest bar only, or nothing while it is late
+    assert client.requests[0] == len(epochs) - session_bars and max(client.requests[1:]) == 1
+    assert len(client.requests) == 1 + session_bars + len(late)
+    supertrend = repository.get_supertrend_arrays(candles["HIGH"], candles["LOW"], candles["CLOSE"], 12, 3)[0]
+    assert [decision["supertrend"] for decision in decisions] == supertrend[-session_bars:].tolist()
+
+
+def test_resample(days=20, minutes_list=(5, 15, 60)):
+    """
+    Fails if resample or the incremental Resampler build other higher timeframe candles than
+    grouping the 1 minute candles by bar start one by one
+    :param days: sessions of 1 minute candles checked
+    :param minutes_list: higher timeframes built
+    """
+    for drop in (0.0, 0.05):
+        base = generate_session_candles(days, drop=drop)
+        timeframes = resample.resample_many(base, minutes_list)
+        for minutes in minutes_list:
+            expected = legacy_resample(base, minutes)
+            actual = np.array([timeframes[minutes][column] for column in repository.CANDLE_COLUMNS])
+            np.testing.assert_allclose(actual, expected, err_msg=f"{minutes} minute bars differ")
+
+            resampler = resample.Resampler(1, minutes)
+            closed = []
+            resampler.on_bar.append(closed.append)
+            resampler.extend(base)
+            if not drop:
+                # every bar closes with its last 1 minute candle, nothing waits for the next one
+                assert resampler.forming is None and len(closed) == expected.shape[1]
+            resampler.flush()
+            np.testing.assert_allclose(np.array(closed).T, expected)
+
+    # a late 5 minute candle of the closed 09:15 bar does not close the forming 09:30 bar early
+    base = {column: values[:6] for column, values in generate_session_candles(1, minutes=5).items()}
+    rows = list(zip(*(base[column].tolist() for column in repository.CANDLE_COLUMNS)))
+    resampler = resample.Resampler(5, 15)
+    for row in rows[:4] + [rows[2]] + rows[4:]:
+        resampler.on_base_bar(row)
+    np.testing.assert_allclose(np.array(resampler.bars.last()), legacy_resample(base, 15)[:, 1])
+    assert len(resampler.bars) == 2 and resampler.forming is None
+
+    # 60 minute bars start at 09:15 and the last one of the day is 15:15 - 15:30
+    hours = resample.resample(generate_session_candles(1), 60)
+    local_minutes = (hours["EPOCH"].astype(np.int64) + session_calendar.IST_OFFSET) % (24 * 60 * 60) // 60
+    assert local_minutes.tolist() == [9 * 60 + 15 + 60 * hour for hour in range(7)]
+
+
+def test_session_calendar(days=30, minutes=5):
+    """
+    Fails if session_calendar disagrees with converting every EPOCH to an IST datetime, or if its
+    masks pick other candles than the INDEX_LIST of experiments.py
+    :param days: sessions checked
+    :param minutes: minutes per candle
+    """
+    epochs = generate_session_candles(days, minutes, drop=0.1)["EPOCH"]
+    calendar = session_calendar.session_calendar(epochs, minutes)
+    np.testing.assert_array_equal(np.array([calendar["day"], calendar["minutes"], calendar["position"]]),
+                                  legacy_session_calendar(epochs))
+    assert (session_calendar.session_dates(epochs[:1]) == np.datetime64("2024-01-02")).all()
+    np.testing.assert_array_equal(session_calendar.bar_of_day(epochs, minutes), calendar["minutes"] // minutes)
+    np.testing.assert_array_equal(calendar["bar_of_day"], session_calendar.bar_of_day(epochs, minutes))
+    # with missing candles both masks still pick clock slots, never the candles that moved up into them
+    np.testing.assert_array_equal(session_calendar.first_bars_mask(epochs, minutes, 12), calendar["bar_of_day"] < 12)
+    np.testing.assert_array_equal(session_calendar.last_bars_mask(epochs, minutes, 12),
+                                  calendar["bar_of_day"] >= 75 - 12)
+    assert session_calendar.in_session_mask(epochs).all()
+    assert not session_calendar.in_session_mask([epochs[0] - 60, epochs[-1] + 60 * 60]).any()
+
+    days_of, starts, ends = session_calendar.session_slices(epochs)
+    assert len(days_of) == days and (calendar["position"][starts] == 0).all()
+    assert (calendar["remaining"][ends - 1] == 0).all()
+
+    full = generate_session_candles(5, minutes)["EPOCH"]
+    _, _, full_ends = session_calendar.session_slices(full)
+    assert (session_calendar.last_bars_mask(full, minutes) == np.isin(np.arange(len(full)), full_ends - 1)).all()
+    assert np.flatnonzero(session_calendar.last_bars_mask(full, minutes, 2)).tolist() == \
+        sorted(np.concatenate((full_ends - 1, full_ends - 2)).tolist())
+    # during a session the newest candle is not the last bar before close
+    assert np.flatnonzero(session_calendar.last_bars_mask(full[:75 + 40], minutes)).tolist() == [74]
+    index_list = [day * 75 + bar for day in range(5) for bar in range(12)]
+    assert np.flatnonzero(session_calendar.first_bars_mask(full, minutes, 12)).tolist() == index_list
+
+
+def test_trade_diff_result(bars=600, atr_period=12, multiplier=3, dema_time_period=3, per=1.003):
+    """
+    Fails if repository.get_trade_diff_result differs from the loop in experiments.py
+    :param bars: number of candles, the original loop is quadratic so keep it small
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    :param dema_time_period: DEMA period
+    :param per: sell percentage criteria
+    """
+    dataframe_data = pd.DataFrame(generate_ohlc(bars))
+    expected = legacy_trade_diff_result(dataframe_data, atr_period, multiplier, dema_time_period, per)
+    actual = repository.get_trade_diff_result(dataframe_data, atr_period, multiplier, dema_time_period, per)
+    assert len(expected) > 0 and len(actual) == len(expected), "number of trades differs"
+    for expected_row, actual_row in zip(expected, actual):
+        assert expected_row[:3] == actual_row[:3], f"trade differs: {expected_row} {actual_row}"
+        np.testing.assert_allclose(actual_row[3:], expected_row[3:], rtol=1e-9)
+
+
+def test_ema_backtest(bars=20000, period=5, rr_ratio_changer=2):
+    """
+    Fails if backtest.run_ema_backtest does not match ema_initializer
+    :param bars: number of candles
+    :param period: EMA period
+    :param rr_ratio_changer: value defined by us
+    """
+    candles = generate_ohlc(bars, volatility=0.004)
+    ema_values = repository.get_ema(candles["CLOSE"], period)
+    while True:
+        try:
+            records = legacy_ema_backtest(candles, ema_values, rr_ratio_changer, logging.INFO)
+            break
+        except IndexError:
+            # ema_initializer sells at the next CLOSE and crashes when the exit is on the last candle
+            candles = {column: values[:-1] for column, values in candles.items()}
+            ema_values = ema_values[:-1]
+    totals = next(record for record in records if record.event == "backtest_summary")
+    exits = [record for record in records if record.event == "sell" and record.rule in ("stop_loss", "target")]
+
+    ledger, summary = backtest.run_ema_backtest(candles["HIGH"], candles["LOW"], candles["CLOSE"], ema_values,
+                                                rr_ratio_changer)
+    assert summary["trade_count"] == totals.trade_count == len(exits), "trade count differs"
+    assert summary["stop_loss_count"] == totals.stop_loss_count, "stop loss count differs"
+    assert abs(summary["final_pnl"] - totals.final_pnl) < 1e-6, "final PnL differs"
+    np.testing.assert_allclose(ledger["exit_price"][:len(exits)], [record.price for record in exits])
+
+
+class ScriptedStrategy:
+    """
+    Strategy for the event backtest that places fixed orders on fixed candles
+    """
+
+    def __init__(self, orders_by_index):
+        """
+        :param orders_by_index: dictionary of candle index to the order dictionaries placed after it closes
+        """
+        self.orders_by_index = orders_by_index
+        self.order_ids = []
+
+    def signals(self, backtest):
+        signals = np.zeros(len(backtest.close), dtype=np.bool_)
+        signals[list(self.orders_by_index)] = True
+        return signals
+
+    def on_bar(self, backtest, index):
+        for order_data in self.orders_by_index[index]:
+            self.order_ids.append(backtest.submit(order_data))
+
+    def on_fill(self, backtest, order_id, index, price, qty):
+        pass
+
+
+def test_event_backtest(years=1, minutes_per_day=375, days_per_year=250):
+    """
+    Fails if EventBacktest fills orders at the wrong candle or price, or sells more than the position over a year
+    of 1 minute candles
+    :param years: years of 1 minute candles replayed
+    :param minutes_per_day: candles in one session
+    :param days_per_year: sessions in one year
+    """
+    assert repository.quantity(50000, 95, 100) == 100
+    assert repository.quantity(50000, 99.9, 100) == 500
+    assert repository.quantity(50000, 100, 100) == 0
+
+    def order(type, qty, side, limit_price=0, stop_price=0):
+        return repository.create_buy_data("NSE:TEST-EQ", type, qty, side, "INTRADAY", limit_price, stop_price)
+
+    buy, sell = backtest.BUY_SIDE, backtest.SELL_SIDE
+    candles = np.array([[100, 101, 99, 100],
+                        [100, 102, 99, 101],
+                        [103, 105, 102, 104],  # gaps up
+                        [104, 104, 96, 97],
+                        [97, 99, 95, 98],
+                        [98, 110, 98, 109]], dtype=np.float64).T
+    strategy = ScriptedStrategy({
+        0: [order(backtest.MARKET_ORDER, 10, buy)],
+        1: [order(backtest.LIMIT_ORDER, 5, sell, limit_price=104.5),  # partial exit
+            order(backtest.STOP_ORDER, 5, sell, stop_price=96.5)],
+        3: [order(backtest.STOP_ORDER, 4, buy, stop_price=100),
+            order(backtest.LIMIT_ORDER, 2, buy, limit_price=98)],  # the next OPEN is already below the limit
+        4: [order(backtest.STOP_LIMIT_ORDER, 6, sell, limit_price=99, stop_price=105)],
+    })
+    fills, summary = backtest.EventBacktest(*candles, slippage=0.001).run(strategy)
+    np.testing.assert_array_equal(fills["index"], [1, 2, 3, 4, 5, 5])
+    np.testing.assert_array_equal(fills["order_id"], [1, 2, 3, 5, 4, 6])
+    np.testing.assert_allclose(fills["price"], [100.1, 104.5, 96.5 * 0.999, 97, 100.1, 99])
+    np.testing.assert_allclose(fills["pnl"], [0, 5 * 4.4, 5 * (96.5 * 0.999 - 100.1), 0, 0, 594 - 594.4])
+    assert summary["trade_count"] == 2 and summary["open_position"] == 0, summary
+    assert abs(summary["final_pnl"] - fills["pnl"].sum()) < 1e-9
+
+    # a market order for 10 shares with 3 shares of room per candle fills over four candles
+    volume = np.full(6, 1000.0)
+    fills, summary = backtest.EventBacktest(*candles, volume, volume_share=0.003).run(
+        ScriptedStrategy({0: [order(backtest.MARKET_ORDER, 10, buy)]}))
+    np.testing.assert_array_equal(fills["qty"], [3, 3, 3, 1])
+    np.testing.assert_array_equal(fills["price"], candles[0][1:5])
+    assert summary["open_position"] == 10
+
+    bars = years * days_per_year * minutes_per_day
+    candles = generate_ohlc(bars, volatility=0.0008)
+    ema_values = repository.get_ema(candles["CLOSE"], 20)
+    fills, summary = backtest.EventBacktest(candles["OPEN"], candles["HIGH"], candles["LOW"], candles["CLOSE"],
+                                            slippage=0.0005).run(backtest.EMABreakoutStrategy(ema_values, 3, 1))
+    assert summary["trade_count"] > 100, summary
+    # exits never sell more than the position and the half exits at fix_rr did happen
+    assert (np.cumsum(fills["side"] * fills["qty"]) >= 0).all()
+    assert ((fills["side"] == sell) & (fills["pnl"] > 0)).sum() > summary["win_count"]
+    assert abs(summary["final_pnl"] - fills["pnl"].sum()) < 1e-6
+
+
+def test_grid_search(bars=3000, max_workers=2):
+    """
+    Fails if a row of sweep.grid_search differs from get_trade_diff_result with the same parameters, or the grid
+    is not complete and ranked by final PnL
+    :param bars: number of candles
+    :param max_workers: number of processes
+    """
+    candles = generate_ohlc(bars)
+    grid = ((10, 14), (2.0, 3.0), (3, 7), (1.01, 1.03))
+    table = sweep.grid_search(candles, *grid, max_workers=max_workers)
+    assert len(table) == 16 and table["final_pnl"].is_monotonic_decreasing
+    assert set(table[["atr_period", "multiplier", "dema_period", "per"]].itertuples(index=False, name=None)) == \
+        set(itertools.product(*grid))
+    for row in table.itertuples(index=False):
+        trades = repository.get_trade_diff_result(candles, row.atr_period, row.multiplier, row.dema_period, row.per)
+        trade_diffs = np.array([trade[3] for trade in trades])
+        assert row.trade_count == len(trades) > 0, row
+        np.testing.assert_allclose(row.final_pnl, trades[-1][4], rtol=1e-9)
+        assert row.win_rate == (trade_diffs > 0).mean()
+
+
+def test_random_search(bars=3000, samples=6, seed=11):
+    """
+    Fails if sweep.random_search draws other combinations for the same seed, returns another number of rows or
+    other columns, or draws outside the ranges
+    :param bars: number of candles
+    :param samples: number of combinations
+    :param seed: seed of the random generator
+    """
+    candles = generate_ohlc(bars)
+    ranges = {"atr_periods": (8, 16), "multipliers": (1.5, 3.5), "dema_periods": (3, 9), "pers": (1.01, 1.05)}
+    table = sweep.random_search(candles, samples, seed=seed, max_workers=2, **ranges)
+    pd.testing.assert_frame_equal(table, sweep.random_search(candles, samples, seed=seed, max_workers=1, **ranges))
+    assert list(table.columns) == ["atr_period", "multiplier", "dema_period", "per", "trade_count", "final_pnl",
+                                   "win_rate"]
+    assert len(table) == samples and table["final_pnl"].is_monotonic_decreasing
+    for column, (low, high) in zip(("atr_period", "multiplier", "dema_period", "per"), ranges.values()):
+        assert table[column].between(low, high).all(), column
+    other = sweep.random_search(candles, samples, seed=seed + 1, max_workers=1, **ranges)
+    assert not table[["atr_period", "multiplier"]].equals(other[["atr_period", "multiplier"]])
+
+
+def test_walk_forward(bars=50_000, train_bars=10_000, test_bars=2500, max_workers=2):
+    """
+    Fails if walk_forward.walk_forward picks other parameters or PnL than recomputing every indicator per window
+    :param bars: number of candles
+    :param train_bars: candles in a train window
+    :param test_bars: candles in a test window
+    :param max_workers: number of processes
+    """
+    candles = generate_ohlc(bars)
+    windows = walk_forward.walk_forward_windows(bars, train_bars, test_bars)
+    assert windows[0] == (0, train_bars, train_bars + test_bars) and windows[-1][2] <= bars
+    assert all(window[0] == 0 for window in walk_forward.walk_forward_windows(bars, train_bars, test_bars,
+                                                                               anchored=True))
+    grid = ((8, 10, 12, 14, 16, 18), (1.5, 2.0, 2.5, 3.0), (3, 5, 7, 9), (1.01, 1.02, 1.03))
+
+    table = walk_forward.walk_forward(candles, windows, *grid, max_workers=max_workers)
+    expected = legacy_walk_forward(candles, windows, *grid)
+
+    actual = table[["atr_period", "multiplier", "dema_period", "per"]].itertuples(index=False)
+    assert [tuple(row) for row in actual] == [row[:4] for row in expected]
+    np.testing.assert_allclose(table["train_pnl"], [row[4] for row in expected])
+    np.testing.assert_allclose(table["test_pnl"], [row[5] for row in expected])
+
+
+def test_matrix_indicators(symbols=40, max_bars=3000, atr_period=12, multiplier=3):
+    """
+    Fails if a row of the matrix indicators differs from the 1-D function on that symbol, with
+    and without the numba kernel, and if scanner.get_signals differs from get_signal
+    :param symbols: number of symbols, their histories have random lengths
+    :param max_bars: longest history
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    """
+    lengths = np.random.default_rng(5).integers(0, max_bars, symbols).tolist() + [max_bars, 1]
+    histories = [generate_ohlc(bars, seed=row) for row, bars in enumerate(lengths)]
+    high, low, close = (matrix_indicators.to_matrix([candles[column] for candles in histories])
+                        for column in ("HIGH", "LOW", "CLOSE"))
+
+    kernel = matrix_indicators._supertrend_rows_jit
+    try:
+        for matrix_kernel in {kernel, None}:
+            matrix_indicators._supertrend_rows_jit = matrix_kernel
+            supertrend = matrix_indicators.get_supertrend_matrix(high, low, close, atr_period, multiplier)
+            for row, candles in enumerate(histories):
+                bars = len(candles["CLOSE"])
+                expected = repository.get_supertrend_arrays(candles["HIGH"], candles["LOW"], candles["CLOSE"],
+                                                            atr_period, multiplier)
+                for actual_values, expected_values in zip(supertrend, expected):
+                    np.testing.assert_array_equal(actual_values[row, max_bars - bars:], expected_values)
+                assert not supertrend[0][row, :max_bars - bars].any()
+                assert np.isnan(supertrend[3][row, :max_bars - bars]).all()
+    finally:
+        matrix_indicators._supertrend_rows_jit = kernel
+
+    ema = matrix_indicators.get_ema_matrix(close, 5)
+    dema = matrix_indicators.get_dema_matrix(close, 3)
+    for row, candles in enumerate(histories):
+        bars = len(candles["CLOSE"])
+        np.testing.assert_array_equal(ema[row, max_bars - bars:], repository.get_ema(candles["CLOSE"], 5))
+        np.testing.assert_array_equal(dema[row, max_bars - bars:], repository.get_dema(candles["CLOSE"], 3))
+
+    candle_columns_by_symbol = {f"NSE:S{row}-EQ": {**candles, "EPOCH": np.arange(len(candles["CLOSE"]))}
+                                for row, candles in enumerate(histories)}
+    signals = scanner.get_signals(candle_columns_by_symbol)
+    for symbol, candles in candle_columns_by_symbol.items():
+        np.testing.assert_equal(signals[symbol], scanner.get_signal(candles), err_msg=f"{symbol} signal differs")
+
+
+class ScanClient:
+    """
+    Serves history() for the scanner from prepared responses, counts the calls in flight and fails for some symbols
+    """
+
+    def __init__(self, responses: dict, failing=(), delay=0.02):
+        self.responses = responses
+        self.failing = set(failing)
+        self.delay = delay
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+    def history(self, data):
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if data["symbol"] in self.failing:
+                raise ConnectionError(f"connection reset fetching {data['symbol']}")
+            return self.responses[data["symbol"]]
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def test_scan(symbols=24, bars=300, max_workers=4):
+    """
+    Fails if scan differs from get_signal per symbol, has more than max_workers fetches in flight or stops when
+    one symbol's fetch raises
+    :param symbols: watchlist length
+    :param bars: candles per symbol
+    :param max_workers: fetches allowed in flight
+    """
+    names = [f"S{number}" for number in range(symbols)]
+    # histories of different lengths end on different candles of the walk, so some symbols have a signal
+    responses = {f"NSE:{name}-EQ": generate_history_response(bars + 7 * number) for number, name in enumerate(names)}
+    client = ScanClient(responses, failing=["NSE:S3-EQ"])
+    collector = RecordCollector()
+    scanner.logger.addHandler(collector)
+    try:
+        rows = scanner.scan(names, max_workers=max_workers, rate_limit=1000, client=client, store=False)
+    finally:
+        scanner.logger.removeHandler(collector)
+
+    assert 1 < client.most_in_flight <= max_workers, client.most_in_flight
+    assert [record.stock_name for record in collector.records if record.event == "scan_skipped"] == ["S3"]
+    expected = {}
+    for name in names[:3] + names[4:]:
+        result = scanner.get_signal(repository.get_candle_columns(responses[f"NSE:{name}-EQ"]))
+        if result["signal"] or result["ema_breakout"]:
+            expected[name] = {"symbol": name, **result}
+    assert expected and {row["symbol"]: row for row in rows} == expected
+
+
+def test_rate_limiter(rate=50, calls=100, threads=4):
+    """
+    Fails if the RateLimiter lets more than rate calls start in a period or holds calls back longer than the
+    token bucket needs
+    :param rate: calls per second
+    :param calls: calls started from all threads together
+    :param threads: threads taking tokens at once
+    """
+    began = time.monotonic()
+    limiter = scanner.RateLimiter(rate)
+    starts = []
+    lock = threading.Lock()
+
+    def take(count):
+        for _ in range(count):
+            limiter.acquire()
+            with lock:
+                starts.append(time.monotonic())
+
+    workers = [threading.Thread(target=take, args=(calls // threads,)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    starts = np.sort(np.array(starts) - began)
+    # a full bucket starts rate calls at once, the rest come one token every 1 / rate seconds
+    earliest = np.maximum(np.arange(calls) - rate + 1, 0) / rate
+    assert len(starts) == calls and (starts >= earliest - 1e-3).all()
+    assert starts[-1] < earliest[-1] + 0.5, starts[-1]
+
+
+def test_indicator_cache(bars=5000, start=4000, atr_period=12, multiplier=3):
+    """
+    Fails if the cached indicators of a growing series differ from the batch functions, or the cache does not
+    count hits, extensions, misses and evictions as expected
+    :param bars: candles at the end
+    :param start: candles at the first call
+    :param atr_period: value defined by us
+    :param multiplier: value defined by us
+    """
+    candles = generate_ohlc(bars)
+    cache = indicator_cache.IndicatorCache(maxsize=3)
+    for n in (start, start, start + 1, start + 60, bars):
+        high, low, close = candles["HIGH"][:n], candles["LOW"][:n], candles["CLOSE"][:n]
+        actual = cache.supertrend(high, low, close, atr_period, multiplier)
+        expected = repository.get_supertrend_arrays(high, low, close, atr_period, multiplier)
+        np.testing.assert_array_equal(actual[0], expected[0])
+        for actual_values, expected_values in zip(actual[1:], expected[1:]):
+            np.testing.assert_allclose(actual_values, expected_values, rtol=1e-9)
+        np.testing.assert_allclose(cache.ema(close, 5), repository.get_ema(close, 5), rtol=1e-9)
+        np.testing.assert_allclose(cache.dema(close, 3), repository.get_dema(close, 3), rtol=1e-9)
+    # the jump to bars is longer than EXTEND_LIMIT, so it is computed again
+    assert cache.stats() == {"hits": 3, "extensions": 6, "misses": 6, "evictions": 0, "entries": 3}, cache.stats()
+
+    cache.ema(candles["OPEN"], 5)
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 3
+
+
+def test_metrics(calls=1000):
+    """
+    Fails if metrics.timed spans are not counted or the percentiles of a Histogram are off by more than a bucket
+    :param calls: number of timed calls
+    """
+    spanned = metrics.timed("test.noop")(lambda: None)
+    for _ in range(calls):
+        spanned()
+
+    stage = metrics.Histogram("test.uniform")
+    durations = np.random.default_rng(3).integers(1_000, 10_000_000, 100_000)
+    for nanoseconds in durations.tolist():
+        stage.record(nanoseconds)
+    for q in (0.50, 0.95, 0.99):
+        exact = np.quantile(durations, q) / 1e9
+        assert exact <= stage.percentile(q) <= exact * 1.25, f"p{q * 100:.0f} {stage.percentile(q)} vs {exact}"
+
+    text = metrics.dump_prometheus()
+    assert 'risingsun_stage_seconds{stage="test.noop",quantile="0.99"}' in text
+    assert f'risingsun_stage_seconds_count{{stage="test.noop"}} {calls}' in text
+
+
+def test_logs():
+    """
+    Fails if a record logged through the queue does not reach the file as one JSON object with its extra= fields,
+    or if configuring again leaves the previous file open
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        first_path, second_path = os.path.join(directory, "first.jsonl"), os.path.join(directory, "second.jsonl")
+        try:
+            logs.configure("INFO", first_path, console=False)
+            first_handlers = list(logs._listener.handlers)
+            logger = logs.get_logger("test")
+            logger.debug("not written")
+            logger.info("Bought %s at %s", "NSE:TEST-EQ", 101.5, extra={"event": "buy", "qty": 10})
+            try:
+                raise ValueError("broken")
+            except ValueError:
+                logger.exception("Failed", extra={"event": "failed"})
+
+            logs.configure("INFO", second_path, console=False)
+            assert all(handler.stream is None for handler in first_handlers), "the first file was left open"
+            logger.warning("Second file")
+            logs.shutdown()
+            assert logs._listener is None
+        finally:
+            logs.configure()
+
+        with open(first_path) as f:
+            entries = [json.loads(line) for line in f]
+        with open(second_path) as f:
+            assert [json.loads(line)["message"] for line in f] == ["Second file"]
+    assert [entry["message"] for entry in entries] == ["Bought NSE:TEST-EQ at 101.5", "Failed"]
+    assert entries[0]["level"] == "INFO" and entries[0]["logger"] == "risingsun.test"
+    assert entries[0]["event"] == "buy" and entries[0]["qty"] == 10 and isinstance(entries[0]["time"], float)
+    assert "ValueError: broken" in entries[1]["exception"] and entries[1]["event"] == "failed"
+    assert not {"args", "msg", "levelno", "exc_info"} & set(entries[0])
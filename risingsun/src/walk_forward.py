@@ -0,0 +1,155 @@
+import os
+import argparse
+import sweep
+import itertools
+import repository
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Set in every worker process by _attach_arrays
+_candles = None
+_supertrend = None
+_above_dema = None
+
+RESULT_COLUMNS = ["train_start", "train_end", "test_end", "atr_period", "multiplier", "dema_period", "per",
+                  "train_pnl", "train_trades", "test_pnl", "test_trades", "test_win_rate"]
+
+
+def walk_forward_windows(length: int, train_bars: int, test_bars: int, step=None, anchored=False):
+    """
+    Splits the candles into train windows each followed by its test window
+    :param length: number of candles
+    :param train_bars: candles a train window has, the first one when anchored
+    :param test_bars: candles a test window has
+    :param step: candles the windows move each time, defaults to test_bars so the test windows do not overlap
+    :param anchored: True makes every train window start at the first candle and grow
+    :return: list of (train_start, train_end, test_end), train is [train_start, train_end) and test
+        [train_end, test_end)
+    """
+    step = step or test_bars
+    windows = []
+    train_end = train_bars
+    while train_end + test_bars <= length:
+        windows.append((0 if anchored else train_end - train_bars, train_end, train_end + test_bars))
+        train_end += step
+    return windows
+
+
+def _attach_arrays(specs: list, n_supertrend: int):
+    """
+    Worker initializer, maps the candles and the indicator signals shared by the parent
+    :param specs: sweep.SharedArrays.specs of HIGH, LOW, CLOSE and of the Supertrend rows followed by the CLOSE
+        above DEMA rows
+    :param n_supertrend: number of Supertrend settings
+    """
+    global _candles, _supertrend, _above_dema
+    _candles, signals = sweep.attach_shared(specs)
+    _supertrend, _above_dema = signals[:n_supertrend], signals[n_supertrend:]
+
+
+def _compute_supertrend(row: int, atr_period: int, multiplier: float):
+    """
+    Computes the Supertrend of one setting over the whole history into its shared row
+    """
+    high, low, close = _candles
+    _supertrend[row] = repository.get_supertrend_arrays(high, low, close, atr_period, multiplier)[0]
+
+
+def _compute_above_dema(row: int, dema_period: int):
+    """
+    Computes CLOSE above DEMA of one period over the whole history into its shared row
+    """
+    close = _candles[2]
+    _above_dema[row] = close > np.asarray(repository.get_dema(close, dema_period))
+
+
+def _evaluate_window(window: tuple, supertrend_settings: list, dema_periods: list, pers: list):
+    """
+    Picks the parameters with the best PnL on the train window and scores them on the test window, the
+    indicators are slices of the whole history so every window starts with warmed up values
+    :param window: (train_start, train_end, test_end)
+    :param supertrend_settings: (atr_period, multiplier) of every Supertrend row
+    :param dema_periods: DEMA period of every CLOSE above DEMA row
+    :param pers: sell percentage criteria to try
+    :return: result dictionary
+    """
+    train_start, train_end, test_end = window
+    close = _candles[2, train_start:train_end]
+    best = None
+    for st_row in range(len(supertrend_settings)):
+        supertrend = _supertrend[st_row, train_start:train_end]
+        for dema_row in range(len(dema_periods)):
+            buy_signal = supertrend & _above_dema[dema_row, train_start:train_end]
+            for per in pers:
+                pnl, trade_count, _ = sweep.score_trades(close, buy_signal, ~supertrend, per)
+                if best is None or pnl > best[0]:
+                    best = (pnl, trade_count, st_row, dema_row, per)
+
+    train_pnl, train_trades, st_row, dema_row, per = best
+    supertrend = _supertrend[st_row, train_end:test_end]
+    test_pnl, test_trades, test_win_rate = sweep.score_trades(_candles[2, train_end:test_end],
+                                                              supertrend & _above_dema[dema_row, train_end:test_end],
+                                                              ~supertrend, per)
+    atr_period, multiplier = supertrend_settings[st_row]
+    return {"train_start": train_start, "train_end": train_end, "test_end": test_end, "atr_period": atr_period,
+            "multiplier": multiplier, "dema_period": dema_periods[dema_row], "per": per, "train_pnl": train_pnl,
+            "train_trades": train_trades, "test_pnl": test_pnl, "test_trades": test_trades,
+            "test_win_rate": test_win_rate}
+
+
+def walk_forward(candle_columns: dict, windows: list, atr_periods, multipliers, dema_periods, pers,
+                 max_workers=None):
+    """
+    Optimises the Supertrend + DEMA parameters on every train window and scores them on the test window after it;
+    every indicator is computed once over the whole history and shared, the windows run in parallel
+    :param candle_columns: dictionary with HIGH, LOW, CLOSE arrays, like repository.get_candle_columns returns
+    :param windows: list of (train_start, train_end, test_end), see walk_forward_windows
+    :param atr_periods: Supertrend ATR periods
+    :param multipliers: Supertrend multipliers
+    :param dema_periods: DEMA periods
+    :param pers: sell percentage criteria
+    :param max_workers: number of processes, defaults to the CPU count
+    :return: one row per window with the chosen parameters and their train and test results
+    """
+    length = len(candle_columns["CLOSE"])
+    supertrend_settings = [(int(atr_period), float(multiplier))
+                           for atr_period, multiplier in itertools.product(atr_periods, multipliers)]
+    dema_periods, pers = [int(period) for period in dema_periods], [float(per) for per in pers]
+    n_signals = len(supertrend_settings) + len(dema_periods)
+
+    with sweep.SharedArrays([sweep.shared_candles(candle_columns), ((n_signals, length), np.bool_)]) as shared, \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_arrays,
+                                initargs=(shared.specs, len(supertrend_settings))) as executor:
+        futures = [executor.submit(_compute_supertrend, row, *setting)
+                   for row, setting in enumerate(supertrend_settings)]
+        futures += [executor.submit(_compute_above_dema, row, period) for row, period in enumerate(dema_periods)]
+        for future in futures:
+            future.result()
+        futures = [executor.submit(_evaluate_window, tuple(window), supertrend_settings, dema_periods, pers)
+                   for window in windows]
+        results = [future.result() for future in futures]
+
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward Supertrend + DEMA optimisation over the cached candles")
+    parser.add_argument("--stock", default="HINDUNILVR")
+    parser.add_argument("--resolution", default="5")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--train", type=int, default=6000, help="candles in a train window")
+    parser.add_argument("--test", type=int, default=1500, help="candles in a test window")
+    parser.add_argument("--step", type=int, default=None, help="candles the windows move, defaults to --test")
+    parser.add_argument("--anchored", action="store_true", help="grow the train window from the first candle")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    arguments = parser.parse_args()
+
+    stock_meta_data = repository.pass_stock_data(arguments.stock, arguments.resolution, arguments.days)
+    candle_columns = repository.get_candle_columns(repository.get_history_data(stock_meta_data))
+    windows = walk_forward_windows(len(candle_columns["CLOSE"]), arguments.train, arguments.test, arguments.step,
+                                   arguments.anchored)
+    table = walk_forward(candle_columns, windows, range(7, 22, 2), np.arange(1.5, 4.51, 0.5), range(2, 16, 2),
+                         np.round(np.arange(1.01, 1.051, 0.01), 3), max_workers=arguments.workers)
+    print(table.to_string())
+    print(f"Out of sample PnL = {table['test_pnl'].sum()}, trades = {table['test_trades'].sum()}")